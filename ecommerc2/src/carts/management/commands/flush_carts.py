@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from carts.store import get_cart_store
+
+
+class Command(BaseCommand):
+    help = "Writes the carts changed in the cart store since the last run to the database (run it every few minutes)."
+
+    def handle(self, *args, **options):
+        flushed = get_cart_store().flush_dirty()
+        self.stdout.write(self.style.SUCCESS("Flushed %s carts." % flushed))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from carts.purge import purge_carts, purge_sessions
+
+
+class Command(BaseCommand):
+    help = "Deletes abandoned carts (see CART_TTL and CART_EMPTY_TTL) and expired sessions (run it daily)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, dest="batch_size",
+                            help="Carts (and sessions) deleted per transaction.")
+
+    def handle(self, *args, **options):
+        carts = purge_carts(batch_size=options["batch_size"])
+        sessions = purge_sessions(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS("Deleted %s carts and %s sessions." % (carts, sessions)))
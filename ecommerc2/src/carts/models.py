@@ -1,10 +1,27 @@
 from decimal import Decimal
 
 from django.conf import settings
-from django.db import models
+from django.core.cache import caches
+from django.db import connection, models, transaction
+from django.db.models import Count
 from django.db.models.signals import pre_save, post_save, post_delete
+from django.utils import timezone
 
+from ecommerc2.deferred import on_commit_once
 from products.models import Variation
+from products.pricing import price_lines, price_totals
+
+
+CHUNK_SIZE = 500
+SUBTOTAL_SQL = "COALESCE((SELECT SUM(i.line_item_total) FROM {item} i WHERE i.cart_id = {cart}.id), 0)"
+TOTALS_SQL = """
+    UPDATE {cart} SET
+        updated = %s,
+        subtotal = {subtotal},
+        tax_total = ROUND({subtotal} * tax_percentage, 2),
+        total = {subtotal} + ROUND({subtotal} * tax_percentage, 2)
+"""
+TOTAL_SQL = "SELECT {subtotal} + ROUND({subtotal} * tax_percentage, 2) FROM {cart} WHERE id = %s"
 
 
 class CartItem(models.Model):  # as intermediate model
@@ -23,15 +40,66 @@ class CartItem(models.Model):  # as intermediate model
 def cart_item_pre_action_receiver(sender, instance, *args, **kwargs):
     qty = instance.quantity
     if qty >= 1:
-        price = Decimal(instance.item.get_price())
-        line_item_total = price * qty
-        instance.line_item_total = line_item_total
+        line = price_lines([(instance.item_id, qty)])[0]
+        instance.line_item_total = line.line_total
 
 pre_save.connect(cart_item_pre_action_receiver, sender=CartItem)
 
 
+def item_count_key(cart_id):
+    return "carts:count:%s" % cart_id
+
+
+def cache_item_counts(cart_ids):
+    """
+    Counts the lines of the carts with one query and caches them for the
+    cart badge (carts.store.DatabaseCartStore.count), in the cache the
+    sessions are read from; written once the transaction commits. Returns
+    {cart id: count}.
+    """
+    counts = dict.fromkeys(cart_ids, 0)
+    counts.update(CartItem.objects.filter(cart_id__in=cart_ids).values("cart_id").annotate(
+        count=Count("id")).values_list("cart_id", "count"))
+    values = dict((item_count_key(cart_id), count) for cart_id, count in counts.items())
+    timeout = getattr(settings, "CART_STORE_TIMEOUT", 60 * 60 * 24 * 14)
+    transaction.on_commit(lambda: caches["default"].set_many(values, timeout))
+    return counts
+
+
+def update_totals(cart_ids):
+    """
+    Sets subtotal (the sum of the line totals), tax_total and total of the
+    carts with one UPDATE per chunk, computed by the database, and caches
+    their line counts. Touches updated as well, purge_carts goes by it.
+    """
+    subtotal = SUBTOTAL_SQL.format(item=CartItem._meta.db_table, cart=Cart._meta.db_table)
+    sql = TOTALS_SQL.format(cart=Cart._meta.db_table, subtotal=subtotal)
+    cart_ids = list(set(cart_ids))
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        for start in range(0, len(cart_ids), CHUNK_SIZE):
+            chunk = cart_ids[start:start + CHUNK_SIZE]
+            cursor.execute(sql + " WHERE id IN (%s)" % ", ".join(["%s"] * len(chunk)), [now] + chunk)
+            cache_item_counts(chunk)
+
+
+def current_total(cart_id):
+    """
+    The cart's total from its lines in one query, right even while the
+    update_totals of this transaction is still deferred. None without cart.
+    """
+    subtotal = SUBTOTAL_SQL.format(item=CartItem._meta.db_table, cart=Cart._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(TOTAL_SQL.format(cart=Cart._meta.db_table, subtotal=subtotal), [cart_id])
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return Decimal(str(row[0])).quantize(Decimal("0.01"))  # a float on SQLite
+
+
 def cart_item_post_action_receiver(sender, instance, *args, **kwargs):
-    instance.cart.update_subtotal()
+    # once per cart and transaction, however many of its lines changed
+    on_commit_once(update_totals, [instance.cart_id])
 
 post_save.connect(cart_item_post_action_receiver, sender=CartItem)
 post_delete.connect(cart_item_post_action_receiver, sender=CartItem)
@@ -41,7 +109,7 @@ class Cart(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True)
     items = models.ManyToManyField(Variation, through=CartItem)
     timestamp = models.DateTimeField(auto_now_add=True, auto_now=False)
-    updated = models.DateTimeField(auto_now_add=False, auto_now=True)
+    updated = models.DateTimeField(auto_now_add=False, auto_now=True, db_index=True)
     tax_percentage = models.DecimalField(max_digits=5, decimal_places=5, default=0.085)
     subtotal = models.DecimalField(max_digits=30, decimal_places=2, default=0.00)
     tax_total = models.DecimalField(max_digits=30, decimal_places=2, default=0.00)
@@ -53,19 +121,14 @@ class Cart(models.Model):
         return str(self.id)
 
     def update_subtotal(self):
-        subtotal = 0
-        cart_item_totals = self.cartitem_set.all()
-        for cart_item in cart_item_totals:
-            subtotal += cart_item.line_item_total
-        self.subtotal = "{0:.2f}".format(subtotal)
-        self.save()
+        update_totals([self.id])
+        self.refresh_from_db(fields=["subtotal", "tax_total", "total"])
 
 
 def do_tax_and_receiver(sender, instance, *args, **kwargs):
-    subtotal = Decimal(instance.subtotal)
-    tax_total = round(subtotal * Decimal(instance.tax_percentage), 2)
-    instance.tax_total = "{0:.2f}".format(tax_total)
-    instance.total = "{0:.2f}".format(round(tax_total+subtotal, 2))
+    totals = price_totals(instance.subtotal, instance.tax_percentage)
+    instance.tax_total = totals["tax_total"]
+    instance.total = totals["total"]
 
 # Connected with pre_save because it doesnt need to be saved (as it would be in post_)
 pre_save.connect(do_tax_and_receiver, sender=Cart)
\ No newline at end of file
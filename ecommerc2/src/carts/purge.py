@@ -0,0 +1,90 @@
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Cart, CartItem
+from .store import get_cart_store
+
+
+DELETE_SQL = "DELETE FROM {table} WHERE {column} IN (%s)"
+
+
+def get_cart_ttl():
+    # seconds since the last change after which a cart nobody ordered is deleted
+    return getattr(settings, "CART_TTL", 60 * 60 * 24 * 30)
+
+
+def get_empty_cart_ttl():
+    return getattr(settings, "CART_EMPTY_TTL", 60 * 60 * 24)
+
+
+def delete_carts(cart_ids):
+    """
+    Deletes the carts of cart_ids without an order, their lines first, with
+    one DELETE per table instead of the collector's row by row signals.
+    Returns how many carts went.
+    """
+    with transaction.atomic():
+        # the carts an order got meanwhile stay
+        cart_ids = list(Cart.objects.filter(id__in=cart_ids, order__isnull=True).select_for_update(
+            ).values_list("id", flat=True))
+        if not cart_ids:
+            return 0
+        placeholders = ", ".join(["%s"] * len(cart_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(DELETE_SQL.format(table=CartItem._meta.db_table, column="cart_id") % placeholders,
+                           cart_ids)
+            cursor.execute(DELETE_SQL.format(table=Cart._meta.db_table, column="id") % placeholders, cart_ids)
+    get_cart_store().discard(cart_ids)
+    return len(cart_ids)
+
+
+def purge_carts(batch_size=500, now=None):
+    """
+    Deletes the carts without an order not changed for get_cart_ttl()
+    seconds, the empty ones after get_empty_cart_ttl() already; batch_size
+    carts per transaction, picked oldest first by the Cart.updated index, so
+    no lock is held for long. Returns the number of carts deleted.
+    """
+    now = now or timezone.now()
+    store = get_cart_store()
+    store.flush_dirty()  # the store's changes count as changes
+    purged = 0
+    kept = set()  # changed in the store but not flushed yet
+    for queryset in (
+            Cart.objects.filter(updated__lt=now - timedelta(seconds=get_empty_cart_ttl()),
+                                cartitem__isnull=True),
+            Cart.objects.filter(updated__lt=now - timedelta(seconds=get_cart_ttl()))):
+        queryset = queryset.filter(order__isnull=True).order_by("updated")
+        while True:
+            ids = list(queryset.exclude(id__in=kept).values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            dirty = store.is_dirty(ids)
+            kept.update(dirty)
+            purged += delete_carts([cart_id for cart_id in ids if cart_id not in dirty])
+    return purged
+
+
+def purge_sessions(batch_size=500, now=None):
+    """
+    Deletes the expired sessions, batch_size per transaction when they are
+    kept in the database; other engines clear their own. Returns how many
+    rows were deleted (0 for the other engines).
+    """
+    if settings.SESSION_ENGINE not in ("django.contrib.sessions.backends.db",
+                                       "django.contrib.sessions.backends.cached_db"):
+        import_module(settings.SESSION_ENGINE).SessionStore.clear_expired()
+        return 0
+    now = now or timezone.now()
+    purged = 0
+    while True:
+        keys = list(Session.objects.filter(expire_date__lt=now).order_by("expire_date").values_list(
+            "session_key", flat=True)[:batch_size])
+        if not keys:
+            return purged
+        purged += Session.objects.filter(session_key__in=keys).delete()[0]
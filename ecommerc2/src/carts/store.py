@@ -0,0 +1,303 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from products.models import Variation
+from products.pricing import price_lines, price_totals
+from .models import Cart, CartItem, cache_item_counts, item_count_key, update_totals
+
+
+CHUNK_SIZE = 500
+LOG_COUNTER_KEY = "carts:store:log:last"  # last position given out
+LOG_SEEN_KEY = "carts:store:log:seen"     # the counter at the last flush_dirty()
+LOG_DONE_KEY = "carts:store:log:done"     # positions flushed so far
+
+
+def load_state(cart_id):
+    """
+    A cart as the stores keep it, read from the tables: {"user_id",
+    "tax_percentage", "lines": {variation id: quantity}} in line order, or
+    None when there is no such cart.
+    """
+    cart = Cart.objects.filter(id=cart_id).values("user_id", "tax_percentage").first()
+    if cart is None:
+        return None
+    cart["lines"] = dict(CartItem.objects.filter(cart_id=cart_id).order_by("id").values_list(
+        "item_id", "quantity"))
+    return cart
+
+
+@transaction.atomic
+def write_state(cart_id, state):
+    # makes the Cart and CartItem rows match the state, changed rows only
+    # the UPDATE locks the cart row, and tells whether the cart still exists
+    if not Cart.objects.filter(id=cart_id).update(user_id=state["user_id"]):
+        return False
+    lines = dict((line.variation_id, line) for line in price_lines(state["lines"].items()))
+    current = dict((item_id, (pk, quantity)) for pk, item_id, quantity in CartItem.objects.filter(
+        cart_id=cart_id).values_list("id", "item_id", "quantity"))
+    CartItem.objects.filter(cart_id=cart_id).exclude(item_id__in=lines).delete()
+    for variation_id, line in lines.items():
+        if variation_id in current and current[variation_id][1] != line.quantity:
+            CartItem.objects.filter(id=current[variation_id][0]).update(
+                quantity=line.quantity, line_item_total=line.line_total)
+    CartItem.objects.bulk_create([
+        CartItem(cart_id=cart_id, item_id=variation_id, quantity=line.quantity,
+                 line_item_total=line.line_total)
+        for variation_id, line in lines.items() if variation_id not in current])
+    # CartItem signals did not run, so the totals are set here
+    update_totals([cart_id])
+    return True
+
+
+def summarize(cart_id, state):
+    """
+    (cart, lines) for the cart page: an unsaved Cart with the current
+    totals and a (CartItem, products.pricing.PriceLine) pair per line, from
+    the state (None for no cart yet) and two queries for the variations.
+    """
+    if state is None:
+        state = {"user_id": None, "tax_percentage": Cart._meta.get_field("tax_percentage").default,
+                 "lines": {}}
+    cart = Cart(id=cart_id, user_id=state["user_id"], tax_percentage=state["tax_percentage"])
+    variations = Variation.objects.filter(id__in=state["lines"]).select_related("product").in_bulk()
+    lines = []
+    for line in price_lines(state["lines"].items()):
+        item = CartItem(cart=cart, item=variations[line.variation_id], quantity=line.quantity,
+                        line_item_total=line.line_total)
+        lines.append((item, line))
+    totals = price_totals(sum((line.line_total for _, line in lines), Decimal("0.00")),
+                          cart.tax_percentage)
+    cart.subtotal, cart.tax_total, cart.total = totals["subtotal"], totals["tax_total"], totals["total"]
+    return cart, lines
+
+
+class BaseCartStore(object):
+    """
+    Where the lines of a cart live between page views. The cart pages read
+    and change carts only through the store; flush() makes the Cart and
+    CartItem rows match it, checkout (orders.mixins.CartOrderMixin) flushes
+    before it reads them.
+    """
+    def create(self, user_id=None):
+        return Cart.objects.create(user_id=user_id).id
+
+    def get(self, cart_id):
+        # state (see load_state) or None
+        raise NotImplementedError
+
+    def set_quantity(self, cart_id, variation_id, quantity):
+        # quantity < 1 removes the line; returns True when the line is new
+        raise NotImplementedError
+
+    def count(self, cart_id):
+        # lines in the cart, for the cart badge
+        state = self.get(cart_id)
+        return len(state["lines"]) if state is not None else 0
+
+    def set_quantities(self, cart_id, quantities):
+        # {variation id: quantity} in one go; returns the ids of the new lines
+        with transaction.atomic():
+            return set(variation_id for variation_id, quantity in quantities.items()
+                       if self.set_quantity(cart_id, variation_id, quantity))
+
+    def set_user(self, cart_id, user_id):
+        raise NotImplementedError
+
+    def flush(self, cart_id):
+        pass
+
+    def discard(self, cart_ids):
+        # forgets carts deleted from the tables
+        pass
+
+    def is_dirty(self, cart_ids):
+        # those of cart_ids with changes not flushed yet
+        return set()
+
+    def flush_dirty(self):
+        # flushes the carts changed since the last run, returns how many
+        return 0
+
+
+class DatabaseCartStore(BaseCartStore):
+    """
+    No store at all, every change goes to the tables right away (the
+    CartItem signals keep the totals).
+    """
+    def get(self, cart_id):
+        return load_state(cart_id)
+
+    def count(self, cart_id):
+        # kept in the cache by update_totals, which runs whenever lines change
+        count = caches["default"].get(item_count_key(cart_id))
+        if count is None:
+            count = cache_item_counts([cart_id])[cart_id]
+        return count
+
+    def set_quantity(self, cart_id, variation_id, quantity):
+        if quantity < 1:
+            for cart_item in CartItem.objects.filter(cart_id=cart_id, item_id=variation_id):
+                cart_item.delete()
+            return False
+        cart_item, created = CartItem.objects.get_or_create(
+            cart_id=cart_id, item_id=variation_id, defaults={"quantity": quantity})
+        if not created and cart_item.quantity != quantity:
+            cart_item.quantity = quantity
+            cart_item.save()
+        return created
+
+    def set_user(self, cart_id, user_id):
+        Cart.objects.filter(id=cart_id).update(user_id=user_id)
+
+    def discard(self, cart_ids):
+        caches["default"].delete_many([item_count_key(cart_id) for cart_id in cart_ids])
+
+
+class CacheCartStore(BaseCartStore):
+    """
+    Carts in the CART_STORE_CACHE cache: reading or changing a cart costs
+    no query, the tables are written by flush() only (at checkout and by the
+    flush_carts command for the carts changed since). Carts missing from the
+    cache are loaded from the tables, so the cache must keep them at least
+    until flushed: use one shared by all processes, large enough and with
+    an atomic incr() (memcached, redis).
+
+    A changed cart gets a dirty mark of its own and, unless it had one, an
+    entry in a numbered log (an incr()'ed counter) which flush_dirty() goes
+    through; no key is shared by all carts but the counter.
+    """
+    def __init__(self):
+        self.cache = caches[getattr(settings, "CART_STORE_CACHE", "default")]
+        self.timeout = getattr(settings, "CART_STORE_TIMEOUT", 60 * 60 * 24 * 14)
+
+    def key(self, cart_id):
+        return "carts:store:%s" % cart_id
+
+    def dirty_key(self, cart_id):
+        return "carts:store:dirty:%s" % cart_id
+
+    def log_key(self, position):
+        return "carts:store:log:entry:%s" % position
+
+    def get(self, cart_id):
+        state = self.cache.get(self.key(cart_id))
+        if state is None:
+            state = load_state(cart_id)
+            if state is not None:
+                self.cache.set(self.key(cart_id), state, self.timeout)
+        return state
+
+    def save(self, cart_id, state):
+        # state first: a flush clearing the mark meanwhile reads it afterwards
+        self.cache.set(self.key(cart_id), state, self.timeout)
+        if self.cache.get(self.dirty_key(cart_id)) is None:
+            self.mark(cart_id)
+
+    def mark(self, cart_id):
+        # logged before marked: a process dying in between leaves it unmarked, not unlogged
+        self.cache.set(self.log_key(self.next_position()), cart_id, None)
+        self.cache.set(self.dirty_key(cart_id), True, None)
+
+    def next_position(self):
+        try:
+            return self.cache.incr(LOG_COUNTER_KEY)
+        except ValueError:  # not in cache
+            self.cache.add(LOG_COUNTER_KEY, 0, None)
+            return self.cache.incr(LOG_COUNTER_KEY)
+
+    def is_dirty(self, cart_ids):
+        found = self.cache.get_many([self.dirty_key(cart_id) for cart_id in cart_ids])
+        return set(cart_id for cart_id in cart_ids if self.dirty_key(cart_id) in found)
+
+    def set_quantity(self, cart_id, variation_id, quantity):
+        state = self.get(cart_id)
+        created = variation_id not in state["lines"]
+        if quantity < 1:
+            if created:
+                return False
+            del state["lines"][variation_id]
+        elif state["lines"].get(variation_id) == quantity:
+            return False
+        else:
+            state["lines"][variation_id] = quantity
+        self.save(cart_id, state)
+        return created and quantity >= 1
+
+    def set_quantities(self, cart_id, quantities):
+        state = self.get(cart_id)
+        created = set()
+        for variation_id, quantity in quantities.items():
+            if quantity < 1:
+                state["lines"].pop(variation_id, None)
+            else:
+                if variation_id not in state["lines"]:
+                    created.add(variation_id)
+                state["lines"][variation_id] = quantity
+        self.save(cart_id, state)
+        return created
+
+    def set_user(self, cart_id, user_id):
+        state = self.get(cart_id)
+        state["user_id"] = user_id
+        self.save(cart_id, state)
+
+    def flush(self, cart_id):
+        if self.cache.get(self.key(cart_id)) is None:
+            return  # never loaded or changed, the tables are current
+        try:
+            with transaction.atomic():
+                # the row lock orders concurrent flushes, the last one reads the
+                # newest state; a change after the mark is cleared marks it again
+                if not Cart.objects.filter(id=cart_id).update(updated=timezone.now()):
+                    self.discard([cart_id])  # purged
+                    return
+                self.cache.delete(self.dirty_key(cart_id))
+                state = self.cache.get(self.key(cart_id))
+                if state is not None:
+                    write_state(cart_id, state)
+        except Exception:
+            self.mark(cart_id)  # for the next flush_dirty()
+            raise
+
+    def discard(self, cart_ids):
+        self.cache.delete_many([self.key(cart_id) for cart_id in cart_ids] +
+                               [self.dirty_key(cart_id) for cart_id in cart_ids])
+
+    def flush_dirty(self):
+        """
+        Flushes the carts logged up to the counter as the previous run saw
+        it: an entry whose incr() happened before then is written by now,
+        or never will be (its process died), so none is skipped while still
+        on its way. The newest ones wait for the next run.
+        """
+        done = self.cache.get(LOG_DONE_KEY, 0)
+        seen = self.cache.get(LOG_SEEN_KEY, 0)
+        end = self.cache.get(LOG_COUNTER_KEY, 0)
+        if end < seen:  # the counter was lost, it starts over
+            done = seen = 0
+        flushed = set()
+        for start in range(done + 1, seen + 1, CHUNK_SIZE):
+            keys = [self.log_key(position) for position in range(start, min(start + CHUNK_SIZE, seen + 1))]
+            for cart_id in set(self.cache.get_many(keys).values()) - flushed:
+                self.flush(cart_id)
+                flushed.add(cart_id)
+            self.cache.delete_many(keys)
+            self.cache.set(LOG_DONE_KEY, start + len(keys) - 1, None)
+        self.cache.set_many({LOG_DONE_KEY: seen, LOG_SEEN_KEY: end}, None)
+        return len(flushed)
+
+
+def get_cart_store():
+    return import_string(getattr(settings, "CART_STORE", "carts.store.DatabaseCartStore"))()
+
+
+def get_cart_item_count(request):
+    cart_id = request.session.get("cart_id")
+    if cart_id is None:
+        return 0
+    return get_cart_store().count(cart_id)
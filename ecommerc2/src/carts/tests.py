@@ -1,3 +1,350 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.urlresolvers import reverse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from orders.models import Order
+from products.models import Product, Variation
+from products.versions import get_catalog_cache
+from . import store as cart_store
+from .models import Cart, CartItem, update_totals
+from .purge import purge_carts, purge_sessions
+from .store import CacheCartStore, DatabaseCartStore, get_cart_store
+from .views import CartBatchView
+
+
+# the cache store in a cache of the test process only, never the configured one
+cache_store_settings = override_settings(
+    CACHES=dict(settings.CACHES, carts={"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                        "LOCATION": "carts-tests"}),
+    CART_STORE_CACHE="carts",
+    CART_STORE="carts.store.CacheCartStore",
+)
+
+
+class CartTestMixin(object):
+    def setUp(self):
+        super(CartTestMixin, self).setUp()
+        caches["carts"].clear()
+        # stock and line counts, ids come again after a rollback
+        get_catalog_cache().clear()
+        caches["default"].clear()
+        self.mug = Product.objects.create(title="Mug", price=10).variation_set.first()
+        self.cup = Product.objects.create(title="Cup", price="2.50").variation_set.first()
+
+    def lines(self, cart_id):
+        return dict(CartItem.objects.filter(cart_id=cart_id).values_list("item_id", "quantity"))
+
+
+@cache_store_settings
+class CacheCartStoreTests(CartTestMixin, TestCase):
+    def setUp(self):
+        super(CacheCartStoreTests, self).setUp()
+        self.store = CacheCartStore()
+        self.cart_id = self.store.create()
+
+    def test_changes_stay_in_the_cache_until_flushed(self):
+        self.store.get(self.cart_id)
+        with self.assertNumQueries(0):
+            self.store.set_quantity(self.cart_id, self.mug.id, 2)
+            self.store.set_quantity(self.cart_id, self.cup.id, 1)
+            self.assertEqual(self.store.count(self.cart_id), 2)
+        self.assertEqual(self.lines(self.cart_id), {})
+        self.assertEqual(self.store.is_dirty([self.cart_id]), set([self.cart_id]))
+
+        self.store.flush(self.cart_id)
+        self.assertEqual(self.lines(self.cart_id), {self.mug.id: 2, self.cup.id: 1})
+        self.assertEqual(Cart.objects.get(id=self.cart_id).subtotal, Decimal("22.50"))
+        self.assertEqual(self.store.is_dirty([self.cart_id]), set())
+
+    def test_flush_writes_changed_lines_only(self):
+        self.store.set_quantities(self.cart_id, {self.mug.id: 2, self.cup.id: 1})
+        self.store.flush(self.cart_id)
+        mug_line = CartItem.objects.get(cart_id=self.cart_id, item=self.mug).id
+        self.store.set_quantities(self.cart_id, {self.mug.id: 3, self.cup.id: 0})
+        self.store.flush(self.cart_id)
+        self.assertEqual(self.lines(self.cart_id), {self.mug.id: 3})
+        self.assertEqual(CartItem.objects.get(cart_id=self.cart_id).id, mug_line)
+        self.assertEqual(Cart.objects.get(id=self.cart_id).subtotal, Decimal("30.00"))
+
+    def test_a_change_during_the_flush_is_not_lost(self):
+        self.store.set_quantity(self.cart_id, self.mug.id, 1)
+        write_state = cart_store.write_state
+
+        def write_and_change(cart_id, state):
+            # another request, after the mark is cleared and the state is read
+            CacheCartStore().set_quantity(cart_id, self.mug.id, 5)
+            return write_state(cart_id, state)
+
+        with mock.patch.object(cart_store, "write_state", write_and_change):
+            self.store.flush(self.cart_id)
+        self.assertEqual(self.lines(self.cart_id), {self.mug.id: 1})
+        self.assertEqual(self.store.is_dirty([self.cart_id]), set([self.cart_id]))
+        self.store.flush(self.cart_id)
+        self.assertEqual(self.lines(self.cart_id), {self.mug.id: 5})
+
+    def test_a_failed_flush_stays_dirty(self):
+        self.store.set_quantity(self.cart_id, self.mug.id, 1)
+        with mock.patch.object(cart_store, "write_state", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.store.flush(self.cart_id)
+        self.assertEqual(self.store.is_dirty([self.cart_id]), set([self.cart_id]))
+        self.assertEqual(self.store.flush_dirty(), 0)
+        self.assertEqual(self.store.flush_dirty(), 1)
+        self.assertEqual(self.lines(self.cart_id), {self.mug.id: 1})
+
+    def test_flush_dirty_takes_the_carts_logged_before_its_last_run(self):
+        other_id = self.store.create()
+        self.store.set_quantity(self.cart_id, self.mug.id, 1)
+        self.store.set_quantity(self.cart_id, self.mug.id, 2)  # logged once
+        self.assertEqual(self.store.flush_dirty(), 0)
+        self.store.set_quantity(other_id, self.cup.id, 1)
+
+        self.assertEqual(self.store.flush_dirty(), 1)
+        self.assertEqual(self.lines(self.cart_id), {self.mug.id: 2})
+        self.assertEqual(self.lines(other_id), {})
+        self.assertEqual(self.store.flush_dirty(), 1)
+        self.assertEqual(self.lines(other_id), {self.cup.id: 1})
+        self.assertEqual(self.store.flush_dirty(), 0)
+
+    def test_flush_dirty_after_the_log_counter_was_lost(self):
+        self.store.set_quantity(self.cart_id, self.mug.id, 1)
+        self.store.flush_dirty()
+        caches["carts"].delete(cart_store.LOG_COUNTER_KEY)
+        self.store.flush(self.cart_id)
+        self.store.set_quantity(self.cart_id, self.mug.id, 4)
+        self.assertEqual(self.store.flush_dirty() + self.store.flush_dirty(), 1)
+        self.assertEqual(self.lines(self.cart_id), {self.mug.id: 4})
+
+    def test_flushing_a_deleted_cart_forgets_it(self):
+        self.store.set_quantity(self.cart_id, self.mug.id, 1)
+        Cart.objects.filter(id=self.cart_id).delete()
+        self.store.flush(self.cart_id)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertIsNone(self.store.get(self.cart_id))
+        self.assertEqual(self.store.is_dirty([self.cart_id]), set())
+
+    def test_carts_missing_from_the_cache_are_loaded_from_the_tables(self):
+        self.store.set_quantity(self.cart_id, self.mug.id, 3)
+        self.store.flush(self.cart_id)
+        caches["carts"].clear()
+        self.assertEqual(self.store.get(self.cart_id)["lines"], {self.mug.id: 3})
+
+
+class CartTotalsTests(CartTestMixin, TestCase):
+    def test_totals_are_computed_by_the_database(self):
+        cart = Cart.objects.create(tax_percentage=Decimal("0.085"))
+        CartItem.objects.create(cart=cart, item=self.mug, quantity=3)
+        CartItem.objects.create(cart=cart, item=self.cup, quantity=1)
+        empty = Cart.objects.create()
+        Cart.objects.filter(id=empty.id).update(subtotal=5, total=5)
+
+        with self.assertNumQueries(2):  # the totals, the line counts
+            update_totals([cart.id, empty.id, cart.id])
+        self.assertEqual(Cart.objects.filter(id=cart.id).values_list("subtotal", "tax_total", "total").get(),
+                         (Decimal("32.50"), Decimal("2.76"), Decimal("35.26")))
+        self.assertEqual(Cart.objects.filter(id=empty.id).values_list("subtotal", "tax_total", "total").get(),
+                         (Decimal("0.00"), Decimal("0.00"), Decimal("0.00")))
+
+    def test_update_subtotal_refreshes_the_instance(self):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, item=self.cup, quantity=2)
+        cart.update_subtotal()
+        self.assertEqual((cart.subtotal, cart.total), (Decimal("5.00"), Decimal("5.43")))
+
+
+class CartBatchTests(CartTestMixin, TestCase):
+    def setUp(self):
+        super(CartBatchTests, self).setUp()
+        Variation.objects.filter(id=self.cup.id).update(inventory_size=3)
+
+    def post(self, operations):
+        response = self.client.post(reverse("cart_batch"), json.dumps({"operations": operations}),
+                                    content_type="application/json")
+        return response, json.loads(response.content.decode("utf-8"))
+
+    def cart_lines(self):
+        cart_id = self.client.session.get("cart_id")
+        return self.lines(cart_id) if cart_id is not None else {}
+
+    def test_applies_every_operation(self):
+        self.post([{"item": self.mug.id, "qty": 1}])
+        response, data = self.post([{"item": self.cup.id, "qty": "2"}, {"item": str(self.mug.id), "delete": True}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart_lines(), {self.cup.id: 2})
+        self.assertEqual([(item["item"], item["item_added"], item["deleted"]) for item in data["items"]],
+                         [(self.cup.id, True, False), (self.mug.id, False, True)])
+        self.assertEqual((data["subtotal"], data["total_items"]), ("5.00", 1))
+
+    def test_the_last_operation_on_an_item_wins(self):
+        self.post([{"item": self.mug.id, "qty": 1}, {"item": self.mug.id, "qty": 4}])
+        self.assertEqual(self.cart_lines(), {self.mug.id: 4})
+
+    def test_quantities_are_capped_to_the_stock(self):
+        response, data = self.post([{"item": self.cup.id, "qty": 5}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart_lines(), {self.cup.id: 3})
+        self.assertEqual(data["items"][0]["qty"], 3)
+        self.assertTrue(data["items"][0]["warning"])
+
+    def test_an_invalid_operation_changes_nothing(self):
+        self.post([{"item": self.mug.id, "qty": 1}])
+        response, data = self.post([{"item": self.cup.id, "qty": 1}, {"item": self.mug.id, "qty": "many"}, 7])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(data["errors"]), ["1", "2"])
+        self.assertEqual(self.cart_lines(), {self.mug.id: 1})
+
+    def test_an_unknown_item_changes_nothing(self):
+        response, data = self.post([{"item": self.mug.id, "qty": 1}, {"item": 0, "qty": 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(data["errors"]), ["0"])
+        self.assertNotIn("cart_id", self.client.session)
+
+    def test_an_item_out_of_stock_changes_nothing(self):
+        Variation.objects.filter(id=self.cup.id).update(inventory_size=0)
+        response, data = self.post([{"item": self.mug.id, "qty": 1}, {"item": self.cup.id, "qty": 1}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(list(data["errors"]), [str(self.cup.id)])
+        self.assertEqual(self.cart_lines(), {})
+
+    def test_a_failure_while_applying_rolls_back(self):
+        self.post([{"item": self.mug.id, "qty": 1}])
+        set_quantity = DatabaseCartStore.set_quantity
+
+        def fail_on_the_cup(store, cart_id, variation_id, quantity):
+            if variation_id == self.cup.id:
+                raise RuntimeError
+            return set_quantity(store, cart_id, variation_id, quantity)
+
+        with mock.patch.object(DatabaseCartStore, "set_quantity", fail_on_the_cup):
+            with self.assertRaises(RuntimeError):
+                self.post([{"item": self.mug.id, "qty": 5}, {"item": self.cup.id, "qty": 1}])
+        self.assertEqual(self.cart_lines(), {self.mug.id: 1})
+
+    def test_bad_requests(self):
+        response = self.client.post(reverse("cart_batch"), "{", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response, data = self.post([])
+        self.assertEqual(response.status_code, 400)
+        response, data = self.post([{"item": self.mug.id}] * (CartBatchView.max_operations + 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse("cart_batch")).status_code, 405)
+
+
+@cache_store_settings
+class CacheCartBatchTests(CartBatchTests):
+    def cart_lines(self):
+        cart_id = self.client.session.get("cart_id")
+        if cart_id is None:
+            return {}
+        return get_cart_store().get(cart_id)["lines"]
+
+    def test_a_failure_while_applying_rolls_back(self):
+        # the whole batch is one set() of the cart's state
+        self.post([{"item": self.mug.id, "qty": 1}])
+        with mock.patch.object(caches["carts"], "set", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post([{"item": self.mug.id, "qty": 5}, {"item": self.cup.id, "qty": 1}])
+        self.assertEqual(self.cart_lines(), {self.mug.id: 1})
+
+
+@override_settings(CART_STORE="carts.store.DatabaseCartStore")
+class ItemCountTests(CartTestMixin, TransactionTestCase):
+    # committed, as in production, so the deferred line counts are written
+    def count(self):
+        response = self.client.get(reverse("item_count"), HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        return response, json.loads(response.content.decode("utf-8"))["cart_item_count"]
+
+    def test_without_a_cart(self):
+        response, count = self.count()
+        self.assertEqual(count, 0)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_count_costs_no_query(self):
+        self.client.get(reverse("cart"), {"item": self.mug.id, "qty": 2})
+        self.client.get(reverse("cart"), {"item": self.cup.id, "qty": 1})
+        with self.assertNumQueries(0):
+            response, count = self.count()
+        self.assertEqual(count, 2)
+
+    def test_count_follows_removed_lines(self):
+        self.client.get(reverse("cart"), {"item": self.mug.id, "qty": 2})
+        self.client.get(reverse("cart"), {"item": self.cup.id, "qty": 1})
+        self.client.get(reverse("cart"), {"item": self.mug.id, "delete": True})
+        with self.assertNumQueries(0):
+            response, count = self.count()
+        self.assertEqual(count, 1)
+
+    def test_only_for_ajax(self):
+        self.assertEqual(self.client.get(reverse("item_count")).status_code, 404)
+
+
+@cache_store_settings
+class CacheItemCountTests(ItemCountTests):
+    pass
+
+
+class LazyCartTests(CartTestMixin, TestCase):
+    def test_looking_at_the_cart_creates_nothing(self):
+        response = self.client.get(reverse("cart"))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Cart.objects.exists())
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_the_first_item_creates_the_cart(self):
+        self.client.get(reverse("cart"), {"item": self.mug.id, "delete": True})
+        self.assertFalse(Cart.objects.exists())
+        self.client.get(reverse("cart"), {"item": self.mug.id, "qty": 1})
+        self.assertEqual(Cart.objects.get().id, self.client.session["cart_id"])
+
+
+class PurgeTests(CartTestMixin, TestCase):
+    def cart(self, days_ago, lines=0):
+        cart = Cart.objects.create()
+        if lines:
+            CartItem.objects.create(cart=cart, item=self.mug, quantity=lines)
+        Cart.objects.filter(id=cart.id).update(updated=timezone.now() - timedelta(days=days_ago))
+        return cart.id
+
+    def remaining(self):
+        return set(Cart.objects.values_list("id", flat=True))
+
+    def test_abandoned_carts_go_empty_ones_first(self):
+        fresh, empty, old_empty, full, old_full = (
+            self.cart(0), self.cart(0.5), self.cart(2), self.cart(2, lines=1), self.cart(31, lines=1))
+        self.assertEqual(purge_carts(batch_size=1), 2)
+        self.assertEqual(self.remaining(), set([fresh, empty, full]))
+        self.assertEqual(CartItem.objects.filter(cart_id=old_full).count(), 0)
+
+    def test_ordered_carts_stay(self):
+        cart_id = self.cart(60, lines=1)
+        Order.objects.create(cart_id=cart_id)
+        self.assertEqual(purge_carts(), 0)
+        self.assertEqual(self.remaining(), set([cart_id]))
+
+    @cache_store_settings
+    def test_carts_changed_in_the_store_stay(self):
+        store = get_cart_store()
+        changed, abandoned = self.cart(60, lines=1), self.cart(60, lines=1)
+        for cart_id in (changed, abandoned):
+            store.get(cart_id)
+        store.set_quantity(changed, self.cup.id, 1)
+        self.assertEqual(purge_carts(), 1)
+        self.assertEqual(self.remaining(), set([changed]))
+        self.assertIsNone(store.get(abandoned))
+
+    def test_expired_sessions(self):
+        now = timezone.now()
+        for number, days in enumerate((-1, 1, 2)):
+            Session.objects.create(session_key="session%s" % number, session_data="",
+                                   expire_date=now + timedelta(days=days))
+        self.assertEqual(purge_sessions(batch_size=1, now=now), 1)
+        self.assertEqual(set(Session.objects.values_list("session_key", flat=True)),
+                         set(["session1", "session2"]))
@@ -1,19 +1,26 @@
+import json
+from collections import OrderedDict
+
 import braintree
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.forms import AuthenticationForm
 from django.core.urlresolvers import reverse
+from django.db import transaction
 from django.http import Http404, JsonResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render, redirect
 from django.views.generic.base import View
-from django.views.generic.detail import SingleObjectMixin, DetailView
+from django.views.generic.detail import DetailView
 from django.views.generic.edit import FormMixin
 
 from orders.forms import GuestCheckForm
 from orders.mixins import CartOrderMixin
 from orders.models import UserCheckout
+from orders.reservations import OutOfStock, commit_reservations, release_reservations, reserve_order
+from products.inventory import get_availability
 from products.models import Variation
-from .models import Cart, CartItem
+from .models import Cart
+from .store import get_cart_item_count, get_cart_store, summarize
 
 if settings.DEBUG:
     braintree.Configuration.configure(
@@ -27,42 +34,43 @@ if settings.DEBUG:
 class ItemCountView(View):
     def get(self, request, *args, **kwargs):
         if request.is_ajax():
-            cart_item_count = 0
-            cart_id = self.request.session.get("cart_id")
-            if cart_id is not None:
-                cart = Cart.objects.get(id=cart_id)
-                cart_item_count = cart.items.count()
-
-            # when we set it, it wont flip from 0 to c.i.c
-            request.session["cart_item_count"] = cart_item_count
-            return JsonResponse({"cart_item_count": cart_item_count})  # cart-count-badge
+            # from the cart store, no query and nothing written to the session
+            return JsonResponse({"cart_item_count": get_cart_item_count(request)})  # cart-count-badge
         raise Http404
 
 
-class CartView(SingleObjectMixin, View):
-    model = Cart
+class CartView(View):
     template_name = "carts/view.html"
 
-    def get_object(self, *args, **kwargs):
-        self.request.session.set_expiry(0)  # as long as u not close browser
+    def get_cart_id(self, create=False):
+        # reads and changes go through the cart store (carts.store), not the
+        # tables; None until the first item is added (create), so visitors
+        # who only look at the cart leave no cart row and no session behind
+        store = get_cart_store()
         cart_id = self.request.session.get("cart_id")
-
-        cart = Cart.objects.get_or_create(id=cart_id)[0]
-        if cart_id is None:
-            self.request.session["cart_id"] = cart.id
+        state = store.get(cart_id) if cart_id is not None else None
+        if state is None and not create:
+            return None
+        if not self.request.session.get_expire_at_browser_close():
+            self.request.session.set_expiry(0)  # as long as u not close browser
 
         user = self.request.user
-        if user.is_authenticated():
-            cart.user = user
-            cart.save()
-        return cart
+        user_id = user.pk if user.is_authenticated() else None
+        if state is None:
+            cart_id = store.create(user_id)
+            self.request.session["cart_id"] = cart_id
+        elif user_id is not None and state["user_id"] != user_id:
+            store.set_user(cart_id, user_id)
+        return cart_id
 
     def get(self, request, *args, **kwargs):
-        cart = self.get_object()
+        store = get_cart_store()
+        cart_id = self.get_cart_id()
         item_id = request.GET.get("item")
         delete_item = request.GET.get("delete", False)
         item_added = False
         flash_message = ""
+        warning = None
 
         if item_id:
             item_instance = get_object_or_404(Variation, id=item_id)
@@ -74,68 +82,162 @@ class CartView(SingleObjectMixin, View):
             except:
                 raise Http404
 
-            cart_item, cart_created = CartItem.objects.get_or_create(cart=cart, item=item_instance)
-            if cart_created:
-                flash_message = "Successfully added to the cart."
-                item_added = True
+            available = get_availability([item_instance.id])[item_instance.id]
+            if not delete_item and available is not None and qty > available:
+                if available < 1:
+                    messages.error(request, "%s is out of stock." % item_instance.get_title())
+                    if request.is_ajax():
+                        return JsonResponse({"flash_message": "Out of stock.", "available": 0}, status=409)
+                    return HttpResponseRedirect(reverse("cart"))
+                qty = available
+                warning = "Only %s of %s left." % (available, item_instance.get_title())
+                if not request.is_ajax():
+                    messages.warning(request, warning)
 
             if delete_item:
+                if cart_id is not None:
+                    store.set_quantity(cart_id, item_instance.id, 0)
                 flash_message = "Item removed successfully."
-                cart_item.delete()
+            elif store.set_quantity(cart_id or self.get_cart_id(create=True), item_instance.id, qty):
+                flash_message = "Successfully added to the cart."
+                item_added = True
             else:
-                if not cart_created:
-                    flash_message = "Quantity has been updated successfully."
-                cart_item.quantity = qty
-                cart_item.save()
+                flash_message = "Quantity has been updated successfully."
+            if warning:
+                flash_message = warning
 
             if not request.is_ajax():
                 return HttpResponseRedirect(reverse("cart"))
 
+        cart_id = self.request.session.get("cart_id")
+        cart, lines = summarize(cart_id, store.get(cart_id) if cart_id is not None else None)
         if request.is_ajax():
-            try:
-                line_total = cart_item.line_item_total
-            except:
-                line_total = None
-
-            try:
-                subtotal = cart_item.cart.subtotal  # cart.subtotal // shows prev (???)
-            except:
-                subtotal = None
-
-            try:
-                total_items = cart_item.cart.items.count()
-            except:
-                total_items = 0
-
-            try:
-                tax_total = cart_item.cart.tax_total
-            except:
-                tax_total = None
-
-            try:
-                total = cart_item.cart.total
-            except:
-                total = None
+            line_total = None
+            for cart_item, line in lines:
+                if str(line.variation_id) == item_id:
+                    line_total = line.line_total
 
             data = {
                 "deleted": delete_item,
                 "flash_message": flash_message,
                 "item_added": item_added,
                 "line_total": line_total,
-                "subtotal": subtotal,
-                "tax_total": tax_total,
-                "total": total,
-                "total_items": total_items,
+                "qty": None if delete_item or not item_id else qty,  # less than asked when capped to stock
+                "warning": warning,
             }
+            data.update(cart_totals_data(cart, lines))
             return JsonResponse(data)  # not Del/Add -> Updated
 
         context = {
-            "object": cart,  # self.get_object()
+            "object": cart,
+            "lines": lines,
         }
         template = self.template_name
         return render(request, template, context)
 
 
+def cart_totals_data(cart, lines):
+    return {
+        "subtotal": cart.subtotal,
+        "tax_total": cart.tax_total,
+        "total": cart.total,
+        "total_items": len(lines),
+    }
+
+
+def parse_operations(operations):
+    """
+    [{"item": variation id, "qty": 2}, {"item": id, "delete": true}, ...] ->
+    ({variation id: quantity, 0 to remove}, {operation index: error}), the
+    last operation on an item wins.
+    """
+    quantities, errors = OrderedDict(), {}
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            errors[index] = "Not an object."
+            continue
+        item, qty = operation.get("item"), operation.get("qty", 1)
+        if isinstance(item, str) and item.isdigit():
+            item = int(item)
+        if isinstance(qty, str) and qty.lstrip("-").isdigit():
+            qty = int(qty)
+        if not isinstance(item, int) or isinstance(item, bool):
+            errors[index] = "item must be a variation id."
+        elif not isinstance(qty, int) or isinstance(qty, bool):
+            errors[index] = "qty must be a whole number."
+        else:
+            quantities.pop(item, None)
+            quantities[item] = 0 if operation.get("delete") else max(qty, 0)
+    return quantities, errors
+
+
+class CartBatchView(CartView):
+    """
+    POST {"operations": [{"item": 1, "qty": 2}, {"item": 3, "delete": true}, ...]}
+    as JSON: applies every change to the cart at once, all or nothing, and
+    answers like the AJAX cart update plus an entry per changed item.
+    """
+    http_method_names = ["post"]
+    max_operations = 200
+
+    def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body.decode("utf-8"))
+        except ValueError:
+            data = None
+        operations = data.get("operations") if isinstance(data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            return JsonResponse({"error": "No operations given."}, status=400)
+        if len(operations) > self.max_operations:
+            return JsonResponse({"error": "At most %s operations per request." % self.max_operations},
+                                status=400)
+
+        # errors by operation index, then by item; nothing is changed when there are any
+        quantities, errors = parse_operations(operations)
+        if errors:
+            return JsonResponse({"errors": errors, "flash_message": "Nothing has been changed."}, status=400)
+        variations = Variation.objects.filter(id__in=quantities).select_related("product").in_bulk()
+        available = get_availability(variations)
+        status, warnings = 400, {}
+        for variation_id, qty in quantities.items():
+            if variation_id not in variations:
+                errors[variation_id] = "No such item."
+            elif qty and available[variation_id] is not None and qty > available[variation_id]:
+                if available[variation_id] < 1:
+                    errors[variation_id] = "%s is out of stock." % variations[variation_id].get_title()
+                    status = 409
+                else:
+                    quantities[variation_id] = available[variation_id]
+                    warnings[variation_id] = "Only %s of %s left." % (
+                        available[variation_id], variations[variation_id].get_title())
+        if errors:
+            return JsonResponse({"errors": errors, "flash_message": "Nothing has been changed."},
+                                status=status)
+
+        store = get_cart_store()
+        cart_id = self.get_cart_id(create=any(quantities.values()))
+        added = store.set_quantities(cart_id, quantities) if cart_id is not None else set()
+        cart, lines = summarize(cart_id, store.get(cart_id) if cart_id is not None else None)
+        line_totals = dict((line.variation_id, line.line_total) for _, line in lines)
+        items = [{
+            "item": variation_id,
+            "qty": qty,
+            "deleted": not qty,
+            "item_added": variation_id in added,
+            "line_total": line_totals.get(variation_id),
+            "warning": warnings.get(variation_id),
+        } for variation_id, qty in quantities.items()]
+        data = {
+            "deleted": any(item["deleted"] for item in items),
+            "flash_message": "Your cart has been updated.",
+            "item_added": bool(added),
+            "line_total": None,
+            "items": items,
+        }
+        data.update(cart_totals_data(cart, lines))
+        return JsonResponse(data)
+
+
 class CheckoutView(CartOrderMixin, FormMixin, DetailView):
     model = Cart
     template_name = "carts/checkout_view.html"
@@ -197,11 +299,8 @@ class CheckoutView(CartOrderMixin, FormMixin, DetailView):
         user = self.request.user
         print("user w GET   ", user)
         if user.is_authenticated():  # user id is not inherited from prev session
-            user_checkout, created = UserCheckout.objects.get_or_create(user=user)
+            user_checkout = UserCheckout.objects.get_or_create(user=user)[0]
             print("user_checkout w GET   ", user_checkout, user_checkout.id)
-            if created:
-                user_checkout.user = user
-                user_checkout.save()
             self.request.session["user_checkout_id"] = user_checkout.id
         user_checkout_id = self.request.session.get("user_checkout_id")
 
@@ -213,16 +312,35 @@ class CheckoutView(CartOrderMixin, FormMixin, DetailView):
             user_checkout = UserCheckout.objects.get(id=user_checkout_id)
             new_order.user = user_checkout
             new_order.save()
+
+            # hold the stock while the payment form is filled in
+            try:
+                reserve_order(new_order)
+            except OutOfStock as e:
+                out_of_stock_message(request, e)
+                return redirect("cart")
         get_data = super(CheckoutView, self).get(request, *args, **kwargs)
         return get_data
 
 
+def out_of_stock_message(request, error):
+    for variation in Variation.objects.filter(id__in=error.variation_ids).select_related("product"):
+        messages.error(request, "Not enough of %s left." % variation.get_title())
+
+
 class CheckoutFinalView(CartOrderMixin, View):
     def post(self, request, *args, **kwargs):
         order = self.get_order()
         order_total = order.order_total
         nonce = request.POST.get("payment_method_nonce")
         if nonce:
+            # the hold may have expired meanwhile, take it again before charging
+            try:
+                reserve_order(order)
+            except OutOfStock as e:
+                out_of_stock_message(request, e)
+                return redirect("cart")
+
             result = braintree.Transaction.sale({
                 "amount": order_total,
                 "payment_method_nonce": nonce,
@@ -235,11 +353,15 @@ class CheckoutFinalView(CartOrderMixin, View):
             })
 
             if result.is_success:
-                order.mark_completed(order_id=result.transaction.id)
+                with transaction.atomic():
+                    order.mark_completed(order_id=result.transaction.id)
+                    order.save()
+                    commit_reservations(order)
                 del request.session["cart_id"]
                 del request.session["order_id"]
                 messages.success(request, "Thank you for your order!")
             else:
+                release_reservations(order.reservations.all())
                 messages.success(request, "%s" % result.message)
                 return redirect("checkout")
 
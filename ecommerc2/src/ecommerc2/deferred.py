@@ -0,0 +1,28 @@
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+def on_commit_once(func, keys, using=DEFAULT_DB_ALIAS):
+    """
+    Calls func(keys) once the current transaction commits, with the keys
+    (e.g. cart ids) of every call made for func during the transaction,
+    so a recomputation a receiver asks for per saved row runs once per
+    affected object. Outside of a transaction func runs right away.
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        func(set(keys))
+        return
+
+    batches = connection.__dict__.setdefault("deferred_batches", {})
+    batch = batches.get(func)
+    # a rolled back transaction (or savepoint) drops its callbacks, not the
+    # batch, so the batch only counts while its callback is still pending
+    if batch is None or not any(callback is batch["callback"] for _, callback in connection.run_on_commit):
+        batch = batches[func] = {"keys": set(), "callback": lambda: run_batch(connection, func)}
+        transaction.on_commit(batch["callback"], using)
+    batch["keys"].update(keys)
+
+
+def run_batch(connection, func):
+    batch = connection.deferred_batches.pop(func)
+    func(batch["keys"])
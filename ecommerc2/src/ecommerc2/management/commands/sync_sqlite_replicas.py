@@ -0,0 +1,36 @@
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = ("Copies the SQLite primary over the SQLite DATABASE_REPLICAS, "
+            "to try the read replica routing locally (see ecommerc2.settings.replicas).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Keep copying every that many seconds (the simulated lag).")
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES["default"]
+        replicas = [settings.DATABASES[alias] for alias in getattr(settings, "DATABASE_REPLICAS", [])]
+        if not replicas:
+            raise CommandError("No DATABASE_REPLICAS configured.")
+        for database in [primary] + replicas:
+            if not database["ENGINE"].endswith("sqlite3"):
+                raise CommandError("Only SQLite databases can be synced this way.")
+        while True:
+            connections["default"].close()
+            for replica in replicas:
+                # copy, then rename: open replica connections keep reading the old file
+                tmp = replica["NAME"] + ".tmp"
+                shutil.copyfile(primary["NAME"], tmp)
+                os.replace(tmp, replica["NAME"])
+            self.stdout.write("Synced %s replica(s)." % len(replicas))
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
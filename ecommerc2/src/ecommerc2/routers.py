@@ -0,0 +1,85 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+
+PIN_COOKIE = "primary_until"
+# read from the primary always: a session or user written a moment ago
+# (login, registration) missing on a lagging replica logs the user out
+PRIMARY_APPS = ("auth", "sessions")
+
+state = threading.local()
+
+
+def get_replicas():
+    return list(getattr(settings, "DATABASE_REPLICAS", []))
+
+
+def replicas_allowed():
+    return getattr(state, "replicas", False) and not getattr(state, "pinned", False)
+
+
+def pin_primary():
+    # the rest of the request, and the next REPLICA_PIN_SECONDS of the session
+    state.pinned = True
+    state.wrote = True
+
+
+class ReplicaRouter(object):
+    """
+    Reads go to a random DATABASE_REPLICAS alias only inside views which
+    opt in (products.mixins.ReplicaReadMixin), never for PRIMARY_APPS,
+    never inside a transaction and never once the request or the session
+    wrote lately; everything else, writes and migrations included, uses
+    the primary (default).
+    """
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas or not replicas_allowed() or connections["default"].in_atomic_block:
+            return "default"
+        if model._meta.app_label in PRIMARY_APPS:
+            return "default"
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if getattr(state, "replicas", None) is not None and model._meta.app_label != "sessions":
+            pin_primary()
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set(["default"] + get_replicas())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema by replication
+        return db not in get_replicas()
+
+
+class ReplicaPinningMiddleware(MiddlewareMixin):
+    """
+    Keeps sessions which wrote (cart, checkout, ...) on the primary for
+    REPLICA_PIN_SECONDS with a cookie, so they read their own writes.
+    """
+    def process_request(self, request):
+        state.replicas = False
+        state.wrote = False
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        state.pinned = pinned_until > time.time()
+
+    def process_response(self, request, response):
+        if getattr(state, "wrote", False):
+            seconds = getattr(settings, "REPLICA_PIN_SECONDS", 5)
+            response.set_cookie(PIN_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True)
+        state.replicas = None
+        state.wrote = False
+        state.pinned = False
+        return response
@@ -41,6 +41,7 @@ INSTALLED_APPS = (
     'django_filters',
     'registration',
     # my apps
+    'ecommerc2',  # project wide management commands (sync_sqlite_replicas)
     'carts',
     'newsletter',
     'orders',
@@ -48,6 +49,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'ecommerc2.routers.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -71,6 +73,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'carts.context_processors.cart',
             ],
         },
     },
@@ -135,4 +138,69 @@ LOGIN_REDIRECT_URL = '/'
 BRAINTREE_PUBLIC = "r5t59qtwypfh82fk"
 BRAINTREE_PRIVATE = "a785e99c3a97dae8aad28dcde5c49395"
 BRAINTREE_MERCHANT_ID = "6yszvrv7645wmgxd"
-BRAINTREE_ENVIRONMENT = "sandbox"
\ No newline at end of file
+BRAINTREE_ENVIRONMENT = "sandbox"
+
+
+# PRODUCT SEARCH
+PRODUCT_SEARCH_BACKEND = "products.search.SQLiteSearchBackend"
+
+# RELATED PRODUCTS
+RELATED_PRODUCTS_POOL_SIZE = 24  # best scored related products kept per product, rebuild_related_products after changing
+
+# HOME PAGE SAMPLING
+PRODUCT_SAMPLE_POOL_TIMEOUT = 300  # seconds
+
+# FILTER FACETS
+PRODUCT_PRICE_BUCKETS = (0, 10, 25, 50, 100, 250, 500, 1000)  # rebuild_facets after changing
+
+# FRAGMENT CACHE
+PRODUCT_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24  # seconds, fragments are also versioned
+CATALOG_CACHE = "default"  # version counters and fragments, shared by every process (products.E001)
+
+# IMAGE RENDITIONS
+PRODUCT_IMAGE_RENDITIONS = (  # name, max width, max height; generate_image_renditions --all after changing
+    ("thumbnail", 200, 200),
+    ("card", 400, 400),
+    ("hero", 1200, 600),
+)
+PRODUCT_IMAGE_FORMATS = ("webp", "jpeg")  # the last one is the <img> fallback, see products.images
+PRODUCT_IMAGE_WORKERS = 2  # processes, 0 renders inline after commit
+
+# INVENTORY
+INVENTORY_RESERVATION_TIMEOUT = 15 * 60  # seconds stock is held at checkout, release_expired_reservations
+PRODUCT_AVAILABILITY_CACHE_TIMEOUT = 30  # seconds
+
+# READ REPLICAS
+DATABASE_ROUTERS = ['ecommerc2.routers.ReplicaRouter']
+DATABASE_REPLICAS = []  # DATABASES aliases catalog and order history pages may read from
+REPLICA_PIN_SECONDS = 5  # seconds a session reads from the primary after it wrote
+
+# SITEMAPS AND FEEDS
+PRODUCT_FEED_SHARD_SIZE = 10000  # products per shard (by id), write_product_feeds --all after changing
+PRODUCT_FEED_ROOT = os.path.join(MEDIA_ROOT, "feeds")
+PRODUCT_FEED_URL = MEDIA_URL + "feeds/"
+PRODUCT_FEED_CURRENCY = "USD"
+
+# CART STORE
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # for carts.store.CacheCartStore: shared by every process, with an atomic
+    # incr() and not evicting carts before flush_carts wrote them (memcached)
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cart_store'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+CART_STORE = "carts.store.DatabaseCartStore"  # every change right away; production.py runs CacheCartStore
+CART_STORE_CACHE = "carts"
+CART_STORE_TIMEOUT = 60 * 60 * 24 * 14  # seconds, longer than flush_carts runs apart
+
+# SESSIONS
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"  # cart badge and cart pages read it without a query
+
+# CARTS PURGE
+CART_TTL = 60 * 60 * 24 * 30  # seconds, purge_carts deletes carts not changed (and not ordered) for longer
+CART_EMPTY_TTL = 60 * 60 * 24  # the same for carts without lines
@@ -78,6 +78,7 @@ if not settings.DEBUG:
 	)
 
 	MIDDLEWARE_CLASSES = (
+	    'ecommerc2.routers.ReplicaPinningMiddleware',
 	    'django.contrib.sessions.middleware.SessionMiddleware',
 	    'django.middleware.common.CommonMiddleware',
 	    'django.middleware.csrf.CsrfViewMiddleware',
@@ -101,6 +102,7 @@ if not settings.DEBUG:
 	                'django.template.context_processors.request',
 	                'django.contrib.auth.context_processors.auth',
 	                'django.contrib.messages.context_processors.messages',
+	                'carts.context_processors.cart',
 	            ],
 	        },
 	    },
@@ -123,6 +125,42 @@ if not settings.DEBUG:
 	    }
 	}
 
+	# read replicas: add them to DATABASES (same NAME/USER, their HOST) and
+	# list their aliases, e.g. DATABASE_REPLICAS = ['replica1']
+	DATABASE_ROUTERS = ['ecommerc2.routers.ReplicaRouter']
+	DATABASE_REPLICAS = []
+	REPLICA_PIN_SECONDS = 5
+
+
+	# Cache
+	# shared by the mod_wsgi daemon processes: catalog versions, fragments,
+	# stock counters (see products.checks)
+	CACHES = {
+	    'default': {
+	        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+	        'LOCATION': '127.0.0.1:11211',
+	    },
+	    # carts.store.CacheCartStore: a memcached of its own, so catalog entries
+	    # never evict carts flush_carts has not written yet; give it the memory
+	    # of CART_STORE_TIMEOUT worth of carts
+	    'carts': {
+	        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+	        'LOCATION': '127.0.0.1:11212',
+	    },
+	}
+	CATALOG_CACHE = 'default'
+
+
+	# Cart store
+	# carts live in the 'carts' cache between page views, written to the tables
+	# at checkout and by cron:
+	#   */5 * * * *  python manage.py flush_carts
+	#   * * * * *    python manage.py release_expired_reservations
+	#   30 4 * * *   python manage.py purge_carts
+	CART_STORE = 'carts.store.CacheCartStore'
+	CART_STORE_CACHE = 'carts'
+	CART_STORE_TIMEOUT = 60 * 60 * 24 * 14  # seconds, longer than flush_carts runs apart
+
 
 	# Internationalization
 	# https://docs.djangoproject.com/en/1.8/topics/i18n/
@@ -168,6 +206,10 @@ if not settings.DEBUG:
 	LOGIN_REDIRECT_URL = '/'
 
 
+	#PRODUCT SEARCH
+	PRODUCT_SEARCH_BACKEND = "products.search.PostgresSearchBackend"
+
+
 
 
 
@@ -0,0 +1,25 @@
+# Local read replica setup: DJANGO_SETTINGS_MODULE=ecommerc2.settings.replicas
+# Replicas are copies of db.sqlite3, "replicated" by the sync_sqlite_replicas
+# command (with --interval it keeps them a few seconds behind, like lag).
+from . import *
+
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    },
+    'replica1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db-replica1.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
+    'replica2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db-replica2.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['ecommerc2.routers.ReplicaRouter']
+DATABASE_REPLICAS = ['replica1', 'replica2']
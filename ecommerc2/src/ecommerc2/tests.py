@@ -0,0 +1,169 @@
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.urlresolvers import reverse
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+
+from carts.models import Cart, CartItem
+from products.models import Product
+from . import routers
+from .deferred import on_commit_once
+from .routers import PIN_COOKIE, ReplicaPinningMiddleware, ReplicaRouter
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"], REPLICA_PIN_SECONDS=5)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.middleware = ReplicaPinningMiddleware()
+        self.request = self.start_request()
+        self.addCleanup(self.middleware.process_response, self.request, HttpResponse())
+
+    def start_request(self, pinned_until=None):
+        request = RequestFactory().get("/products/")
+        if pinned_until is not None:
+            request.COOKIES[PIN_COOKIE] = str(pinned_until)
+        self.middleware.process_request(request)
+        return request
+
+    def test_reads_stay_on_primary_unless_the_view_opts_in(self):
+        self.assertEqual(self.router.db_for_read(Product), "default")
+        routers.state.replicas = True
+        self.assertEqual(self.router.db_for_read(Product), "replica1")
+
+    def test_sessions_and_users_are_read_from_primary(self):
+        routers.state.replicas = True
+        self.assertEqual(self.router.db_for_read(Session), "default")
+        self.assertEqual(self.router.db_for_read(User), "default")
+
+    def test_reads_in_a_transaction_go_to_primary(self):
+        routers.state.replicas = True
+        with mock.patch.object(connections["default"], "in_atomic_block", True):
+            self.assertEqual(self.router.db_for_read(Product), "default")
+
+    def test_write_pins_the_rest_of_the_request(self):
+        routers.state.replicas = True
+        self.assertEqual(self.router.db_for_write(Product), "default")
+        self.assertEqual(self.router.db_for_read(Product), "default")
+
+    def test_session_writes_do_not_pin(self):
+        routers.state.replicas = True
+        self.router.db_for_write(Session)
+        self.assertEqual(self.router.db_for_read(Product), "replica1")
+
+    def test_write_sets_the_pin_cookie(self):
+        self.router.db_for_write(Product)
+        response = self.middleware.process_response(self.request, HttpResponse())
+        self.assertEqual(response.cookies[PIN_COOKIE]["max-age"], 5)
+        self.assertGreater(float(response.cookies[PIN_COOKIE].value), time.time())
+
+    def test_no_pin_cookie_without_a_write(self):
+        response = self.middleware.process_response(self.request, HttpResponse())
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_pin_cookie_keeps_reads_on_primary(self):
+        self.start_request(pinned_until=time.time() + 5)
+        routers.state.replicas = True
+        self.assertEqual(self.router.db_for_read(Product), "default")
+
+    def test_expired_pin_cookie_is_ignored(self):
+        self.start_request(pinned_until=time.time() - 1)
+        routers.state.replicas = True
+        self.assertEqual(self.router.db_for_read(Product), "replica1")
+
+    def test_no_migrations_on_replicas(self):
+        self.assertFalse(self.router.allow_migrate("replica1", "products"))
+        self.assertTrue(self.router.allow_migrate("default", "products"))
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"], CART_STORE="carts.store.DatabaseCartStore")
+class ReadAfterWriteTests(TransactionTestCase):
+    # no atomic block around the requests, as in production
+    def setUp(self):
+        product = Product.objects.create(title="Mug", price=10)
+        self.variation = product.variation_set.first()
+        self.reads = []
+        route = ReplicaRouter.db_for_read
+
+        def db_for_read(router, model, **hints):
+            self.reads.append(route(router, model, **hints))
+            return "default"  # there is no replica to read from here
+
+        patcher = mock.patch.object(ReplicaRouter, "db_for_read", db_for_read)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_catalog_reads_go_to_replicas(self):
+        self.client.get(reverse("product_list"))
+        self.assertIn("replica1", self.reads)
+
+    def test_reads_after_a_write_go_to_primary(self):
+        response = self.client.get(reverse("cart"), {"item": self.variation.id, "qty": 1})
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        self.reads = []
+        self.client.get(reverse("product_list"))
+        self.assertTrue(self.reads)
+        self.assertEqual(set(self.reads), set(["default"]))
+
+
+class OnCommitOnceTests(TransactionTestCase):
+    def setUp(self):
+        self.calls = []
+
+    def record(self, keys):
+        self.calls.append(keys)
+
+    def test_runs_right_away_outside_of_a_transaction(self):
+        on_commit_once(self.record, [1, 1])
+        self.assertEqual(self.calls, [set([1])])
+
+    def test_calls_in_a_transaction_run_once_at_commit(self):
+        with transaction.atomic():
+            on_commit_once(self.record, [1])
+            on_commit_once(self.record, [2, 1])
+            with transaction.atomic():
+                on_commit_once(self.record, [3])
+            self.assertEqual(self.calls, [])
+        self.assertEqual(self.calls, [set([1, 2, 3])])
+
+    def test_functions_are_batched_apart(self):
+        other = []
+
+        def record_other(keys):
+            other.append(keys)
+
+        with transaction.atomic():
+            on_commit_once(self.record, [1])
+            on_commit_once(record_other, [2])
+        self.assertEqual((self.calls, other), ([set([1])], [set([2])]))
+
+    def test_rolled_back_calls_do_not_run(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            on_commit_once(self.record, [1])
+            raise RuntimeError
+        with transaction.atomic():
+            on_commit_once(self.record, [2])
+        self.assertEqual(self.calls, [set([2])])
+
+    def test_calls_after_a_rolled_back_savepoint_still_run(self):
+        with transaction.atomic():
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                on_commit_once(self.record, [1])
+                raise RuntimeError
+            on_commit_once(self.record, [2])
+        self.assertEqual(self.calls, [set([2])])
+
+    def test_cart_totals_are_recomputed_once_per_transaction(self):
+        variations = [Product.objects.create(title=str(number), price=1).variation_set.first()
+                      for number in range(3)]
+        cart = Cart.objects.create()
+        with mock.patch("carts.models.update_totals", side_effect=self.record):
+            with transaction.atomic():
+                for variation in variations:
+                    CartItem.objects.create(cart=cart, item=variation, quantity=2)
+        self.assertEqual(self.calls, [set([cart.id])])
@@ -4,6 +4,7 @@ from django.conf.urls.static import static
 from django.contrib import admin
 
 from carts.views import (
+    CartBatchView,
     CartView,
     CheckoutFinalView,
     CheckoutView,
@@ -19,6 +20,11 @@ OrderDetailView,
     OrderListView,
     UserAddressCreateView,
 )
+from products.views import (
+    ProductFeedView,
+    ProductSitemapView,
+    SitemapIndexView,
+)
 from .views import about
 
 urlpatterns = [
@@ -31,12 +37,17 @@ urlpatterns = [
 
     url(r'^products/', include('products.urls')),
     url(r'^categories/', include('products.urls_categories')),
+    url(r'^api/', include('products.urls_api')),
+    url(r'^sitemap\.xml$', SitemapIndexView.as_view(), name='sitemap'),
+    url(r'^sitemaps/products-(?P<shard>\d+)\.xml$', ProductSitemapView.as_view(), name='product_sitemap'),
+    url(r'^feeds/products\.(?P<format>xml|csv)$', ProductFeedView.as_view(), name='product_feed'),
 
     url(r'^orders/$', OrderListView.as_view(), name='orders'),
     url(r'^orders/(?P<pk>\d+)/$', OrderDetailView.as_view(), name='order_detail'),
 
     url(r'^cart/$', CartView.as_view(), name='cart'),
     url(r'^cart/count/$', ItemCountView.as_view(), name='item_count'),
+    url(r'^cart/batch/$', CartBatchView.as_view(), name='cart_batch'),
 
     url(r'^checkout/$', CheckoutView.as_view(), name='checkout'),
     url(r'^checkout/address/$', AddressSelectFormView.as_view(), name='order_address'),
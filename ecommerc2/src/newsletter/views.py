@@ -4,22 +4,12 @@ from django.shortcuts import render
 
 from .forms import ContactForm, SignUpForm
 from .models import SignUp
-from products.models import Product, ProductFeatured
+from products.sampling import random_featured, sample_products
 
 
 def home(request):
     title = 'Sign Up Now'
-    featured_img = ProductFeatured.objects.filter(active=True).order_by("?").first()
     form = SignUpForm(request.POST or None)
-    products = Product.objects.all().order_by("?")[:6]
-    products2 = Product.objects.all().order_by("?")[:6]
-    context = {
-        "title": title,
-        "featured_img": featured_img,
-        "form": form,
-        "products": products,
-        "products2": products2,
-    }
     if form.is_valid():
         # form.save()
         # print request.POST['email'] #not recommended
@@ -35,7 +25,15 @@ def home(request):
         context = {
             "title": "Thank you"
         }
+        return render(request, "home.html", context)
 
+    context = {
+        "title": title,
+        "featured_img": random_featured(),
+        "form": form,
+        "products": sample_products(6),
+        "products2": sample_products(6),
+    }
     return render(request, "home.html", context)
 
 
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from orders.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = "Gives the stock of expired, unpaid inventory reservations back (run it every minute or so)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, dest="batch_size",
+                            help="Reservations released per transaction.")
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS("Released %s reserved units." % released))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 09:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_image_renditions'),
+        ('orders', '0009_auto_20170216_0123'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryReservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('held', 'Held'), ('committed', 'Committed'), ('released', 'Released')], default='held', max_length=20)),
+                ('expires', models.DateTimeField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.Order')),
+                ('variation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.Variation')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='inventoryreservation',
+            index_together=set([('status', 'expires')]),
+        ),
+    ]
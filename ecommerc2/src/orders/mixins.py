@@ -3,6 +3,7 @@ from django.utils.decorators import method_decorator
 
 from .models import Order
 from carts.models import Cart
+from carts.store import get_cart_store
 
 
 class LoginRequiredMixin(object):
@@ -16,8 +17,9 @@ class CartOrderMixin(object):
         cart_id = self.request.session.get("cart_id")
         if cart_id is None:
             return None
-        cart = Cart.objects.get(id=cart_id)
-        if cart.items.count() < 1:
+        get_cart_store().flush(cart_id)  # checkout reads the tables
+        cart = Cart.objects.filter(id=cart_id).first()  # None once purged
+        if cart is None or cart.items.count() < 1:
             return None
         return cart
 
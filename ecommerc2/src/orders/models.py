@@ -6,7 +6,9 @@ from django.core.urlresolvers import reverse
 from django.db import models
 from django.db.models.signals import pre_save, post_save
 
-from carts.models import Cart
+from carts.models import Cart, current_total
+from ecommerc2.deferred import on_commit_once
+from products.models import Variation
 
 if settings.DEBUG:
     braintree.Configuration.configure(
@@ -46,11 +48,26 @@ class UserCheckout(models.Model):
         return None
 
 
+def create_braintree_customers(user_checkouts):
+    # the saved instances themselves, so their callers see the new id
+    for user_checkout in user_checkouts:
+        user_checkout.get_braintree_id()
+
+
+def keep_braintree_id(sender, instance, *args, **kwargs):
+    # an instance loaded before the customer was created must not save None over its id
+    if instance.pk and not instance.braintree_id:
+        instance.braintree_id = UserCheckout.objects.filter(pk=instance.pk).values_list(
+            "braintree_id", flat=True).first()
+
+
 def update_braintree_id(sender, instance, *args, **kwargs):
+    # after commit, no API call inside the transaction and one per checkout user
     if not instance.braintree_id:
-        instance.get_braintree_id()
+        on_commit_once(create_braintree_customers, [instance])
 
 
+pre_save.connect(keep_braintree_id, sender=UserCheckout)
 post_save.connect(update_braintree_id, sender=UserCheckout)
 
 
@@ -104,11 +121,37 @@ class Order (models.Model):
     def get_absolute_url(self):
         return reverse("order_detail", kwargs={"pk": self.pk})
 
+
 def order_pre_save(sender, instance, *args, **kwargs):
-    total_shipping_price = Decimal(instance.shipping_total_price)
-    cart_total = Decimal(instance.cart.total)
-    order_total = total_shipping_price + cart_total
-    instance.order_total = order_total
+    # from the cart lines, so cart totals still deferred in this transaction count
+    cart_total = current_total(instance.cart_id)
+    instance.order_total = Decimal(str(instance.shipping_total_price)) + (cart_total or Decimal("0.00"))
+
+
+pre_save.connect(order_pre_save, sender=Order)
 
 
-pre_save.connect(order_pre_save, sender=Order)
\ No newline at end of file
+RESERVATION_STATUS_CHOICES = (
+    ("held", "Held"),
+    ("committed", "Committed"),
+    ("released", "Released"),
+)
+
+
+class InventoryReservation(models.Model):
+    # stock taken off Variation.inventory_size for an order until it is paid
+    # (committed) or given back (released), see orders.reservations
+    order = models.ForeignKey(Order, related_name="reservations")
+    variation = models.ForeignKey(Variation, related_name="+")
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(choices=RESERVATION_STATUS_CHOICES, max_length=20, default="held")
+    expires = models.DateTimeField()
+    timestamp = models.DateTimeField(auto_now_add=True, auto_now=False)
+
+    class Meta:
+        index_together = [
+            ("status", "expires"),
+        ]
+
+    def __str__(self):
+        return "%s x %s" % (self.quantity, self.variation_id)
@@ -0,0 +1,97 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from products.inventory import return_stock, take_stock
+from .models import InventoryReservation
+
+
+class OutOfStock(Exception):
+    def __init__(self, variation_ids):
+        super(OutOfStock, self).__init__(variation_ids)
+        self.variation_ids = variation_ids
+
+
+def get_reservation_timeout():
+    return getattr(settings, "INVENTORY_RESERVATION_TIMEOUT", 15 * 60)
+
+
+def reserve_order(order):
+    """
+    Holds the stock for the order's cart: takes what the cart needs on top of
+    what the order already holds (gives back what it no longer needs) and
+    extends the hold. Raises OutOfStock, with nothing changed, when some
+    variation has not enough left. Each take is a conditional UPDATE, so
+    concurrent checkouts never oversell and no row stays locked after this.
+    """
+    wanted = Counter()
+    for variation_id, quantity in order.cart.cartitem_set.values_list("item_id", "quantity"):
+        wanted[variation_id] += quantity
+    expires = timezone.now() + timedelta(seconds=get_reservation_timeout())
+
+    with transaction.atomic():
+        held = dict((reservation.variation_id, reservation)
+                    for reservation in order.reservations.filter(status="held"))
+        missing = []
+        # same order in every transaction, so concurrent ones cannot deadlock
+        for variation_id in sorted(set(wanted) | set(held)):
+            have = held[variation_id].quantity if variation_id in held else 0
+            need = wanted[variation_id] - have
+            if need > 0 and not take_stock(variation_id, need):
+                missing.append(variation_id)
+            elif need < 0:
+                return_stock(variation_id, -need)
+        if missing:
+            raise OutOfStock(missing)
+
+        new = []
+        for variation_id in sorted(set(wanted) | set(held)):
+            if variation_id not in held:
+                new.append(InventoryReservation(order=order, variation_id=variation_id,
+                                                quantity=wanted[variation_id], expires=expires))
+            elif wanted[variation_id]:
+                InventoryReservation.objects.filter(id=held[variation_id].id).update(
+                    quantity=wanted[variation_id], expires=expires)
+            else:
+                InventoryReservation.objects.filter(id=held[variation_id].id).update(status="released")
+        InventoryReservation.objects.bulk_create(new)
+
+
+def commit_reservations(order):
+    # the sale went through, the held stock is gone for good
+    return order.reservations.filter(status="held").update(status="committed")
+
+
+def release_reservations(reservations):
+    """
+    Gives the stock of the held reservations back. Every row is flipped
+    with a conditional UPDATE first, so a reservation committed or released
+    concurrently is never returned twice.
+    """
+    returned = Counter()
+    with transaction.atomic():
+        rows = reservations.filter(status="held").values_list("id", "variation_id", "quantity")
+        for pk, variation_id, quantity in list(rows):
+            if InventoryReservation.objects.filter(id=pk, status="held").update(status="released"):
+                returned[variation_id] += quantity
+        for variation_id in sorted(returned):
+            return_stock(variation_id, returned[variation_id])
+    return sum(returned.values())
+
+
+def release_expired(batch_size=500, now=None):
+    """
+    Releases expired holds, batch_size rows per transaction. Returns the
+    number of units given back.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        ids = list(InventoryReservation.objects.filter(
+            status="held", expires__lt=now).order_by("expires").values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return released
+        released += release_reservations(InventoryReservation.objects.filter(id__in=ids))
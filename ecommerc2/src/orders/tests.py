@@ -1,3 +1,213 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from carts.models import Cart, CartItem
+from products.models import Product, Variation
+from .models import InventoryReservation, Order, UserAddress, UserCheckout
+from .reservations import (OutOfStock, commit_reservations, release_expired, release_reservations,
+                           reserve_order)
+
+
+class ReservationTests(TestCase):
+    def setUp(self):
+        self.mug = self.variation("Mug", 5)
+        self.cup = self.variation("Cup", 2)
+        self.cart = Cart.objects.create()
+        self.order = Order.objects.create(cart=self.cart)
+
+    def variation(self, title, inventory_size):
+        variation = Product.objects.create(title=title, price=10).variation_set.first()
+        Variation.objects.filter(id=variation.id).update(inventory_size=inventory_size)
+        return variation
+
+    def add(self, variation, quantity):
+        CartItem.objects.update_or_create(cart=self.cart, item=variation, defaults={"quantity": quantity})
+
+    def left(self, variation):
+        return Variation.objects.get(id=variation.id).inventory_size
+
+    def held(self):
+        return dict(self.order.reservations.filter(status="held").values_list("variation_id", "quantity"))
+
+    def test_reserve_takes_the_stock(self):
+        self.add(self.mug, 3)
+        self.add(self.cup, 2)
+        reserve_order(self.order)
+        self.assertEqual(self.left(self.mug), 2)
+        self.assertEqual(self.left(self.cup), 0)
+        self.assertEqual(self.held(), {self.mug.id: 3, self.cup.id: 2})
+
+    def test_reserve_again_takes_only_the_difference(self):
+        self.add(self.mug, 3)
+        reserve_order(self.order)
+        self.add(self.mug, 4)
+        reserve_order(self.order)
+        self.assertEqual(self.left(self.mug), 1)
+        self.add(self.mug, 1)
+        reserve_order(self.order)
+        self.assertEqual(self.left(self.mug), 4)
+        self.assertEqual(self.held(), {self.mug.id: 1})
+
+    def test_reserve_gives_back_removed_lines(self):
+        self.add(self.mug, 3)
+        reserve_order(self.order)
+        CartItem.objects.filter(cart=self.cart).delete()
+        reserve_order(self.order)
+        self.assertEqual(self.left(self.mug), 5)
+        self.assertEqual(self.held(), {})
+
+    def test_out_of_stock_changes_nothing(self):
+        self.add(self.mug, 3)
+        self.add(self.cup, 3)
+        with self.assertRaises(OutOfStock) as raised:
+            reserve_order(self.order)
+        self.assertEqual(raised.exception.variation_ids, [self.cup.id])
+        self.assertEqual(self.left(self.mug), 5)
+        self.assertEqual(self.left(self.cup), 2)
+        self.assertFalse(self.order.reservations.exists())
+
+    def test_unlimited_variations_are_not_counted(self):
+        Variation.objects.filter(id=self.mug.id).update(inventory_size=None)
+        self.add(self.mug, 100)
+        reserve_order(self.order)
+        self.assertIsNone(self.left(self.mug))
+        self.assertEqual(self.held(), {self.mug.id: 100})
+
+    def test_release_gives_the_stock_back_once(self):
+        self.add(self.mug, 3)
+        reserve_order(self.order)
+        self.assertEqual(release_reservations(self.order.reservations.all()), 3)
+        self.assertEqual(release_reservations(self.order.reservations.all()), 0)
+        self.assertEqual(self.left(self.mug), 5)
+
+    def test_committed_reservations_are_not_released(self):
+        self.add(self.mug, 3)
+        reserve_order(self.order)
+        self.assertEqual(commit_reservations(self.order), 1)
+        self.assertEqual(release_reservations(self.order.reservations.all()), 0)
+        self.assertEqual(self.left(self.mug), 2)
+
+    def test_release_expired(self):
+        self.add(self.mug, 3)
+        reserve_order(self.order)
+        other = Order.objects.create(cart=Cart.objects.create())
+        CartItem.objects.create(cart=other.cart, item=self.cup, quantity=1)
+        reserve_order(other)
+        self.order.reservations.update(expires=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(release_expired(batch_size=1), 3)
+        self.assertEqual(self.left(self.mug), 5)
+        self.assertEqual(self.left(self.cup), 1)
+        self.assertEqual(InventoryReservation.objects.filter(status="held").count(), 1)
+
+    def test_release_expired_later(self):
+        self.add(self.mug, 3)
+        reserve_order(self.order)
+        self.assertEqual(release_expired(), 0)
+        self.assertEqual(release_expired(now=timezone.now() + timedelta(hours=1)), 3)
+        self.assertEqual(self.left(self.mug), 5)
+
+
+class OrderTotalTests(TransactionTestCase):
+    def setUp(self):
+        self.mug = Product.objects.create(title="Mug", price=10).variation_set.first()
+        self.cart = Cart.objects.create(tax_percentage=0)
+        CartItem.objects.create(cart=self.cart, item=self.mug, quantity=2)
+
+    def stored_total(self, order):
+        return Order.objects.filter(id=order.id).values_list("order_total", flat=True).get()
+
+    def test_the_instance_gets_the_total(self):
+        order = Order.objects.create(cart=self.cart, shipping_total_price=Decimal("5.99"))
+        self.assertEqual(order.order_total, Decimal("25.99"))
+        self.assertEqual(self.stored_total(order), Decimal("25.99"))
+
+    def test_a_later_save_keeps_the_total(self):
+        order = Order.objects.create(cart=self.cart)
+        line = CartItem.objects.get(cart=self.cart)
+        line.quantity = 3
+        line.save()  # cart totals recomputed at once, outside of a transaction
+        order.mark_completed("payment-1")
+        order.save()
+        self.assertEqual(order.order_total, Decimal("35.99"))
+        self.assertEqual(self.stored_total(order), Decimal("35.99"))
+
+    def test_cart_totals_deferred_in_the_transaction_reach_the_order(self):
+        with transaction.atomic():
+            CartItem.objects.create(cart=self.cart, item=Product.objects.create(
+                title="Cup", price=1).variation_set.first(), quantity=1)
+            order = Order.objects.create(cart=self.cart)
+            self.assertEqual(order.order_total, Decimal("26.99"))
+        self.assertEqual(self.stored_total(order), Decimal("26.99"))
+
+    def test_a_save_reads_the_total_once(self):
+        order = Order.objects.create(cart=self.cart)
+        with CaptureQueriesContext(connection) as queries:
+            order.save()
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+        self.assertEqual([statement for statement in statements if statement != "BEGIN"], ["SELECT", "UPDATE"])
+
+
+class OrderDetailTests(TestCase):
+    def test_the_order_is_fetched_once(self):
+        user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+        user_checkout = UserCheckout.objects.create(user=user, email=user.email, braintree_id="customer-1")
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, item=Product.objects.create(title="Mug", price=10).variation_set.first())
+        order = Order.objects.create(cart=cart, user=user_checkout)
+        self.client.login(username="buyer", password="secret")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(order.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        fetches = [query["sql"] for query in queries.captured_queries
+                   if query["sql"].startswith('SELECT "%s"."id"' % Order._meta.db_table)]
+        self.assertEqual(len(fetches), 1)
+
+
+@override_settings(CART_STORE="carts.store.DatabaseCartStore")
+class CheckoutCustomerTests(TransactionTestCase):
+    def setUp(self):
+        User.objects.create_user("buyer", "buyer@example.com", "secret")
+        self.client.login(username="buyer", password="secret")
+        variation = Product.objects.create(title="Mug", price=10).variation_set.first()
+        self.client.get(reverse("cart"), {"item": variation.id, "qty": 1})
+        created = mock.Mock(is_success=True, customer=mock.Mock(id="customer-1"))
+        patchers = [mock.patch("braintree.Customer.create", return_value=created),
+                    mock.patch("braintree.ClientToken.generate", return_value="token")]
+        self.create = patchers[0].start()
+        patchers[1].start()
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def test_one_customer_per_checkout_user(self):
+        response = self.client.get(reverse("checkout"))
+        self.assertRedirects(response, reverse("order_address"), fetch_redirect_response=False)
+        self.assertEqual(self.create.call_count, 1)
+        user_checkout = UserCheckout.objects.get()
+        self.assertEqual(user_checkout.braintree_id, "customer-1")
+
+        address = UserAddress.objects.create(user=user_checkout, type="billing", street="1 Main St",
+                                             city="Springfield", state="IL", zipcode="62701")
+        Order.objects.filter(id=self.client.session["order_id"]).update(
+            billing_address=address, shipping_address=address)
+        response = self.client.get(reverse("checkout"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual(UserCheckout.objects.get().braintree_id, "customer-1")
+
+    def test_a_stale_instance_keeps_the_customer(self):
+        user_checkout = UserCheckout.objects.create(email="guest@example.com")
+        stale = UserCheckout.objects.get(id=user_checkout.id)
+        stale.braintree_id = None
+        stale.save()
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual(UserCheckout.objects.get(id=user_checkout.id).braintree_id, "customer-1")
@@ -4,6 +4,7 @@ from django.shortcuts import redirect
 from django.views.generic import CreateView, DetailView, ListView
 from django.views.generic import FormView
 
+from products.mixins import MemoizedObjectMixin, ReplicaReadMixin
 from .forms import AddressForm, UserAddressForm
 from .mixins import CartOrderMixin, LoginRequiredMixin
 from .models import (
@@ -13,8 +14,10 @@ from .models import (
 )
 
 
-class OrderDetailView(DetailView):
+class OrderDetailView(ReplicaReadMixin, MemoizedObjectMixin, DetailView):
     model = Order
+    select_related = ("cart", "user", "billing_address", "shipping_address")
+    prefetch_related = ("cart__cartitem_set__item__product",)
 
     def dispatch(self, request, *args, **kwargs):
         user = request.user
@@ -27,13 +30,13 @@ class OrderDetailView(DetailView):
             except:
                 user_checkout = None
 
-        obj = self.get_object()
-        if user_checkout and obj.user == user_checkout:
+        obj = self.get_object()  # memoized, DetailView.get reuses it
+        if user_checkout and obj.user_id == user_checkout.id:
             return super(OrderDetailView, self).dispatch(request, *args, **kwargs)
         raise Http404
 
 
-class OrderListView(LoginRequiredMixin, ListView):
+class OrderListView(LoginRequiredMixin, ReplicaReadMixin, ListView):
     queryset = Order.objects.all()
 
     def get_queryset(self):
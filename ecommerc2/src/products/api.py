@@ -0,0 +1,189 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.urlresolvers import reverse
+
+from .images import rendition_path
+from .models import Category, Product, ProductImage, Variation
+
+
+EXPORT_CHUNK_SIZE = 500  # rows per query, at most that many are in memory
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+class Resource(object):
+    """
+    Read-only JSON representation of a model. Plain fields are read with
+    values() (no model instances), the others are added by extend() for a
+    whole page (or export chunk) at once, one query each.
+    """
+    queryset = None
+    columns = {}  # field -> values() lookup
+    fields = ()   # every field, in output order; "id" first
+
+    def get_queryset(self):
+        return self.queryset.all()
+
+    def filter(self, queryset, params):
+        return queryset
+
+    def parse_fields(self, value):
+        # "?fields=title,price", id is always included
+        if not value:
+            return list(self.fields)
+        fields = [field.strip() for field in value.split(",") if field.strip()]
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown:
+            raise InvalidFields("Unknown fields: %s" % ", ".join(unknown))
+        return ["id"] + [field for field in self.fields if field in fields and field != "id"]
+
+    def values(self, queryset, fields):
+        lookups = set(["id"] + [self.columns[field] for field in fields if field in self.columns])
+        return queryset.values(*lookups)
+
+    def serialize(self, rows, fields):
+        objects = [dict((field, row[self.columns[field]]) for field in fields if field in self.columns)
+                   for row in rows]
+        self.extend(rows, objects, fields)
+        return objects
+
+    def extend(self, rows, objects, fields):
+        pass
+
+
+class VariationResource(Resource):
+    queryset = Variation.objects.filter(active=True, product__active=True)
+    columns = {
+        "id": "id",
+        "product": "product_id",
+        "title": "title",
+        "price": "price",
+        "sale_price": "sale_price",
+        "inventory": "inventory_size",  # null == unlimited
+    }
+    fields = ("id", "product", "title", "price", "sale_price", "inventory")
+
+    def filter(self, queryset, params):
+        if params.get("product", "").isdigit():
+            queryset = queryset.filter(product_id=params["product"])
+        return queryset
+
+
+class ImageResource(Resource):
+    queryset = ProductImage.objects.filter(product__active=True)
+    columns = {
+        "id": "id",
+        "product": "product_id",
+    }
+    fields = ("id", "product", "url", "renditions")
+
+    def values(self, queryset, fields):
+        return queryset.values("id", "product_id", "image", "renditions")
+
+    def filter(self, queryset, params):
+        if params.get("product", "").isdigit():
+            queryset = queryset.filter(product_id=params["product"])
+        return queryset
+
+    def extend(self, rows, objects, fields):
+        storage = ProductImage._meta.get_field("image").storage
+        for row, obj in zip(rows, objects):
+            if "url" in fields:
+                obj["url"] = storage.url(row["image"])
+            if "renditions" in fields:
+                # {rendition: {"width", "height", format: url}}, empty until rendered
+                renditions = json.loads(row["renditions"]) if row["renditions"] else {"sizes": {}}
+                obj["renditions"] = {}
+                for rendition, (width, height) in renditions["sizes"].items():
+                    obj["renditions"][rendition] = dict(
+                        [("width", width), ("height", height)] +
+                        [(fmt, storage.url(rendition_path(row["image"], rendition, fmt)))
+                         for fmt in renditions["formats"]])
+
+
+class CategoryResource(Resource):
+    queryset = Category.objects.filter(active=True)
+    columns = {
+        "id": "id",
+        "title": "title",
+        "slug": "slug",
+        "description": "description",
+    }
+    fields = ("id", "title", "slug", "description", "url")
+
+    def values(self, queryset, fields):
+        return queryset.values("id", "title", "slug", "description")
+
+    def extend(self, rows, objects, fields):
+        if "url" in fields:
+            for row, obj in zip(rows, objects):
+                obj["url"] = reverse("category_detail", kwargs={"slug": row["slug"]})
+
+
+class ProductResource(Resource):
+    queryset = Product.objects.all()
+    columns = {
+        "id": "id",
+        "title": "title",
+        "description": "description",
+        "price": "price",
+        "min_price": "min_effective_price",
+        "max_price": "max_effective_price",
+        "default_category": "default_id",
+    }
+    fields = ("id", "title", "description", "url", "price", "min_price", "max_price",
+              "default_category", "categories", "variations", "images")
+
+    def filter(self, queryset, params):
+        if params.get("category"):
+            queryset = queryset.filter(category_memberships__category__slug=params["category"])
+        return queryset
+
+    def extend(self, rows, objects, fields):
+        ids = [row["id"] for row in rows]
+        nested = {}
+        if "categories" in fields:
+            nested["categories"] = {}
+            for product_id, category_id in Product.categories.through.objects.filter(
+                    product_id__in=ids).order_by("category_id").values_list("product_id", "category_id"):
+                nested["categories"].setdefault(product_id, []).append(category_id)
+        for field, resource in (("variations", VariationResource()), ("images", ImageResource())):
+            if field in fields:
+                nested[field] = {}
+                children = [child for child in resource.fields if child != "product"]
+                queryset = resource.get_queryset().filter(product_id__in=ids).order_by("id")
+                child_rows = list(resource.values(queryset, resource.fields))
+                for row, obj in zip(child_rows, resource.serialize(child_rows, children)):
+                    nested[field].setdefault(row["product_id"], []).append(obj)
+        for obj in objects:
+            if "url" in fields:
+                obj["url"] = reverse("product_detail", kwargs={"pk": obj["id"]})
+            for field, values in nested.items():
+                obj[field] = values.get(obj["id"], [])
+
+
+def export_objects(resource, queryset, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Every object of queryset in id order, read chunk by chunk with keyset
+    queries (id > last id), so memory use does not grow with the catalog
+    and no cursor or transaction stays open while the client reads.
+    """
+    queryset = resource.values(queryset.order_by("id"), fields)
+    last_id = None
+    while True:
+        chunk = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+        for obj in resource.serialize(rows, fields):
+            yield obj
+        last_id = rows[-1]["id"]
+
+
+def export_lines(resource, queryset, fields):
+    # JSON Lines, one object per line
+    for obj in export_objects(resource, queryset, fields):
+        yield json.dumps(obj, cls=DjangoJSONEncoder) + "\n"
@@ -0,0 +1,107 @@
+from django.db import transaction
+from django.db.models import Case, F, Func, Value, When
+
+from .forms import VariationUpdateForm
+from .inventory import invalidate_availability
+from .models import Variation
+
+
+CHUNK_SIZE = 100  # rows per UPDATE, each row is a few parameters per field
+MAX_ROWS = 500
+
+
+def refresh_products(product_ids):
+    # what the Variation signals would do, for UPDATEs which bypass them
+    from .facets import sync_product_facets
+    from .pricing import refresh_effective_prices
+    from .versions import bump_catalog
+
+    product_ids = list(set(product_ids))
+    if product_ids:
+        refresh_effective_prices(product_ids)
+        sync_product_facets(product_ids)
+        bump_catalog(product_ids)
+
+
+def apply_updates(changes):
+    """
+    changes: {variation id: {field: value}}. One UPDATE per chunk, each
+    field set with CASE id WHEN ... and left alone for the other rows.
+    """
+    ids = sorted(changes)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        fields = set(field for pk in chunk for field in changes[pk])
+        values = {}
+        for field in fields:
+            output_field = Variation._meta.get_field(field)
+            values[field] = Case(*[When(id=pk, then=Value(changes[pk][field], output_field=output_field))
+                                   for pk in chunk if field in changes[pk]],
+                                 default=F(field), output_field=output_field)
+        Variation.objects.filter(id__in=chunk).update(**values)
+
+
+@transaction.atomic
+def update_variations(rows, queryset=None, partial=True):
+    """
+    Validates a batch of variation changes (dicts with id and any of price,
+    sale_price, inventory_size, active) and applies it in one transaction,
+    all or nothing (at most MAX_ROWS rows). Rows outside of queryset are not found. Returns
+    (applied, results), results being {"id", "status", "errors"} per row in
+    order; status is one of updated, unchanged, invalid, not_found or
+    skipped (valid, but the batch was not applied).
+    """
+    if len(rows) > MAX_ROWS:
+        raise ValueError("At most %s rows per batch." % MAX_ROWS)
+    if queryset is None:
+        queryset = Variation.objects.all()
+    forms = [VariationUpdateForm(row if isinstance(row, dict) else {}, partial=partial)
+             for row in rows]
+    ids = [form.cleaned_data["id"] for form in forms if form.is_valid()]
+    current = {}
+    for row in queryset.filter(id__in=ids).values("id", "product_id", "price", "sale_price",
+                                                    "inventory_size", "active").iterator():
+        current[row["id"]] = row
+
+    results, changes = [], {}
+    for form in forms:
+        pk = form.data.get("id")
+        if not form.is_valid():
+            errors = dict((field, list(messages)) for field, messages in form.errors.items())
+            results.append({"id": pk, "status": "invalid", "errors": errors})
+            continue
+        pk = form.cleaned_data["id"]
+        if pk not in current:
+            results.append({"id": pk, "status": "not_found", "errors": {}})
+            continue
+        values = dict((field, value) for field, value in form.get_values().items()
+                      if current[pk][field] != value)
+        if values:
+            changes.setdefault(pk, {}).update(values)
+        results.append({"id": pk, "status": "updated" if values else "unchanged", "errors": {}})
+
+    if any(result["status"] in ("invalid", "not_found") for result in results):
+        for result in results:
+            if result["status"] in ("updated", "unchanged"):
+                result["status"] = "skipped"
+        return False, results
+
+    apply_updates(changes)
+    refresh_products(current[pk]["product_id"] for pk in changes)
+    invalidate_availability(pk for pk in changes if "inventory_size" in changes[pk])
+    return True, results
+
+
+def reprice_variations(queryset, percent, field="price"):
+    """
+    Moves price (or sale_price, where set) of every variation in queryset
+    by percent with a single UPDATE. Returns the number of variations.
+    """
+    factor = 1 + percent / 100
+    queryset = queryset.exclude(**{"%s__isnull" % field: True})
+    with transaction.atomic():
+        product_ids = list(queryset.values_list("product_id", flat=True).distinct())
+        updated = queryset.update(**{field: Func(F(field) * Value(factor), Value(2), function="ROUND",
+                                                 output_field=Variation._meta.get_field(field))})
+        refresh_products(product_ids)
+    return updated
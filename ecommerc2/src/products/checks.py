@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+PROCESS_LOCAL_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.caches)
+def check_catalog_cache(app_configs, **kwargs):
+    """
+    The catalog version counters (products.versions), the fragments and
+    stock counters keyed by them must be seen by every process, or a
+    change made in one leaves the others serving old pages.
+    """
+    if settings.DEBUG:
+        return []
+    alias = getattr(settings, "CATALOG_CACHE", "default")
+    backend = settings.CACHES.get(alias, {}).get("BACKEND")
+    if backend in PROCESS_LOCAL_BACKENDS:
+        return [Error(
+            "CATALOG_CACHE (%r) uses %s, which is not shared between processes." % (alias, backend),
+            hint="Point it at a shared cache (memcached, redis or the database).",
+            id="products.E001",
+        )]
+    return []
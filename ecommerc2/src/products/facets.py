@@ -0,0 +1,217 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, When
+
+from .models import CategoryFacet, Product, ProductFacet
+
+
+DEFAULT_PRICE_BUCKETS = (0, 10, 25, 50, 100, 250, 500, 1000)
+
+# products between pre_delete and post_delete; their variations are deleted
+# (and signalled) first and must not put them back into the counts
+deleting = threading.local()
+
+
+def deleting_product_ids():
+    if not hasattr(deleting, "product_ids"):
+        deleting.product_ids = set()
+    return deleting.product_ids
+
+
+def get_bucket_edges():
+    return tuple(getattr(settings, "PRODUCT_PRICE_BUCKETS", DEFAULT_PRICE_BUCKETS))
+
+
+def price_bucket(price):
+    return max(bisect_right(get_bucket_edges(), price) - 1, 0)
+
+
+def price_span(min_price, max_price):
+    """
+    (low, high) buckets a product priced min_price..max_price shows up in
+    through the price links, which filter like ProductFilter: some
+    variation at or above the lower bound, some at or below the upper one.
+    A price on an edge is in both buckets around it.
+    """
+    edges = get_bucket_edges()
+    low = min(max(bisect_left(edges, min_price) - 1, 0), len(edges) - 1)
+    return low, max(price_bucket(max_price), low)
+
+
+def span_buckets(span):
+    # the CategoryFacet buckets a product with span is counted in, None == any price
+    low, high = span
+    return [None] + list(range(low, high + 1))
+
+
+def bucket_bounds(bucket):
+    edges = get_bucket_edges()
+    upper = edges[bucket + 1] if bucket + 1 < len(edges) else None
+    return edges[bucket], upper
+
+
+def apply_deltas(deltas):
+    for (category_id, bucket), delta in sorted(deltas.items(), key=str):
+        if not delta:
+            continue
+        facets = CategoryFacet.objects.filter(category_id=category_id, price_bucket=bucket)
+        if facets.update(product_count=F("product_count") + delta):
+            continue
+        try:
+            with transaction.atomic():
+                CategoryFacet.objects.create(category_id=category_id, price_bucket=bucket,
+                                             product_count=delta)
+        except IntegrityError:  # created concurrently
+            facets.update(product_count=F("product_count") + delta)
+
+
+def update_category_facets(pairs, delta):
+    """
+    (product_id, category_id) links were added (delta 1) or removed (-1).
+    """
+    pairs = list(pairs)
+    spans = dict((product_id, (low, high)) for product_id, low, high in ProductFacet.objects.filter(
+        product_id__in=set(product_id for product_id, _ in pairs)
+    ).values_list("product_id", "low_bucket", "high_bucket"))
+    deltas = Counter()
+    for product_id, category_id in pairs:
+        if product_id in spans:
+            for bucket in span_buckets(spans[product_id]):
+                deltas[(category_id, bucket)] += delta
+    with transaction.atomic():
+        apply_deltas(deltas)
+
+
+def sync_product_facets(product_ids, removed=False):
+    """
+    Moves products to the buckets of their current effective price range,
+    or out of the counts when they are inactive (or about to be deleted).
+    """
+    product_ids = set(product_ids)
+    old = dict((product_id, (low, high)) for product_id, low, high in ProductFacet.objects.filter(
+        product_id__in=product_ids).values_list("product_id", "low_bucket", "high_bucket"))
+    new = {}
+    if not removed:
+        prices = Product.objects.get_queryset().active().filter(
+            id__in=product_ids - deleting_product_ids()).values_list(
+            "id", "min_effective_price", "max_effective_price")
+        new = dict((product_id, price_span(min_price, max_price))
+                   for product_id, min_price, max_price in prices)
+    changed = [product_id for product_id in product_ids if old.get(product_id) != new.get(product_id)]
+    if not changed:
+        return
+
+    categories = defaultdict(lambda: [None])
+    links = Product.categories.through.objects.filter(product_id__in=changed)
+    for product_id, category_id in links.values_list("product_id", "category_id"):
+        categories[product_id].append(category_id)
+
+    deltas = Counter()
+    for product_id in changed:
+        for category_id in categories[product_id]:
+            if product_id in old:
+                for bucket in span_buckets(old[product_id]):
+                    deltas[(category_id, bucket)] -= 1
+            if product_id in new:
+                for bucket in span_buckets(new[product_id]):
+                    deltas[(category_id, bucket)] += 1
+
+    with transaction.atomic():
+        ProductFacet.objects.filter(product_id__in=[pk for pk in changed if pk not in new]).delete()
+        for product_id in changed:
+            if product_id in new:
+                ProductFacet.objects.update_or_create(product_id=product_id, defaults={
+                    "low_bucket": new[product_id][0], "high_bucket": new[product_id][1]})
+        apply_deltas(deltas)
+
+
+def rebuild_facets():
+    with transaction.atomic():
+        CategoryFacet.objects.all().delete()
+        ProductFacet.objects.all().delete()
+
+        prices = Product.objects.get_queryset().active().values_list(
+            "id", "min_effective_price", "max_effective_price")
+        ProductFacet.objects.bulk_create(
+            (ProductFacet(product_id=product_id, low_bucket=low, high_bucket=high)
+             for product_id, (low, high) in ((product_id, price_span(min_price, max_price))
+                                             for product_id, min_price, max_price in prices.iterator())),
+            batch_size=500)
+
+        facets = []
+        links = Product.categories.through.objects.filter(product__facet__isnull=False)
+        for bucket in [None] + list(range(len(get_bucket_edges()))):
+            in_bucket = {}
+            if bucket is not None:
+                in_bucket = {"low_bucket__lte": bucket, "high_bucket__gte": bucket}
+            counts = links.filter(**dict(("product__facet__" + lookup, value)
+                                         for lookup, value in in_bucket.items()))
+            facets += [CategoryFacet(category_id=category_id, price_bucket=bucket, product_count=count)
+                       for category_id, count in counts.values("category_id").annotate(
+                           count=Count("id")).values_list("category_id", "count")]
+            total = ProductFacet.objects.filter(**in_bucket).count()
+            if total:
+                facets.append(CategoryFacet(category_id=None, price_bucket=bucket, product_count=total))
+        CategoryFacet.objects.bulk_create(facets, batch_size=500)
+
+
+def bucket_of_range(min_price, max_price):
+    # the bucket whose price link selects exactly min_price..max_price, or None
+    for bucket in range(len(get_bucket_edges())):
+        if bucket_bounds(bucket) == (min_price, max_price):
+            return bucket
+    return None
+
+
+def facet_counts(category_ids=None, min_price=None, max_price=None):
+    """
+    Counts for the filter sidebar, of distinct products as ProductFilter
+    finds them: "categories" - products per category within the selected
+    price range, "prices" - (lower, upper, count) per bucket within the
+    selected categories (any of them). No selection, one category and the
+    ranges of the price links are read from the facet store; other
+    selections take one aggregate query.
+    """
+    edges = get_bucket_edges()
+    category_ids = list(category_ids or [])
+
+    if min_price is None and max_price is None:
+        bucket = None
+    else:
+        bucket = bucket_of_range(min_price, max_price)
+    if bucket is not None or (min_price is None and max_price is None):
+        rows = CategoryFacet.objects.filter(category__isnull=False, price_bucket=bucket)
+        category_counts = dict(rows.values_list("category_id", "product_count"))
+    else:
+        links = Product.categories.through.objects.filter(product__active=True)
+        if min_price is not None:
+            links = links.filter(product__max_effective_price__gte=min_price)
+        if max_price is not None:
+            links = links.filter(product__min_effective_price__lte=max_price)
+        category_counts = dict(links.values("category_id").annotate(
+            count=Count("product_id", distinct=True)).values_list("category_id", "count"))
+
+    if len(category_ids) < 2:
+        rows = CategoryFacet.objects.filter(price_bucket__isnull=False)
+        if category_ids:
+            rows = rows.filter(category_id=category_ids[0])
+        else:
+            rows = rows.filter(category__isnull=True)
+        price_counts = dict(rows.values_list("price_bucket", "product_count"))
+    else:
+        # a product in several of the categories counts once
+        counts = Product.categories.through.objects.filter(
+            category_id__in=category_ids, product__facet__isnull=False).aggregate(**dict(
+                ("bucket_%s" % bucket, Count(Case(When(product__facet__low_bucket__lte=bucket,
+                                                       product__facet__high_bucket__gte=bucket,
+                                                       then="product_id")), distinct=True))
+                for bucket in range(len(edges))))
+        price_counts = dict((bucket, counts["bucket_%s" % bucket]) for bucket in range(len(edges)))
+
+    prices = [bucket_bounds(bucket) + (price_counts.get(bucket),)
+              for bucket in range(len(edges)) if price_counts.get(bucket)]
+    return {"categories": category_counts, "prices": prices}
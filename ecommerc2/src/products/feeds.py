@@ -0,0 +1,248 @@
+import csv
+import gzip
+import io
+import json
+import os
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Max, Sum
+
+from .models import Product, ProductImage, Variation
+
+
+CHUNK_SIZE = 500  # products per query, at most that many are in memory
+FEED_FIELDS = ("id", "item_group_id", "title", "description", "link", "image_link",
+               "price", "sale_price", "availability")
+
+
+def get_shard_size():
+    # products (by id range) per sitemap and feed shard; a sitemap holds at most 50000 URLs
+    return getattr(settings, "PRODUCT_FEED_SHARD_SIZE", 10000)
+
+
+def get_feed_root():
+    return getattr(settings, "PRODUCT_FEED_ROOT", os.path.join(settings.MEDIA_ROOT, "feeds"))
+
+
+def get_feed_url():
+    return getattr(settings, "PRODUCT_FEED_URL", settings.MEDIA_URL + "feeds/")
+
+
+def get_currency():
+    return getattr(settings, "PRODUCT_FEED_CURRENCY", "USD")
+
+
+def shard_queryset(shard):
+    size = get_shard_size()
+    return Product.objects.all().filter(id__gte=shard * size, id__lt=(shard + 1) * size)
+
+
+def shard_signatures():
+    """
+    {shard: [product count, sum of ids, last Product.updated]} of every shard
+    in one query, inactive products included so switching one off changes
+    its shard too.
+    """
+    shard = ExpressionWrapper(F("id") / get_shard_size(), output_field=IntegerField())
+    rows = Product.objects.get_queryset().annotate(shard=shard).values("shard").annotate(
+        count=Count("id"), id_sum=Sum("id"), updated=Max("updated")).order_by("shard")
+    return dict((row["shard"], [row["count"], row["id_sum"], row["updated"].isoformat()])
+                for row in rows)
+
+
+def chunked(queryset, fields, chunk_size=CHUNK_SIZE):
+    # values() rows in id order, one keyset query (id > last id) per chunk
+    queryset = queryset.order_by("id").values(*fields)
+    last_id = None
+    while True:
+        chunk = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]["id"]
+
+
+def absolute(base_url, url):
+    if url.startswith("http://") or url.startswith("https://") or url.startswith("//"):
+        return url
+    return base_url + url
+
+
+def sitemap_urls(queryset, base_url):
+    # (loc, lastmod) per active product
+    for rows in chunked(queryset, ("id", "updated")):
+        for row in rows:
+            yield (absolute(base_url, reverse("product_detail", kwargs={"pk": row["id"]})),
+                   row["updated"].date().isoformat())
+
+
+def feed_items(queryset, base_url):
+    """
+    One merchant feed item (FEED_FIELDS) per active variation, grouped by
+    product; three queries per chunk of products.
+    """
+    storage = ProductImage._meta.get_field("image").storage
+    currency = get_currency()
+    for products in chunked(queryset, ("id", "title", "description")):
+        ids = [product["id"] for product in products]
+        images = {}
+        for product_id, image in ProductImage.objects.filter(
+                product_id__in=ids).order_by("-id").values_list("product_id", "image"):
+            images[product_id] = image  # the first one wins
+        variations = {}
+        for variation in Variation.objects.filter(product_id__in=ids, active=True).order_by("id").values(
+                "id", "product_id", "title", "price", "sale_price", "inventory_size"):
+            variations.setdefault(variation["product_id"], []).append(variation)
+
+        for product in products:
+            link = absolute(base_url, reverse("product_detail", kwargs={"pk": product["id"]}))
+            image = images.get(product["id"])
+            for variation in variations.get(product["id"], []):
+                title = product["title"]
+                if len(variations[product["id"]]) > 1:
+                    title = "%s - %s" % (title, variation["title"])
+                inventory = variation["inventory_size"]
+                yield {
+                    "id": variation["id"],
+                    "item_group_id": product["id"],
+                    "title": title,
+                    "description": product["description"] or product["title"],
+                    "link": link,
+                    "image_link": absolute(base_url, storage.url(image)) if image else "",
+                    "price": "%s %s" % (variation["price"], currency),
+                    "sale_price": ("%s %s" % (variation["sale_price"], currency)
+                                   if variation["sale_price"] is not None else ""),
+                    "availability": "in stock" if inventory is None or inventory > 0 else "out of stock",
+                }
+
+
+def render_sitemap(urls):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for loc, lastmod in urls:
+        yield "<url><loc>%s</loc><lastmod>%s</lastmod></url>\n" % (escape(loc), lastmod)
+    yield "</urlset>\n"
+
+
+def render_sitemap_index(sitemaps):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for loc in sitemaps:
+        yield "<sitemap><loc>%s</loc></sitemap>\n" % escape(loc)
+    yield "</sitemapindex>\n"
+
+
+def render_feed_xml(items, title, link):
+    # RSS 2.0 with the Google merchant namespace
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0"><channel>\n'
+    yield "<title>%s</title><link>%s</link>\n" % (escape(title), escape(link))
+    for item in items:
+        yield "<item>%s</item>\n" % "".join(
+            "<g:{0}>{1}</g:{0}>".format(field, escape(str(item[field])))
+            for field in FEED_FIELDS if item[field] != "")
+    yield "</channel></rss>\n"
+
+
+def render_feed_csv(items, header=True):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(FEED_FIELDS)
+    for item in items:
+        writer.writerow([item[field] for field in FEED_FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+RENDERERS = {
+    # shard file name -> render(queryset, base_url)
+    "sitemap-products-%s.xml.gz": lambda queryset, base_url: render_sitemap(sitemap_urls(queryset, base_url)),
+    "feed-products-%s.xml.gz": lambda queryset, base_url: render_feed_xml(
+        feed_items(queryset, base_url), "Products", base_url + "/"),
+    "feed-products-%s.csv.gz": lambda queryset, base_url: render_feed_csv(feed_items(queryset, base_url)),
+}
+
+
+def write_gzip(path, chunks):
+    # written aside and renamed, a reader never sees half a file
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as output:
+        for chunk in chunks:
+            output.write(chunk)
+    os.replace(tmp, path)
+
+
+class ShardWriter(object):
+    """
+    Writes the sitemap and merchant feed of every shard of products (see
+    get_shard_size) gzipped into get_feed_root(), plus sitemap.xml, the
+    index of the sitemaps. Only the shards whose signature changed since
+    the last run (manifest.json) are written again, and the files of the
+    shards which no longer have products are removed.
+    """
+    def __init__(self, base_url, root=None):
+        self.base_url = base_url.rstrip("/")
+        self.root = root or get_feed_root()
+        self.manifest_path = os.path.join(self.root, "manifest.json")
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path) as manifest:
+                return dict((int(shard), signature) for shard, signature in json.load(manifest).items())
+        except (IOError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as output:
+            json.dump(manifest, output, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def shard_paths(self, shard):
+        return [os.path.join(self.root, name % shard) for name in RENDERERS]
+
+    def write_shard(self, shard):
+        queryset = shard_queryset(shard)
+        for name, render in RENDERERS.items():
+            write_gzip(os.path.join(self.root, name % shard), render(queryset, self.base_url))
+
+    def remove_shard(self, shard):
+        for path in self.shard_paths(shard):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write_index(self, shards):
+        urls = [absolute(self.base_url, get_feed_url() + "sitemap-products-%s.xml.gz" % shard)
+                for shard in sorted(shards)]
+        with open(os.path.join(self.root, "sitemap.xml.tmp"), "w", encoding="utf-8") as output:
+            output.writelines(render_sitemap_index(urls))
+        os.replace(os.path.join(self.root, "sitemap.xml.tmp"), os.path.join(self.root, "sitemap.xml"))
+
+    def run(self, force=False, progress=None):
+        """
+        Returns (written shards, removed shards).
+        """
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        old = {} if force else self.load_manifest()
+        signatures = shard_signatures()
+        written, removed = [], []
+        for shard, signature in sorted(signatures.items()):
+            if old.get(shard) == signature and all(os.path.exists(path) for path in self.shard_paths(shard)):
+                continue
+            self.write_shard(shard)
+            written.append(shard)
+            if progress is not None:
+                progress(shard)
+        for shard in set(self.load_manifest()) - set(signatures):
+            self.remove_shard(shard)
+            removed.append(shard)
+        self.write_index(signatures)
+        self.save_manifest(signatures)
+        return written, removed
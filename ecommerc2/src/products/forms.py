@@ -3,9 +3,19 @@ from django.forms.models import modelformset_factory
 from .models import Category, Variation
 
 
+class FacetMultipleChoiceField(forms.ModelMultipleChoiceField):
+    counts = None
+
+    def label_from_instance(self, obj):
+        label = super(FacetMultipleChoiceField, self).label_from_instance(obj)
+        if self.counts is not None:
+            return "%s (%s)" % (label, self.counts.get(obj.pk, 0))
+        return label
+
+
 class ProductFilterForm(forms.Form):
     q = forms.CharField(label="Search", required=False)
-    category_id = forms.ModelMultipleChoiceField(
+    category_id = FacetMultipleChoiceField(
         label="Category",
         queryset=Category.objects.all(),
         widget=forms.CheckboxSelectMultiple,
@@ -13,6 +23,11 @@ class ProductFilterForm(forms.Form):
     max_price = forms.DecimalField(decimal_places=2, max_digits=12, required=False)
     min_price = forms.DecimalField(decimal_places=2, max_digits=12, required=False)
 
+    def __init__(self, *args, **kwargs):
+        category_counts = kwargs.pop("category_counts", None)
+        super(ProductFilterForm, self).__init__(*args, **kwargs)
+        self.fields["category_id"].counts = category_counts
+
 
 class VariationInventoryForm(forms.ModelForm):
     class Meta:
@@ -25,6 +40,48 @@ class VariationInventoryForm(forms.ModelForm):
         ]
 
 
+class VariationUpdateForm(forms.Form):
+    # one row of a bulk update, see products.bulk.update_variations
+    id = forms.IntegerField()
+    price = forms.DecimalField(decimal_places=2, max_digits=15, min_value=0, required=False)
+    sale_price = forms.DecimalField(decimal_places=2, max_digits=15, min_value=0, required=False)
+    inventory_size = forms.IntegerField(min_value=0, required=False)  # empty == unlimited
+    active = forms.BooleanField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        # partial: only the fields present in data are changed (JSON rows),
+        # otherwise every field is (HTML forms leave unchecked boxes out)
+        self.partial = kwargs.pop("partial", False)
+        super(VariationUpdateForm, self).__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = ("price", "sale_price", "inventory_size", "active")
+        if self.partial:
+            return [field for field in fields if field in self.data]
+        return list(fields)
+
+    def clean(self):
+        cleaned_data = super(VariationUpdateForm, self).clean()
+        if "price" in self.get_fields() and cleaned_data.get("price") is None \
+                and "price" not in self.errors:
+            self.add_error("price", "This field is required.")
+        return cleaned_data
+
+    def get_values(self):
+        return dict((field, self.cleaned_data[field]) for field in self.get_fields())
+
+
+class VariationRepriceForm(forms.Form):
+    category = forms.ModelChoiceField(queryset=Category.objects.all())
+    percent = forms.DecimalField(decimal_places=2, max_digits=6, min_value=-100,
+                                 help_text="e.g. -10 for 10% off.")
+    field = forms.ChoiceField(choices=(("price", "Price"), ("sale_price", "Sale price")),
+                              initial="price", required=False)
+
+    def clean_field(self):
+        return self.cleaned_data.get("field") or "price"
+
+
 VariationInventoryFormSet = modelformset_factory(Variation,
                                                  form=VariationInventoryForm,
                                                  extra=0)
\ No newline at end of file
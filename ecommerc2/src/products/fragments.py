@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.template.loader import render_to_string
+
+from .listing import load_listing
+from .versions import get_catalog_cache, get_versions
+
+
+THUMBNAIL_TEMPLATE = "products/product_thumbnail.html"
+
+
+def get_fragment_timeout():
+    return getattr(settings, "PRODUCT_FRAGMENT_CACHE_TIMEOUT", 60 * 60 * 24)
+
+
+def render_thumbnails(products, price=True):
+    """
+    Thumbnail html for every product, read from the cache with one multi-get
+    (keyed by product version, see products.versions). Only the misses are
+    loaded and rendered.
+    """
+    cache = get_catalog_cache()
+    products = list(products)
+    versions = get_versions("product", [product.pk for product in products])
+    keys = dict((product.pk, "catalog:thumbnail:%s:%s:%d" % (product.pk, versions[product.pk], price))
+                for product in products)
+    fragments = cache.get_many(keys.values())
+
+    missing = [product for product in products if keys[product.pk] not in fragments]
+    if missing:
+        load_listing(missing)
+        rendered = dict((keys[product.pk], render_to_string(THUMBNAIL_TEMPLATE, {
+            "obj": product,
+            "price": "True" if price else "",
+        })) for product in missing)
+        cache.set_many(rendered, get_fragment_timeout())
+        fragments.update(rendered)
+    return [fragments[keys[product.pk]] for product in products]
@@ -0,0 +1,132 @@
+import io
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RENDITIONS = (
+    # name, max width, max height
+    ("thumbnail", 200, 200),
+    ("card", 400, 400),
+    ("hero", 1200, 600),
+)
+DEFAULT_FORMATS = ("webp", "jpeg")  # preferred first, the last one is the <img> fallback
+
+FORMATS = {
+    # name: (PIL format, extension, content type, save options)
+    "webp": ("WEBP", "webp", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "jpg", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+    "png": ("PNG", "png", "image/png", {"optimize": True}),
+}
+
+
+def get_renditions():
+    return tuple(getattr(settings, "PRODUCT_IMAGE_RENDITIONS", DEFAULT_RENDITIONS))
+
+
+def get_formats():
+    # formats the installed Pillow cannot write (e.g. built without libwebp) are skipped
+    Image.init()
+    formats = getattr(settings, "PRODUCT_IMAGE_FORMATS", DEFAULT_FORMATS)
+    return tuple(fmt for fmt in formats if FORMATS[fmt][0] in Image.SAVE)
+
+
+def rendition_path(name, rendition, fmt):
+    directory, filename = os.path.split(name)
+    base = os.path.splitext(filename)[0]
+    return "%s/renditions/%s-%s.%s" % (directory, base, rendition, FORMATS[fmt][1])
+
+
+def render_renditions(name, renditions, formats):
+    """
+    Runs in a worker process: reads the original from storage, writes every
+    rendition in every format next to it and returns their pixel sizes.
+    """
+    with default_storage.open(name) as original:
+        source = Image.open(io.BytesIO(original.read()))
+        source.load()
+    if source.mode != "RGB":
+        source = source.convert("RGB")
+
+    sizes = {}
+    for rendition, width, height in renditions:
+        image = source.copy()
+        image.thumbnail((width, height), Image.ANTIALIAS)
+        sizes[rendition] = image.size
+        for fmt in formats:
+            pil_format, _, _, options = FORMATS[fmt]
+            output = io.BytesIO()
+            image.save(output, pil_format, **options)
+            path = rendition_path(name, rendition, fmt)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            default_storage.save(path, ContentFile(output.getvalue()))
+    return {"formats": list(formats), "sizes": sizes}
+
+
+executor = None
+
+
+def get_executor():
+    global executor
+    workers = getattr(settings, "PRODUCT_IMAGE_WORKERS", 2)
+    if workers < 1:
+        return None
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    return executor
+
+
+def store_renditions(model, pk, name, renditions):
+    from .versions import bump_catalog
+
+    # only if the image was not replaced meanwhile
+    updated = model.objects.filter(pk=pk, image=name).update(renditions=json.dumps(renditions))
+    if updated:
+        product_id = model.objects.filter(pk=pk).values_list("product_id", flat=True).first()
+        bump_catalog([product_id])
+
+
+def render_inline(model, pk, name):
+    # PRODUCT_IMAGE_WORKERS = 0, in this process; a broken image must not break the save
+    try:
+        store_renditions(model, pk, name, render_renditions(name, get_renditions(), get_formats()))
+    except Exception:
+        logger.exception("Image renditions failed for %s %s (%s)", model.__name__, pk, name)
+
+
+def renditions_done(model, pk, name, future):
+    # called in the executor's management thread, off the request
+    try:
+        store_renditions(model, pk, name, future.result())
+    except Exception:
+        logger.exception("Image renditions failed for %s %s (%s)", model.__name__, pk, name)
+    finally:
+        connection.close()
+
+
+def schedule_renditions(instance):
+    """
+    Renders thumbnail / card / hero renditions of instance.image in the
+    process pool (PRODUCT_IMAGE_WORKERS, 0 renders inline) and records them
+    on instance.renditions when done. Returns the future, if any.
+    """
+    model, pk, name = type(instance), instance.pk, instance.image.name
+    if not name:
+        return None
+    pool = get_executor()
+    if pool is None:
+        render_inline(model, pk, name)
+        return None
+    future = pool.submit(render_renditions, name, get_renditions(), get_formats())
+    future.add_done_callback(lambda future: renditions_done(model, pk, name, future))
+    return future
@@ -0,0 +1,312 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .inventory import invalidate_availability
+from .models import Category, Product, Variation
+
+
+FIELDS = ("title", "description", "price", "active", "categories", "default",
+          "variation", "variation_price", "sale_price", "inventory")
+TRUE_VALUES = ("1", "true", "yes", "y", "t")
+FALSE_VALUES = ("0", "false", "no", "n", "f")
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def read_csv(stream):
+    # categories are "|" separated slugs
+    for row in csv.DictReader(stream):
+        row["categories"] = [slug for slug in (row.get("categories") or "").split("|") if slug.strip()]
+        yield row
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line  # reported as an invalid row
+
+
+READERS = {
+    "csv": read_csv,
+    "jsonl": read_jsonl,
+}
+
+
+def parse_decimal(value, field, required=False):
+    if value in (None, ""):
+        if required:
+            raise InvalidRow("%s is required" % field)
+        return None
+    try:
+        value = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise InvalidRow("%s is not a number: %r" % (field, value))
+    if not value.is_finite():
+        raise InvalidRow("%s is not a number: %r" % (field, value))
+    return value.quantize(Decimal("0.01"))
+
+
+def parse_bool(value, field):
+    if value in (None, ""):
+        return True
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in TRUE_VALUES:
+        return True
+    if str(value).strip().lower() in FALSE_VALUES:
+        return False
+    raise InvalidRow("%s is not a boolean: %r" % (field, value))
+
+
+def parse_text(value, field):
+    # JSON rows may hold numbers where text is expected, but no lists or objects
+    if value is None:
+        return ""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float, Decimal)):
+        raise InvalidRow("%s is not text: %s" % (field, repr(value)[:80]))
+    return str(value).strip()
+
+
+def parse_row(row):
+    if not isinstance(row, dict):
+        raise InvalidRow("not an object: %s" % repr(row)[:80])
+    title = parse_text(row.get("title"), "title")
+    if not title:
+        raise InvalidRow("title is required")
+    inventory = row.get("inventory")
+    try:
+        inventory = int(inventory) if inventory not in (None, "") else None
+    except (TypeError, ValueError):
+        raise InvalidRow("inventory is not an integer: %r" % inventory)
+    price = parse_decimal(row.get("price"), "price", required=True)
+    variation_price = parse_decimal(row.get("variation_price"), "variation_price")
+    categories = row.get("categories") or []
+    if not isinstance(categories, list):
+        raise InvalidRow("categories is not a list: %s" % repr(categories)[:80])
+    return {
+        "title": title[:120],
+        "description": parse_text(row.get("description"), "description") or None,
+        "price": price,
+        "active": parse_bool(row.get("active"), "active"),
+        "categories": [parse_text(slug, "categories") for slug in categories],
+        "default": parse_text(row.get("default"), "default") or None,
+        "variation": parse_text(row.get("variation"), "variation")[:120] or None,
+        "variation_price": price if variation_price is None else variation_price,
+        "sale_price": parse_decimal(row.get("sale_price"), "sale_price"),
+        "inventory": inventory,
+    }
+
+
+class CatalogImporter(object):
+    """
+    Upserts products (by title), their variations (by product and title),
+    categories (by slug) and category links chunk by chunk, with bulk
+    queries instead of per row saves. Model signals do not fire, so the
+    data they maintain (default variations, effective prices, search index,
+    memberships, versions) is rebuilt set-wise for every chunk, related
+    products and facets once at the end.
+
+    Rows of one product (one per variation) must be consecutive.
+    """
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        self.categories = {}  # slug -> id
+        self.stats = dict.fromkeys(("rows", "skipped", "products_created", "products_updated",
+                                    "variations_created", "variations_updated",
+                                    "default_variations", "categories_created"), 0)
+        self.errors = []
+        self.changed_ids = set()
+        self.left_category_ids = set()  # categories products of the chunk moved out of
+
+    def chunks(self, rows):
+        # never splits the rows of one product between chunks
+        chunk, line = [], 0
+        for line, row in enumerate(rows, 1):
+            self.stats["rows"] += 1
+            try:
+                row = parse_row(row)
+            except InvalidRow as e:
+                self.stats["skipped"] += 1
+                self.errors.append((line, str(e)))
+                continue
+            if len(chunk) >= self.chunk_size and chunk[-1]["title"] != row["title"]:
+                yield chunk
+                chunk = []
+            chunk.append(row)
+        if chunk:
+            yield chunk
+
+    def run(self, rows, progress=None):
+        for chunk in self.chunks(rows):
+            with transaction.atomic():
+                changed_ids = self.import_chunk(chunk)
+                if changed_ids:
+                    self.refresh_chunk(changed_ids)
+            self.changed_ids.update(changed_ids)
+            if progress is not None:
+                progress(self.stats)
+        self.finish()
+        return self.stats
+
+    def category_ids(self, slugs):
+        missing = set(slugs) - set(self.categories)
+        if missing:
+            self.categories.update(Category.objects.filter(
+                slug__in=missing).values_list("slug", "id"))
+            new = missing - set(self.categories)
+            if new:
+                Category.objects.bulk_create([Category(title=slug, slug=slug) for slug in new])
+                self.categories.update(Category.objects.filter(
+                    slug__in=new).values_list("slug", "id"))
+                self.stats["categories_created"] += len(new)
+        return [self.categories[slug] for slug in slugs]
+
+    def import_chunk(self, chunk):
+        products = {}  # title -> product fields, the last row wins
+        links = {}     # title -> category ids
+        slugs = set()
+        for row in chunk:
+            slugs.update(row["categories"])
+            if row["default"]:
+                slugs.add(row["default"])
+        self.category_ids(sorted(slugs))
+        for row in chunk:
+            products[row["title"]] = {
+                "description": row["description"],
+                "price": row["price"],
+                "active": row["active"],
+                "default_id": self.categories.get(row["default"]),
+            }
+            links.setdefault(row["title"], set()).update(self.category_ids(row["categories"]))
+
+        # every step returns the ids of the products it actually changed
+        ids, changed_ids = self.upsert_products(products)
+        changed_ids |= self.replace_links(
+            dict((ids[title], category_ids) for title, category_ids in links.items()))
+        changed_ids |= self.upsert_variations(
+            [(ids[row["title"]], row) for row in chunk if row["variation"]])
+        changed_ids |= self.create_default_variations(ids.values())
+        return changed_ids
+
+    def upsert_products(self, products):
+        fields = ("description", "price", "active", "default_id")
+        existing, changed_ids = {}, set()
+        rows = Product.objects.get_queryset().filter(
+            title__in=products).order_by("-id").values_list("id", "title", *fields)
+        for row in rows:
+            existing[row[1]] = row  # duplicate titles: the oldest product is updated
+
+        for title, values in products.items():
+            if title not in existing:
+                continue
+            row = existing[title]
+            if tuple(values[field] for field in fields) != row[2:]:
+                Product.objects.filter(id=row[0]).update(**values)
+                if row[5] and row[5] != values["default_id"]:
+                    self.left_category_ids.add(row[5])
+                changed_ids.add(row[0])
+                self.stats["products_updated"] += 1
+
+        new = [title for title in products if title not in existing]
+        Product.objects.bulk_create([Product(title=title, **products[title]) for title in new])
+        self.stats["products_created"] += len(new)
+
+        ids = dict((title, row[0]) for title, row in existing.items())
+        if new:
+            # bulk_create does not return ids on every backend
+            created = dict(Product.objects.get_queryset().filter(
+                title__in=new).order_by("-id").values_list("title", "id"))
+            ids.update(created)
+            changed_ids.update(created.values())
+        return ids, changed_ids
+
+    def replace_links(self, links):
+        through = Product.categories.through
+        current = {}
+        for product_id, category_id in through.objects.filter(
+                product_id__in=links).values_list("product_id", "category_id"):
+            current.setdefault(product_id, set()).add(category_id)
+        new, changed_ids = [], set()
+        for product_id, category_ids in links.items():
+            old = current.get(product_id, set())
+            if old - category_ids:
+                through.objects.filter(product_id=product_id,
+                                       category_id__in=old - category_ids).delete()
+                self.left_category_ids.update(old - category_ids)
+            new += [through(product_id=product_id, category_id=category_id)
+                    for category_id in category_ids - old]
+            if old != category_ids:
+                changed_ids.add(product_id)
+        through.objects.bulk_create(new)
+        return changed_ids
+
+    def upsert_variations(self, rows):
+        fields = ("price", "sale_price", "inventory_size")
+        existing = dict(((product_id, title), (pk, price, sale_price, inventory))
+                        for pk, product_id, title, price, sale_price, inventory
+                        in Variation.objects.filter(
+                            product_id__in=set(product_id for product_id, _ in rows)
+                        ).values_list("id", "product_id", "title", *fields))
+        new, changed_ids = {}, set()
+        for product_id, row in rows:
+            values = (row["variation_price"], row["sale_price"], row["inventory"])
+            key = (product_id, row["variation"])
+            if key in existing:
+                if values != existing[key][1:]:
+                    Variation.objects.filter(id=existing[key][0]).update(**dict(zip(fields, values)))
+                    if values[2] != existing[key][3]:
+                        invalidate_availability([existing[key][0]])
+                    changed_ids.add(product_id)
+                    self.stats["variations_updated"] += 1
+            else:
+                new[key] = Variation(product_id=product_id, title=row["variation"],
+                                     **dict(zip(fields, values)))
+        Variation.objects.bulk_create(new.values())
+        self.stats["variations_created"] += len(new)
+        return changed_ids | set(product_id for product_id, _ in new)
+
+    def create_default_variations(self, product_ids):
+        # same as product_post_save_receiver, for every product of the chunk at once
+        products = Product.objects.get_queryset().filter(
+            id__in=product_ids, variation__isnull=True).values_list("id", "price")
+        defaults = [Variation(product_id=product_id, title="Default", price=price)
+                    for product_id, price in products]
+        Variation.objects.bulk_create(defaults)
+        self.stats["default_variations"] += len(defaults)
+        return set(variation.product_id for variation in defaults)
+
+    def refresh_chunk(self, product_ids):
+        from .membership import rebuild_memberships
+        from .pricing import refresh_effective_prices
+        from .search import get_search_backend
+        from .versions import bump_catalog
+
+        refresh_effective_prices(product_ids)
+        get_search_backend().update_index(product_ids)
+        rebuild_memberships(product_ids)
+        bump_catalog(product_ids, self.left_category_ids)
+        self.left_category_ids = set()
+
+    def finish(self):
+        from .facets import rebuild_facets
+        from .related import rebuild_related
+        from .sampling import invalidate_pools
+
+        # pairs between two imported products would be recomputed by every
+        # chunk, so related products are done once, from scratch for big imports
+        if not self.changed_ids:
+            return
+        if len(self.changed_ids) * 2 > Product.objects.count():
+            rebuild_related()
+        else:
+            rebuild_related(self.changed_ids)
+        rebuild_facets()
+        invalidate_pools()
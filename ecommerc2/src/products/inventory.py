@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import Variation
+from .versions import get_catalog_cache
+
+
+UNLIMITED = -1  # cached for inventory_size None, as None is a cache miss
+
+
+def availability_key(variation_id):
+    return "products:available:%s" % variation_id
+
+
+def get_availability_timeout():
+    return getattr(settings, "PRODUCT_AVAILABILITY_CACHE_TIMEOUT", 30)
+
+
+def get_availability(variation_ids):
+    """
+    {variation id: units left, None == unlimited} from the cache, missing
+    counters are read in one query and cached for a short while.
+    """
+    variation_ids = set(variation_ids)
+    keys = dict((availability_key(pk), pk) for pk in variation_ids)
+    cache = get_catalog_cache()
+    available = dict((keys[key], value) for key, value in cache.get_many(keys).items())
+    missing = variation_ids - set(available)
+    if missing:
+        loaded = dict(Variation.objects.filter(id__in=missing).values_list("id", "inventory_size"))
+        cache.set_many(dict((availability_key(pk), UNLIMITED if size is None else size)
+                            for pk, size in loaded.items()), get_availability_timeout())
+        available.update((pk, UNLIMITED if size is None else size) for pk, size in loaded.items())
+    return dict((pk, None if value == UNLIMITED else max(value, 0))
+                for pk, value in available.items())
+
+
+def invalidate_availability(variation_ids):
+    # after commit, a reader in between would cache the old count again
+    keys = [availability_key(pk) for pk in set(variation_ids)]
+    if keys:
+        transaction.on_commit(lambda: get_catalog_cache().delete_many(keys))
+
+
+def take_stock(variation_id, quantity):
+    """
+    Decrements inventory_size by quantity if that many are left, with one
+    conditional UPDATE (no read, no lock held beyond the statement's
+    transaction). Unlimited variations always succeed. Returns success.
+    """
+    taken = Variation.objects.filter(
+        Q(inventory_size__isnull=True) | Q(inventory_size__gte=quantity), id=variation_id,
+    ).update(inventory_size=F("inventory_size") - quantity)
+    if taken:
+        invalidate_availability([variation_id])
+    return bool(taken)
+
+
+def return_stock(variation_id, quantity):
+    Variation.objects.filter(id=variation_id).update(inventory_size=F("inventory_size") + quantity)
+    invalidate_availability([variation_id])
@@ -0,0 +1,29 @@
+from django.db.models import Min
+
+from .models import ProductImage, Variation
+
+
+def first_per_product(model, product_ids):
+    # lowest id per product, the same row .first() would pick
+    first_ids = model.objects.filter(product_id__in=product_ids).values(
+        "product_id").annotate(first_id=Min("id")).values("first_id")
+    return {obj.product_id: obj for obj in model.objects.filter(id__in=first_ids)}
+
+
+def load_listing(products):
+    """
+    Loads the primary image and the lead variation for a whole page of
+    products in two queries and attaches them to the instances, where
+    Product.get_image_url and Product.get_lead_variation pick them up.
+    """
+    products = list(products)
+    product_ids = set(product.pk for product in products)
+    if not product_ids:
+        return products
+
+    images = first_per_product(ProductImage, product_ids)
+    variations = first_per_product(Variation, product_ids)
+    for product in products:
+        product._listing_image = images.get(product.pk)
+        product._lead_variation = variations.get(product.pk)
+    return products
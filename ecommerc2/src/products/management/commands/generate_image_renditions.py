@@ -0,0 +1,48 @@
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from products.images import get_executor, get_formats, get_renditions, render_renditions, store_renditions
+from products.models import ProductFeatured, ProductImage
+
+
+class Command(BaseCommand):
+    help = "Renders thumbnail / card / hero renditions for product and featured " \
+           "images which have none yet (existing media, changed PRODUCT_IMAGE_*)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", dest="all",
+                            help="Render every image again, not only the missing ones.")
+
+    def handle(self, *args, **options):
+        renditions, formats = get_renditions(), get_formats()
+        pool = get_executor()
+        jobs = {}
+        failed = 0
+        for model in (ProductImage, ProductFeatured):
+            images = model.objects.exclude(image="")
+            if not options["all"]:
+                images = images.filter(renditions="")
+            for pk, name in images.values_list("pk", "image"):
+                if pool is not None:
+                    jobs[pool.submit(render_renditions, name, renditions, formats)] = (model, pk, name)
+                    continue
+                try:
+                    store_renditions(model, pk, name, render_renditions(name, renditions, formats))
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write("%s: %s" % (name, e))
+                else:
+                    self.stdout.write(name)
+
+        for future in as_completed(jobs):
+            model, pk, name = jobs[future]
+            try:
+                store_renditions(model, pk, name, future.result())
+            except Exception as e:
+                failed += 1
+                self.stderr.write("%s: %s" % (name, e))
+            else:
+                self.stdout.write(name)
+        self.stdout.write(self.style.SUCCESS(
+            "Renditions generated in %s, %s failed." % (", ".join(formats), failed)))
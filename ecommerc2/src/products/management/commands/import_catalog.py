@@ -0,0 +1,58 @@
+import io
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import FIELDS, READERS, CatalogImporter
+
+
+class Command(BaseCommand):
+    help = "Imports products, variations and categories from a CSV or JSON lines file " \
+           "with bulk queries. Columns / keys: %s (categories are slugs, " \
+           "\"|\" separated in CSV). One row per variation, rows of a product " \
+           "consecutive." % ", ".join(FIELDS)
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, - for stdin.")
+        parser.add_argument("--format", choices=sorted(READERS), dest="format",
+                            help="Input format, by default from the file extension.")
+        parser.add_argument("--chunk-size", type=int, default=500, dest="chunk_size",
+                            help="Rows per transaction.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or path.rsplit(".", 1)[-1].lower()
+        if fmt not in READERS:
+            raise CommandError("Unknown format %r, use --format." % fmt)
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive.")
+
+        self.started = time.time()
+        importer = CatalogImporter(chunk_size=options["chunk_size"])
+        if path == "-":
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+        else:
+            try:
+                stream = open(path, encoding="utf-8", newline="")
+            except IOError as e:
+                raise CommandError(e)
+        with stream:
+            stats = importer.run(READERS[fmt](stream), progress=self.progress)
+
+        for line, error in importer.errors[:50]:
+            self.stderr.write("row %s: %s" % (line, error))
+        if len(importer.errors) > 50:
+            self.stderr.write("... %s more invalid rows" % (len(importer.errors) - 50))
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %(rows)s rows (%(skipped)s skipped): "
+            "%(products_created)s products created, %(products_updated)s updated, "
+            "%(variations_created)s variations created, %(variations_updated)s updated, "
+            "%(default_variations)s default variations, "
+            "%(categories_created)s categories created." % stats))
+
+    def progress(self, stats):
+        elapsed = max(time.time() - self.started, 0.001)
+        self.stdout.write("%s rows, %s products created, %s updated, %.0f rows/s" % (
+            stats["rows"], stats["products_created"], stats["products_updated"],
+            stats["rows"] / elapsed))
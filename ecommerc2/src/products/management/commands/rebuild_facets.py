@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.facets import rebuild_facets
+from products.models import CategoryFacet
+
+
+class Command(BaseCommand):
+    help = "Recounts category / price bucket facets from scratch " \
+           "(after migrating or changing PRODUCT_PRICE_BUCKETS)."
+
+    def handle(self, *args, **options):
+        rebuild_facets()
+        self.stdout.write(self.style.SUCCESS(
+            "Facets rebuilt, %s rows." % CategoryFacet.objects.count()))
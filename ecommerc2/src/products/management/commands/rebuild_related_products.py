@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from products.models import RelatedProduct
+from products.related import rebuild_related
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the related products table from categories and default categories."
+
+    def add_arguments(self, parser):
+        parser.add_argument("product_ids", nargs="*", type=int,
+                            help="Only rebuild pairs of these products.")
+
+    def handle(self, *args, **options):
+        product_ids = options["product_ids"] or None
+        rebuild_related(product_ids)
+        self.stdout.write(self.style.SUCCESS(
+            "Related products rebuilt, %s rows." % RelatedProduct.objects.count()))
@@ -0,0 +1,24 @@
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+
+from products.feeds import ShardWriter, get_feed_root
+
+
+class Command(BaseCommand):
+    help = ("Writes the product sitemaps and merchant feeds (XML and CSV) as gzipped shards, "
+            "only the shards whose products changed since the last run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", dest="all",
+                            help="Write every shard, changed or not (e.g. after stock only changes).")
+        parser.add_argument("--base-url", dest="base_url",
+                            help="Site URL for the links, http://<current Site domain> by default.")
+        parser.add_argument("--root", dest="root", help="Output directory, %s by default." % get_feed_root())
+
+    def handle(self, *args, **options):
+        base_url = options["base_url"] or "http://%s" % Site.objects.get_current().domain
+        writer = ShardWriter(base_url, root=options["root"])
+        written, removed = writer.run(force=options["all"],
+                                      progress=lambda shard: self.stdout.write("Wrote shard %s" % shard))
+        self.stdout.write(self.style.SUCCESS("%s shard(s) written, %s removed, in %s." % (
+            len(written), len(removed), writer.root)))
@@ -0,0 +1,50 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import CategoryMembership, Product
+
+
+def update_links(pairs, field, value):
+    """
+    Sets in_categories or is_default for (product_id, category_id) pairs,
+    creating rows on the way in and dropping rows with neither flag left.
+    """
+    by_category = defaultdict(set)
+    for product_id, category_id in pairs:
+        by_category[category_id].add(product_id)
+
+    with transaction.atomic():
+        for category_id, product_ids in by_category.items():
+            rows = CategoryMembership.objects.filter(category_id=category_id,
+                                                     product_id__in=product_ids)
+            rows.update(**{field: value})
+            if value:
+                existing = set(rows.values_list("product_id", flat=True))
+                CategoryMembership.objects.bulk_create([
+                    CategoryMembership(category_id=category_id, product_id=product_id, **{field: True})
+                    for product_id in product_ids - existing
+                ])
+            else:
+                rows.filter(in_categories=False, is_default=False).delete()
+
+
+def rebuild_memberships(product_ids=None):
+    products = Product.objects.get_queryset()
+    links = Product.categories.through.objects.all()
+    memberships = CategoryMembership.objects.all()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+        links = links.filter(product_id__in=product_ids)
+        memberships = memberships.filter(product_id__in=product_ids)
+
+    linked = set(links.values_list("product_id", "category_id").iterator())
+    defaults = set(products.filter(default__isnull=False).values_list("id", "default_id").iterator())
+    with transaction.atomic():
+        memberships.delete()
+        CategoryMembership.objects.bulk_create(
+            (CategoryMembership(product_id=product_id, category_id=category_id,
+                                in_categories=(product_id, category_id) in linked,
+                                is_default=(product_id, category_id) in defaults)
+             for product_id, category_id in linked | defaults),
+            batch_size=500)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE products_product_fts USING fts5("
+    "title, description, variations, tokenize = 'unicode61 remove_diacritics 1')",
+]
+SQLITE_DROP = [
+    "DROP TABLE IF EXISTS products_product_fts",
+]
+
+POSTGRES_CREATE = [
+    "CREATE TABLE products_productsearch ("
+    "product_id integer PRIMARY KEY, document tsvector NOT NULL)",
+    "CREATE INDEX products_productsearch_document_gin "
+    "ON products_productsearch USING GIN (document)",
+]
+POSTGRES_DROP = [
+    "DROP TABLE IF EXISTS products_productsearch",
+]
+
+
+def run_statements(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    from products.search import VENDOR_BACKENDS
+    from django.utils.module_loading import import_string
+
+    vendor = schema_editor.connection.vendor
+    run_statements(schema_editor, {
+        "sqlite": SQLITE_CREATE,
+        "postgresql": POSTGRES_CREATE,
+    })
+    if vendor in VENDOR_BACKENDS:
+        import_string(VENDOR_BACKENDS[vendor])().update_index()
+
+
+def drop_search_index(apps, schema_editor):
+    run_statements(schema_editor, {
+        "sqlite": SQLITE_DROP,
+        "postgresql": POSTGRES_DROP,
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 08:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_effective_prices(apps, schema_editor):
+    schema_editor.execute("""
+        UPDATE products_product SET
+            min_effective_price = COALESCE(
+                (SELECT MIN(COALESCE(v.sale_price, v.price)) FROM products_variation v
+                 WHERE v.product_id = products_product.id), price),
+            max_effective_price = COALESCE(
+                (SELECT MAX(COALESCE(v.sale_price, v.price)) FROM products_variation v
+                 WHERE v.product_id = products_product.id), price)
+    """)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_related_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='max_effective_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_effective_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=15),
+        ),
+        migrations.RunPython(fill_effective_prices, migrations.RunPython.noop),
+    ]
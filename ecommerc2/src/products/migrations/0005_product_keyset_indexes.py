@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 08:43
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='product',
+            index_together=set([('title', 'id'), ('min_effective_price', 'id')]),
+        ),
+    ]
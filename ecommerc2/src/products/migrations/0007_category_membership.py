@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 08:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_memberships(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    CategoryMembership = apps.get_model("products", "CategoryMembership")
+
+    linked = set(Product.categories.through.objects.values_list("product_id", "category_id"))
+    defaults = set(Product.objects.filter(default__isnull=False).values_list("id", "default_id"))
+    CategoryMembership.objects.bulk_create(
+        [CategoryMembership(product_id=product_id, category_id=category_id,
+                            in_categories=(product_id, category_id) in linked,
+                            is_default=(product_id, category_id) in defaults)
+         for product_id, category_id in linked | defaults],
+        batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_category_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryMembership',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('in_categories', models.BooleanField(default=False)),
+                ('is_default', models.BooleanField(default=False)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.Category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_memberships', to='products.Product')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='categorymembership',
+            unique_together=set([('category', 'product')]),
+        ),
+        migrations.RunPython(fill_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 08:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_category_membership'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productfeatured',
+            name='renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='renditions',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
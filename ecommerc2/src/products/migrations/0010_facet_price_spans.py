@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_updated'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='productfacet',
+            old_name='price_bucket',
+            new_name='low_bucket',
+        ),
+        migrations.AddField(
+            model_name='productfacet',
+            name='high_bucket',
+            field=models.PositiveSmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='categoryfacet',
+            name='price_bucket',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,20 @@
+import hashlib
+import math
+
+from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
+from django.utils.http import http_date, quote_etag
 from django.http import Http404
 
+from ecommerc2 import routers
+
+from .pagination import InvalidCursor, KeysetPaginator
+from .versions import get_modified, get_versions
+
 
 class StaffRequiredMixin(object):
     @classmethod
@@ -25,4 +37,137 @@ class LoginRequiredMixin(object):
 
     @method_decorator(login_required)
     def dispatch(self, request, *args, **kwargs):
-        return super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
\ No newline at end of file
+        return super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+
+class KeysetPaginationMixin(object):
+    # GET value -> order_by() fields; every entry must be backed by an index
+    # and end with a unique field so the cursor position is unambiguous
+    orderings = {"id": ("id",)}
+    default_ordering = "id"
+    search_ordering_param = "ordering"
+    cursor_param = "cursor"
+    page_size_param = "page_size"
+    page_size = 24
+    max_page_size = 96
+
+    def get_ordering_key(self):
+        ordering = self.request.GET.get(self.search_ordering_param)
+        if ordering in self.orderings:
+            return ordering
+        return self.default_ordering
+
+    def get_page_size(self):
+        try:
+            page_size = int(self.request.GET.get(self.page_size_param, self.page_size))
+        except ValueError:
+            page_size = self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_page_querystring(self, cursor):
+        params = self.request.GET.copy()
+        params[self.cursor_param] = cursor
+        return params.urlencode()
+
+    def paginate_keyset(self, queryset):
+        ordering = self.orderings[self.get_ordering_key()]
+        paginator = KeysetPaginator(queryset, ordering, self.get_page_size())
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_param))
+        except InvalidCursor:
+            raise Http404
+        if page.has_next():
+            page.next_querystring = self.get_page_querystring(page.next_cursor)
+        if page.has_previous():
+            page.previous_querystring = self.get_page_querystring(page.previous_cursor)
+        return page
+
+
+class MemoizedObjectMixin(object):
+    """
+    For detail views: get_object() hits the database once per request, no
+    matter how often dispatch / get / get_context_data ask for it, and
+    loads what the template needs along with it.
+    """
+    select_related = ()
+    prefetch_related = ()  # names or Prefetch objects
+
+    def get_queryset(self):
+        queryset = super(MemoizedObjectMixin, self).get_queryset()
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super(MemoizedObjectMixin, self).get_object(queryset)
+        if not hasattr(self, "_memoized_object"):
+            self._memoized_object = super(MemoizedObjectMixin, self).get_object()
+        return self._memoized_object
+
+
+class CatalogConditionalMixin(object):
+    """
+    Answers conditional GETs (If-None-Match / If-Modified-Since) with 304
+    from the catalog version counters (products.versions) before the view
+    runs any listing query. The ETag also covers what the page shows of the
+    viewer (user, cart badge, CSRF cookie, URL); pages with pending messages
+    are always rendered. Last-Modified knows nothing of the viewer, so it is
+    only sent (and If-Modified-Since only honoured) by views whose viewer
+    state is the URL alone.
+    """
+    send_last_modified = False
+
+    def get_catalog_scopes(self):
+        # (kind, pk) counters the page depends on
+        return [("catalog", "all")]
+
+    def get_viewer_state(self):
+        from carts.store import get_cart_item_count
+
+        request = self.request
+        return [request.get_full_path(), request.user.pk, request.is_ajax(),
+                get_cart_item_count(request),
+                request.COOKIES.get(settings.CSRF_COOKIE_NAME)]
+
+    def get_catalog_validators(self):
+        scopes = self.get_catalog_scopes()
+        kinds = {}
+        for kind, pk in scopes:
+            kinds.setdefault(kind, []).append(pk)
+        versions = {}
+        for kind, pks in kinds.items():
+            versions.update(((kind, pk), version) for pk, version in get_versions(kind, pks).items())
+        state = repr(([versions[scope] for scope in scopes], self.get_viewer_state()))
+        etag = hashlib.md5(state.encode("utf-8")).hexdigest()
+        if not self.send_last_modified:
+            return etag, None
+        last_modified = get_modified(scopes)
+        return etag, last_modified and int(math.ceil(last_modified))
+
+    def get(self, request, *args, **kwargs):
+        if len(get_messages(request)):
+            return super(CatalogConditionalMixin, self).get(request, *args, **kwargs)
+        etag, last_modified = self.get_catalog_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super(CatalogConditionalMixin, self).get(request, *args, **kwargs)
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            response["ETag"] = quote_etag(etag)
+            if last_modified:
+                response["Last-Modified"] = http_date(last_modified)
+        return response
+
+
+class ReplicaReadMixin(object):
+    """
+    Lets the GET/HEAD reads of the view (and of its template) go to
+    DATABASE_REPLICAS, see ecommerc2.routers. Only for pages where a few
+    seconds of replication lag are acceptable.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in ("GET", "HEAD"):
+            routers.state.replicas = True
+        return super(ReplicaReadMixin, self).dispatch(request, *args, **kwargs)
@@ -1,6 +1,9 @@
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models.signals import post_save
+import json
+import random
+
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.utils.safestring import mark_safe
 from django.utils.text import slugify
 
@@ -17,12 +20,13 @@ class ProductManager(models.Manager):
     def all(self, *args, **kwargs):
         return self.get_queryset().active()
 
-    def get_related(self, instance):
-        products_one = self.get_queryset().filter(categories__in=instance.categories.all())
-        products_two = self.get_queryset().filter(default=instance.default)
-        a = (products_one | products_two).exclude(id=instance.id).distinct()
-        print(a)
-        return (products_one | products_two).exclude(id=instance.id).distinct()
+    def get_related(self, instance, limit=6):
+        # the best scored first, in random order among equal scores
+        related = RelatedProduct.objects.filter(product=instance, related__active=True)
+        related = list(related.select_related("related"))
+        random.shuffle(related)
+        related.sort(key=lambda obj: -obj.score)
+        return [obj.related for obj in related[:limit]]
 
 
 class Product(models.Model):
@@ -33,21 +37,49 @@ class Product(models.Model):
     categories = models.ManyToManyField("Category", blank=True)
     default = models.ForeignKey("Category", related_name="default_category",
                                 null=True, blank=True)
+    # cheapest / most expensive variation (sale price when set), kept by signals
+    min_effective_price = models.DecimalField(decimal_places=2, max_digits=15,
+                                              default=0, db_index=True, editable=False)
+    max_effective_price = models.DecimalField(decimal_places=2, max_digits=15,
+                                              default=0, db_index=True, editable=False)
+    # also touched by products.versions.bump_catalog, sitemap and feed shards are regenerated from it
+    updated = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = ProductManager()
 
+    class Meta:
+        # keyset pagination orderings, see products.views.PRODUCT_ORDERINGS
+        index_together = [
+            ("title", "id"),
+            ("min_effective_price", "id"),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super(Product, self).__init__(*args, **kwargs)
+        self._loaded_default_id = self.__dict__.get("default_id")
+
     def __str__(self):
         return self.title
 
     def get_absolute_url(self):
         return reverse("product_detail", kwargs={"pk": self.pk})
 
+    def get_image(self):
+        if hasattr(self, "_listing_image"):  # see products.listing.load_listing
+            return self._listing_image
+        return self.productimage_set.first()
+
     def get_image_url(self):
-        img = self.productimage_set.first()
+        img = self.get_image()
         if img:
             return img.image.url
         return img # None
 
+    def get_lead_variation(self):
+        if hasattr(self, "_lead_variation"):
+            return self._lead_variation
+        return self.variation_set.first()
+
 
 class Variation(models.Model):
     product = models.ForeignKey(Product)
@@ -61,19 +93,14 @@ class Variation(models.Model):
         return self.title
 
     def get_price(self):
-        if self.sale_price is not None:
-            return self.sale_price
-        return self.price
+        from .pricing import effective_price
+
+        return effective_price(self.price, self.sale_price)
 
     def get_html_price(self):
-        if self.sale_price is not None:
-            html_text = "<small class='sale-price'>%s</small>" \
-                        " <small class='og-price'>%s</small>" \
-                        % (self.sale_price, self.price)
-        else:
-            html_text = "<small class='price'>%s</small>" % self.price
+        from .pricing import price_html
 
-        return mark_safe(html_text)
+        return mark_safe(price_html(self.price, self.sale_price))
 
     def get_absolute_url(self):
         return self.product.get_absolute_url()
@@ -103,6 +130,109 @@ def product_post_save_receiver(sender, instance, created, *args, **kwargs):
 post_save.connect(product_post_save_receiver, sender=Product)
 
 
+def search_index_receiver(sender, instance, *args, **kwargs):
+    from .search import get_search_backend
+
+    product_id = instance.pk if sender is Product else instance.product_id
+    get_search_backend().update_index([product_id])
+
+
+post_save.connect(search_index_receiver, sender=Product)
+post_delete.connect(search_index_receiver, sender=Product)
+post_save.connect(search_index_receiver, sender=Variation)
+post_delete.connect(search_index_receiver, sender=Variation)
+
+
+def effective_price_receiver(sender, instance, *args, **kwargs):
+    from .pricing import refresh_effective_prices
+
+    # also after product saves, which write back whatever prices they loaded
+    product_id = instance.pk if sender is Product else instance.product_id
+    refresh_effective_prices([product_id])
+
+
+post_save.connect(effective_price_receiver, sender=Product)
+post_save.connect(effective_price_receiver, sender=Variation)
+post_delete.connect(effective_price_receiver, sender=Variation)
+
+
+def availability_receiver(sender, instance, *args, **kwargs):
+    from .inventory import invalidate_availability
+
+    invalidate_availability([instance.pk])
+
+
+post_save.connect(availability_receiver, sender=Variation)
+post_delete.connect(availability_receiver, sender=Variation)
+
+
+class RelatedProduct(models.Model):
+    product = models.ForeignKey(Product, related_name="related_set")
+    related = models.ForeignKey(Product, related_name="+")
+    score = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("product", "related")
+        index_together = [("product", "score")]
+
+    def __str__(self):
+        return "%s -> %s" % (self.product_id, self.related_id)
+
+
+def default_category_receiver(sender, instance, created, *args, **kwargs):
+    from .membership import update_links
+    from .related import rebuild_related
+    from .versions import bump_catalog
+
+    old_default_id = instance._loaded_default_id
+    if created or instance.default_id != old_default_id:
+        rebuild_related([instance.pk])
+        if old_default_id and not created:
+            update_links([(instance.pk, old_default_id)], "is_default", False)
+            bump_catalog(category_ids=[old_default_id])  # the new one is bumped with the product
+        if instance.default_id:
+            update_links([(instance.pk, instance.default_id)], "is_default", True)
+        instance._loaded_default_id = instance.default_id
+
+
+post_save.connect(default_category_receiver, sender=Product)
+
+
+def categories_changed_receiver(sender, instance, action, reverse, pk_set, *args, **kwargs):
+    from .facets import update_category_facets
+    from .membership import update_links
+    from .related import rebuild_related
+    from .versions import bump_catalog
+
+    through = Product.categories.through
+    own_field, other_field = ("category_id", "product_id") if reverse else ("product_id", "category_id")
+    if action == "pre_clear":
+        # pk_set is not sent with clear, remember what is about to go
+        instance._changed_pks = set(through.objects.filter(
+            **{own_field: instance.pk}).values_list(other_field, flat=True))
+    elif action == "pre_remove":
+        # pk_set may name objects which were never linked
+        instance._changed_pks = set(through.objects.filter(
+            **{own_field: instance.pk, other_field + "__in": pk_set}).values_list(other_field, flat=True))
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if action != "post_add":
+        pk_set = getattr(instance, "_changed_pks", set())
+    if reverse:
+        product_ids = pk_set
+        pairs = [(pk, instance.pk) for pk in pk_set]
+    else:
+        product_ids = [instance.pk]
+        pairs = [(instance.pk, pk) for pk in pk_set]
+    rebuild_related(product_ids)
+    update_category_facets(pairs, 1 if action == "post_add" else -1)
+    update_links(pairs, "in_categories", action == "post_add")
+    bump_catalog(product_ids, [category_id for _, category_id in pairs])
+
+
+m2m_changed.connect(categories_changed_receiver, sender=Product.categories.through)
+
+
 def image_upload(instance, filename):
     title = instance.product.title
     slug = slugify(title)
@@ -111,7 +241,29 @@ def image_upload(instance, filename):
     return "products/%s/%s" % (slug, new_filename)
 
 
-class ProductImage(models.Model):
+class ImageRenditionsModel(models.Model):
+    # {"formats": [...], "sizes": {rendition: [w, h]}} once products.images rendered it
+    renditions = models.TextField(blank=True, default="", editable=False)
+
+    class Meta:
+        abstract = True
+
+    def __init__(self, *args, **kwargs):
+        super(ImageRenditionsModel, self).__init__(*args, **kwargs)
+        self._loaded_image = self.__dict__.get("image")
+
+    def get_renditions(self):
+        if self.renditions:
+            return json.loads(self.renditions)
+        return None
+
+    def get_rendition_url(self, rendition, fmt):
+        from .images import rendition_path
+
+        return self.image.storage.url(rendition_path(self.image.name, rendition, fmt))
+
+
+class ProductImage(ImageRenditionsModel):
     product = models.ForeignKey(Product)
     image = models.ImageField(upload_to=image_upload)
 
@@ -119,6 +271,23 @@ class ProductImage(models.Model):
         return self.product.title
 
 
+def product_version_receiver(sender, instance, *args, **kwargs):
+    from .versions import bump_catalog
+
+    product_id = instance.pk if sender is Product else instance.product_id
+    bump_catalog([product_id])
+
+
+post_save.connect(product_version_receiver, sender=Product)
+# before the delete as well, while its categories can still be looked up
+pre_delete.connect(product_version_receiver, sender=Product)
+post_delete.connect(product_version_receiver, sender=Product)
+post_save.connect(product_version_receiver, sender=Variation)
+post_delete.connect(product_version_receiver, sender=Variation)
+post_save.connect(product_version_receiver, sender=ProductImage)
+post_delete.connect(product_version_receiver, sender=ProductImage)
+
+
 class Category(models.Model):
     title = models.CharField(max_length=120, unique=True)
     slug = models.SlugField(unique=True)
@@ -133,6 +302,16 @@ class Category(models.Model):
         return reverse("category_detail", kwargs={"slug": self.slug})
 
 
+def category_version_receiver(sender, instance, *args, **kwargs):
+    from .versions import bump_catalog
+
+    bump_catalog(category_ids=[instance.pk])
+
+
+post_save.connect(category_version_receiver, sender=Category)
+post_delete.connect(category_version_receiver, sender=Category)
+
+
 def image_upload_to_featured(instance, filename):
     title = instance.product.title
     slug = slugify(title)
@@ -141,7 +320,7 @@ def image_upload_to_featured(instance, filename):
     return "products/%s/featured/%s" % (slug, new_filename)
 
 
-class ProductFeatured(models.Model):
+class ProductFeatured(ImageRenditionsModel):
     product = models.ForeignKey(Product)
     image = models.ImageField(upload_to=image_upload_to_featured)
     title = models.CharField(max_length=120, null=True, blank=True)
@@ -153,4 +332,103 @@ class ProductFeatured(models.Model):
     active = models.BooleanField(default=True)
 
     def __str__(self):
-        return self.product.title
\ No newline at end of file
+        return self.product.title
+
+
+def sample_pools_receiver(sender, instance, *args, **kwargs):
+    from .sampling import invalidate_pools
+
+    invalidate_pools()
+
+
+post_save.connect(sample_pools_receiver, sender=Product)
+post_delete.connect(sample_pools_receiver, sender=Product)
+post_save.connect(sample_pools_receiver, sender=ProductFeatured)
+post_delete.connect(sample_pools_receiver, sender=ProductFeatured)
+
+
+def renditions_pre_save_receiver(sender, instance, *args, **kwargs):
+    if instance.image.name != getattr(instance._loaded_image, "name", instance._loaded_image):
+        instance.renditions = ""
+
+
+def renditions_receiver(sender, instance, *args, **kwargs):
+    from .images import schedule_renditions
+
+    if not instance.renditions:
+        transaction.on_commit(lambda: schedule_renditions(instance))
+    instance._loaded_image = instance.image.name
+
+
+pre_save.connect(renditions_pre_save_receiver, sender=ProductImage)
+post_save.connect(renditions_receiver, sender=ProductImage)
+pre_save.connect(renditions_pre_save_receiver, sender=ProductFeatured)
+post_save.connect(renditions_receiver, sender=ProductFeatured)
+
+
+class CategoryMembership(models.Model):
+    # products shown on a category page, linked through Product.categories
+    # and/or having it as the default category; kept by products.membership
+    category = models.ForeignKey(Category)
+    product = models.ForeignKey(Product, related_name="category_memberships")
+    in_categories = models.BooleanField(default=False)
+    is_default = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ("category", "product")
+
+    def __str__(self):
+        return "%s - %s" % (self.category_id, self.product_id)
+
+
+class CategoryFacet(models.Model):
+    # number of active products per category and price bucket, category None
+    # holds the whole catalog, price_bucket None any price; kept by products.facets
+    category = models.ForeignKey(Category, null=True, blank=True)
+    price_bucket = models.PositiveSmallIntegerField(null=True, blank=True)
+    product_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("category", "price_bucket")
+
+    def __str__(self):
+        return "%s [%s]: %s" % (self.category_id, self.price_bucket, self.product_count)
+
+
+class ProductFacet(models.Model):
+    # price buckets a product is currently counted in (its effective price
+    # range overlaps them, see products.facets.price_span), no row == not counted
+    product = models.OneToOneField(Product, primary_key=True, related_name="facet")
+    low_bucket = models.PositiveSmallIntegerField()
+    high_bucket = models.PositiveSmallIntegerField()
+
+    def __str__(self):
+        return "%s [%s-%s]" % (self.product_id, self.low_bucket, self.high_bucket)
+
+
+def product_facets_receiver(sender, instance, *args, **kwargs):
+    from .facets import sync_product_facets
+
+    product_id = instance.pk if sender is Product else instance.product_id
+    sync_product_facets([product_id])
+
+
+# after effective_price_receiver, buckets follow the effective prices
+post_save.connect(product_facets_receiver, sender=Product)
+post_save.connect(product_facets_receiver, sender=Variation)
+post_delete.connect(product_facets_receiver, sender=Variation)
+
+
+def product_delete_facets_receiver(sender, instance, *args, **kwargs):
+    from .facets import deleting_product_ids, sync_product_facets
+
+    if kwargs["signal"] is pre_delete:
+        # categories links are removed without m2m_changed, uncount them first
+        sync_product_facets([instance.pk], removed=True)
+        deleting_product_ids().add(instance.pk)
+    else:
+        deleting_product_ids().discard(instance.pk)
+
+
+pre_delete.connect(product_delete_facets_receiver, sender=Product)
+post_delete.connect(product_delete_facets_receiver, sender=Product)
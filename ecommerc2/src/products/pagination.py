@@ -0,0 +1,121 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values, direction):
+    data = json.dumps([direction, values], cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        raise InvalidCursor(cursor)
+    if direction not in ("next", "previous") or not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(cursor)
+    if not all(isinstance(value, (str, int, float)) for value in values):
+        raise InvalidCursor(cursor)
+    return direction, values
+
+
+class KeysetPage(object):
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator(object):
+    """
+    Cursor (keyset) pagination: every page is "WHERE (sort key) > (last row)
+    ORDER BY sort key LIMIT n", so its cost does not depend on how deep into
+    the listing it is. The ordering must end with a unique field (id).
+    """
+    def __init__(self, queryset, ordering, page_size):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.page_size = page_size
+
+    @staticmethod
+    def split(field):
+        if field.startswith("-"):
+            return field[1:], True
+        return field, False
+
+    def values(self, obj):
+        # model instances or values() rows
+        if isinstance(obj, dict):
+            return [obj[self.split(field)[0]] for field in self.ordering]
+        return [getattr(obj, self.split(field)[0]) for field in self.ordering]
+
+    def seek(self, values, backwards=False):
+        # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y)
+        lookup = Q()
+        names = [self.split(field)[0] for field in self.ordering]
+        for position, field in enumerate(self.ordering):
+            descending = self.split(field)[1]
+            operator = "lt" if descending != backwards else "gt"
+            step = Q(**{"%s__%s" % (names[position], operator): values[position]})
+            for previous in range(position):
+                step &= Q(**{names[previous]: values[previous]})
+            lookup |= step
+        return lookup
+
+    def page(self, cursor=None):
+        direction, values = "next", None
+        if cursor:
+            direction, values = decode_cursor(cursor, len(self.ordering))
+
+        backwards = direction == "previous"
+        if backwards:
+            ordering = [field[1:] if field.startswith("-") else "-" + field
+                        for field in self.ordering]
+        else:
+            ordering = self.ordering
+
+        queryset = self.queryset.order_by(*ordering)
+        if values is not None:
+            try:
+                queryset = queryset.filter(self.seek(values, backwards))
+            except (ValueError, TypeError, ValidationError):
+                raise InvalidCursor(cursor)
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+
+        next_cursor = previous_cursor = None
+        if has_more or backwards:
+            next_cursor = encode_cursor(self.values(rows[-1]), "next")
+        if values is not None and (has_more or not backwards):
+            previous_cursor = encode_cursor(self.values(rows[0]), "previous")
+        return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,86 @@
+from collections import namedtuple
+from decimal import ROUND_HALF_EVEN, ROUND_HALF_UP, Decimal
+
+from django.db import connection
+
+from .models import Product, Variation
+
+
+CHUNK_SIZE = 500
+CENTS = Decimal("0.01")
+
+PriceLine = namedtuple("PriceLine", "variation_id quantity price sale_price unit_price line_total")
+
+REFRESH_SQL = """
+    UPDATE {product} SET
+        min_effective_price = COALESCE(
+            (SELECT MIN(COALESCE(v.sale_price, v.price)) FROM {variation} v
+             WHERE v.product_id = {product}.id), price),
+        max_effective_price = COALESCE(
+            (SELECT MAX(COALESCE(v.sale_price, v.price)) FROM {variation} v
+             WHERE v.product_id = {product}.id), price)
+"""
+
+
+def refresh_effective_prices(product_ids=None):
+    """
+    Recomputes Product.min/max_effective_price from the variations
+    (sale_price when set, price otherwise) with one UPDATE per chunk.
+    Products without variations fall back to their own price.
+    """
+    sql = REFRESH_SQL.format(product=Product._meta.db_table,
+                             variation=Variation._meta.db_table)
+    with connection.cursor() as cursor:
+        if product_ids is None:
+            cursor.execute(sql)
+            return
+        product_ids = list(set(product_ids))
+        for start in range(0, len(product_ids), CHUNK_SIZE):
+            chunk = product_ids[start:start + CHUNK_SIZE]
+            cursor.execute(sql + " WHERE id IN (%s)" % ", ".join(["%s"] * len(chunk)), chunk)
+
+
+def effective_price(price, sale_price):
+    if sale_price is not None:
+        return sale_price
+    return price
+
+
+def price_html(price, sale_price):
+    if sale_price is not None:
+        return "<small class='sale-price'>%s</small>" \
+               " <small class='og-price'>%s</small>" % (sale_price, price)
+    return "<small class='price'>%s</small>" % price
+
+
+def price_lines(items):
+    """
+    Prices (variation id, quantity) pairs, or bare variation ids for one
+    unit, with one query: a PriceLine per item, in order, unknown variations
+    left out. line_total is unit_price * quantity rounded to cents.
+    """
+    items = [item if isinstance(item, (tuple, list)) else (item, 1) for item in items]
+    if not items:
+        return []
+    prices = dict((pk, (price, sale_price)) for pk, price, sale_price in Variation.objects.filter(
+        id__in=set(pk for pk, _ in items)).values_list("id", "price", "sale_price"))
+    items = [(pk, quantity) for pk, quantity in items if pk in prices]
+    units = [effective_price(*prices[pk]) for pk, _ in items]
+    totals = [(unit * quantity).quantize(CENTS, ROUND_HALF_EVEN)
+              for unit, (_, quantity) in zip(units, items)]
+    return [PriceLine(pk, quantity, prices[pk][0], prices[pk][1], unit, total)
+            for (pk, quantity), unit, total in zip(items, units, totals)]
+
+
+def price_totals(subtotal, tax_percentage=0, shipping=0):
+    # cart / order totals, every amount rounded to cents the same way, half
+    # up like SQL ROUND() in carts.models.TOTALS_SQL
+    subtotal = Decimal(str(subtotal)).quantize(CENTS, ROUND_HALF_UP)
+    tax_total = (subtotal * Decimal(str(tax_percentage))).quantize(CENTS, ROUND_HALF_UP)
+    shipping = Decimal(str(shipping)).quantize(CENTS, ROUND_HALF_UP)
+    return {
+        "subtotal": subtotal,
+        "tax_total": tax_total,
+        "shipping": shipping,
+        "total": subtotal + tax_total + shipping,
+    }
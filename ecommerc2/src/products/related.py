@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Product, RelatedProduct
+
+
+CATEGORY_SCORE = 1  # per shared category
+DEFAULT_SCORE = 1   # for the same default category
+CHUNK_SIZE = 500
+
+PAIRS_SQL = """
+    SELECT a.product_id AS product_id, b.product_id AS related_id, {category_score} AS score
+    FROM {through} a
+    JOIN {through} b ON a.category_id = b.category_id AND a.product_id <> b.product_id
+    {where_categories}
+    UNION ALL
+    SELECT a.id AS product_id, b.id AS related_id, {default_score} AS score
+    FROM {product} a
+    JOIN {product} b ON a.default_id = b.default_id AND a.id <> b.id
+    {where_default}
+"""
+
+# the get_pool_size() best rows of every product of the pairs, ties by related id
+INSERT_SQL = """
+    INSERT INTO {related} (product_id, related_id, score)
+    SELECT product_id, related_id, score FROM (
+        SELECT product_id, related_id, score, ROW_NUMBER() OVER (
+            PARTITION BY product_id ORDER BY score DESC, related_id) AS position
+        FROM (
+            SELECT product_id, related_id, SUM(score) AS score FROM ({pairs}) pairs
+            GROUP BY product_id, related_id
+        ) scores
+    ) ranked
+    WHERE position <= %s
+"""
+
+REVERSE_SQL = """
+    INSERT INTO {related} (product_id, related_id, score)
+    SELECT related_id, product_id, SUM(score) FROM ({pairs}) pairs
+    WHERE related_id IN ({ids})
+    GROUP BY product_id, related_id
+"""
+
+# what REVERSE_SQL pushed out of the pools
+TRIM_SQL = """
+    DELETE FROM {related} WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY product_id ORDER BY score DESC, related_id) AS position
+            FROM {related} WHERE product_id IN ({ids})
+        ) ranked
+        WHERE position > %s
+    )
+"""
+
+
+def get_pool_size():
+    # rows kept per product, get_related picks from them
+    return getattr(settings, "RELATED_PRODUCTS_POOL_SIZE", 24)
+
+
+def pairs_sql(where_categories="", where_default=""):
+    return PAIRS_SQL.format(
+        through=Product.categories.through._meta.db_table,
+        product=Product._meta.db_table,
+        category_score=CATEGORY_SCORE,
+        default_score=DEFAULT_SCORE,
+        where_categories=where_categories,
+        where_default=where_default,
+    )
+
+
+def insert_top(cursor, product_ids):
+    # the pool of each of product_ids, from scratch
+    placeholders = ", ".join(["%s"] * len(product_ids))
+    cursor.execute(INSERT_SQL.format(
+        related=RelatedProduct._meta.db_table,
+        pairs=pairs_sql(
+            where_categories="WHERE a.product_id IN (%s)" % placeholders,
+            where_default="WHERE a.id IN (%s)" % placeholders,
+        ),
+    ), product_ids * 2 + [get_pool_size()])
+
+
+def rebuild_related(product_ids=None):
+    """
+    Recomputes RelatedProduct rows, the get_pool_size() best scored ones of
+    every product. With product_ids only the rows which involve one of
+    these products are touched, otherwise the whole table is rebuilt, a
+    chunk of products per transaction.
+    """
+    if product_ids is None:
+        RelatedProduct.objects.all().delete()
+        last_id = 0
+        while True:
+            ids = list(Product.objects.get_queryset().filter(id__gt=last_id).order_by("id").values_list(
+                "id", flat=True)[:CHUNK_SIZE])
+            if not ids:
+                return
+            with transaction.atomic(), connection.cursor() as cursor:
+                insert_top(cursor, ids)
+            last_id = ids[-1]
+
+    product_ids = list(set(product_ids))
+    for start in range(0, len(product_ids), CHUNK_SIZE):
+        rebuild_related_chunk(product_ids[start:start + CHUNK_SIZE])
+
+
+def rebuild_related_chunk(product_ids):
+    """
+    The pools of product_ids are rebuilt, and so are those which held one
+    of them (its score there may have dropped). The products newly related
+    to one of them get it in their pool only if it beats their last row.
+    """
+    table = RelatedProduct._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        affected = set(product_ids) | set(RelatedProduct.objects.filter(
+            related_id__in=product_ids).values_list("product_id", flat=True))
+        affected = list(affected)
+        for start in range(0, len(affected), CHUNK_SIZE):
+            chunk = affected[start:start + CHUNK_SIZE]
+            RelatedProduct.objects.filter(product_id__in=chunk).delete()
+            insert_top(cursor, chunk)
+
+        # related -> product, the score is symmetric
+        placeholders = ", ".join(["%s"] * len(product_ids))
+        pairs = pairs_sql(
+            where_categories="WHERE a.product_id IN (%s)" % placeholders,
+            where_default="WHERE a.id IN (%s)" % placeholders,
+        )
+        cursor.execute("SELECT DISTINCT related_id FROM (%s) pairs" % pairs, product_ids * 2)
+        others = list(set(row[0] for row in cursor.fetchall()) - set(affected))
+        for start in range(0, len(others), CHUNK_SIZE):
+            chunk = others[start:start + CHUNK_SIZE]
+            other_placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(REVERSE_SQL.format(related=table, pairs=pairs, ids=other_placeholders),
+                           product_ids * 2 + chunk)
+            cursor.execute(TRIM_SQL.format(related=table, ids=other_placeholders),
+                           chunk + [get_pool_size()])
@@ -0,0 +1,58 @@
+import random
+import time
+
+from django.conf import settings
+
+from .models import Product, ProductFeatured
+from .versions import bump_versions, get_versions
+
+
+# this process' copy of the pools, {"version", "expires", "products", "featured"}
+local_pools = {}
+
+
+def get_pool_timeout():
+    return getattr(settings, "PRODUCT_SAMPLE_POOL_TIMEOUT", 300)
+
+
+def get_pools():
+    """
+    Ids of active products and active featured banners, kept in process
+    memory for PRODUCT_SAMPLE_POOL_TIMEOUT seconds or until the catalog
+    changes (a version counter in the cache, one small read per call), so
+    sampling costs O(k) and not a transfer of the whole pool.
+    """
+    global local_pools
+    version = get_versions("pools", ["sample"])["sample"]
+    pools = local_pools
+    if pools.get("version") != version or pools["expires"] < time.time():
+        pools = {
+            "version": version,
+            "expires": time.time() + get_pool_timeout(),
+            "products": list(Product.objects.all().values_list("id", flat=True)),
+            "featured": list(ProductFeatured.objects.filter(
+                active=True, product__active=True).values_list("id", flat=True)),
+        }
+        local_pools = pools  # swapped whole, other threads see the old or the new one
+    return pools
+
+
+def invalidate_pools():
+    # every process reloads its copy on its next call
+    bump_versions("pools", ["sample"])
+
+
+def sample_products(count):
+    pool = get_pools()["products"]
+    ids = random.sample(pool, min(count, len(pool)))
+    products = Product.objects.in_bulk(ids)
+    # keep the random order, skip rows deleted since the pool was built
+    return [products[pk] for pk in ids if pk in products]
+
+
+def random_featured():
+    pool = get_pools()["featured"]
+    if not pool:
+        return None
+    return ProductFeatured.objects.select_related("product").filter(
+        id=random.choice(pool)).first()
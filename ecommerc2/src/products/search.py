@@ -0,0 +1,172 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.utils.module_loading import import_string
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query or "")[:10]
+
+
+def parse_price(query):
+    try:
+        price = Decimal(query.strip())
+    except (InvalidOperation, AttributeError):
+        return None
+    if price.is_finite():
+        return price
+    return None
+
+
+class BaseSearchBackend(object):
+    """
+    Keeps a search document (product title, description and variation
+    titles) per product and answers ranked id lookups for the product list.
+    """
+    max_results = 500
+    chunk_size = 500
+
+    def search(self, query):
+        # ranked list of product ids
+        raise NotImplementedError
+
+    def update_index(self, product_ids=None):
+        # (re)index given products, None == whole catalog
+        if product_ids is None:
+            return self.update_chunk(None)
+        product_ids = list(product_ids)
+        for start in range(0, len(product_ids), self.chunk_size):
+            self.update_chunk(product_ids[start:start + self.chunk_size])
+
+    def update_chunk(self, product_ids):
+        raise NotImplementedError
+
+    def filter_queryset(self, queryset, query):
+        ids = self.search(query)
+        price = parse_price(query)
+        if price is not None:
+            price_ids = queryset.filter(price=price).values_list("id", flat=True)
+            ids += [pk for pk in price_ids if pk not in ids]
+        if not ids:
+            return queryset.none().annotate(search_rank=Value(0, output_field=IntegerField()))
+        rank = Case(*[When(id=pk, then=pos) for pos, pk in enumerate(ids)],
+                    output_field=IntegerField())
+        return queryset.filter(id__in=ids).annotate(search_rank=rank).order_by("search_rank")
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """
+    No index at all, scans products with icontains. Used for databases
+    which have no full text search support.
+    """
+    def search(self, query):
+        from .models import Product
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        lookup = Q()
+        for token in tokens:
+            lookup &= Q(title__icontains=token) | Q(description__icontains=token)
+        qs = Product.objects.get_queryset().filter(lookup)
+        return list(qs.values_list("id", flat=True)[:self.max_results])
+
+    def update_chunk(self, product_ids):
+        pass
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    FTS5 virtual table products_product_fts, rowid == product id.
+    """
+    table = "products_product_fts"
+
+    def search(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        match = " ".join('"%s"*' % token for token in tokens)
+        sql = "SELECT rowid FROM {table} WHERE {table} MATCH %s " \
+              "ORDER BY bm25({table}, 10.0, 1.0, 4.0) LIMIT %s".format(table=self.table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match, self.max_results])
+            return [row[0] for row in cursor.fetchall()]
+
+    def update_chunk(self, product_ids):
+        where, params = "", []
+        if product_ids is not None:
+            where = " WHERE {column} IN (%s)" % ", ".join(["%s"] * len(product_ids))
+            params = product_ids
+        delete_sql = "DELETE FROM {table}".format(table=self.table) + \
+                     where.format(column="rowid")
+        insert_sql = """
+            INSERT INTO {table} (rowid, title, description, variations)
+            SELECT p.id, p.title, COALESCE(p.description, ''),
+                   COALESCE((SELECT group_concat(v.title, ' ')
+                             FROM products_variation v
+                             WHERE v.product_id = p.id), '')
+            FROM products_product p
+        """.format(table=self.table) + where.format(column="p.id")
+        with connection.cursor() as cursor:
+            cursor.execute(delete_sql, params)
+            cursor.execute(insert_sql, params)
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    products_productsearch table with a weighted tsvector per product and a
+    GIN index on it.
+    """
+    table = "products_productsearch"
+    config = "english"
+
+    def search(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        tsquery = " & ".join("%s:*" % token for token in tokens)
+        sql = "SELECT product_id FROM {table}, to_tsquery(%s, %s) query " \
+              "WHERE document @@ query " \
+              "ORDER BY ts_rank(document, query) DESC LIMIT %s".format(table=self.table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.config, tsquery, self.max_results])
+            return [row[0] for row in cursor.fetchall()]
+
+    def update_chunk(self, product_ids):
+        where, params = "", []
+        if product_ids is not None:
+            where, params = " WHERE {column} = ANY(%s)", [product_ids]
+        delete_sql = "DELETE FROM {table}".format(table=self.table) + \
+                     where.format(column="product_id")
+        insert_sql = """
+            INSERT INTO {table} (product_id, document)
+            SELECT p.id,
+                   setweight(to_tsvector(%s, p.title), 'A') ||
+                   setweight(to_tsvector(%s, COALESCE(
+                       (SELECT string_agg(v.title, ' ')
+                        FROM products_variation v
+                        WHERE v.product_id = p.id), '')), 'B') ||
+                   setweight(to_tsvector(%s, COALESCE(p.description, '')), 'C')
+            FROM products_product p
+        """.format(table=self.table) + where.format(column="p.id")
+        with connection.cursor() as cursor:
+            cursor.execute(delete_sql, params)
+            cursor.execute(insert_sql, [self.config] * 3 + params)
+
+
+VENDOR_BACKENDS = {
+    "sqlite": "products.search.SQLiteSearchBackend",
+    "postgresql": "products.search.PostgresSearchBackend",
+}
+
+
+def get_search_backend():
+    path = getattr(settings, "PRODUCT_SEARCH_BACKEND", None)
+    if path is None:
+        path = VENDOR_BACKENDS.get(connection.vendor, "products.search.SimpleSearchBackend")
+    return import_string(path)()
@@ -0,0 +1,58 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from products.fragments import render_thumbnails
+from products.images import FORMATS
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_thumbnails(products, price=True):
+    """
+    {% product_thumbnails object_list as thumbnails %}
+    {% for product, thumbnail in thumbnails %}...{{ thumbnail }}{% endfor %}
+    """
+    products = list(products)
+    return list(zip(products, [mark_safe(html) for html in render_thumbnails(products, price)]))
+
+
+def rendition_srcset(image, renditions, fmt):
+    widths = sorted((size[0], name) for name, size in renditions["sizes"].items())
+    return ", ".join("%s %sw" % (image.get_rendition_url(name, fmt), width) for width, name in widths)
+
+
+@register.simple_tag
+def rendition_url(image, rendition):
+    """
+    {% rendition_url featured_img "hero" %}, the original until rendered
+    """
+    renditions = image.get_renditions()
+    if not renditions or rendition not in renditions["sizes"]:
+        return image.image.url
+    return image.get_rendition_url(rendition, renditions["formats"][-1])
+
+
+@register.simple_tag
+def responsive_image(image, rendition, sizes="100vw", css_class="img-responsive"):
+    """
+    {% responsive_image obj_img "card" sizes="(min-width: 768px) 33vw, 100vw" %}
+    <picture> with a srcset per format (see products.images), the last format
+    being the <img> fallback. Plain <img> of the original until rendered.
+    """
+    if not image:
+        return ""
+    renditions = image.get_renditions()
+    if not renditions or rendition not in renditions["sizes"]:
+        return format_html('<img class="{}" src="{}" />', css_class, image.image.url)
+
+    *preferred, fallback = renditions["formats"]
+    sources = format_html_join("", '<source type="{}" srcset="{}" sizes="{}" />', (
+        (FORMATS[fmt][2], rendition_srcset(image, renditions, fmt), sizes) for fmt in preferred))
+    width, height = renditions["sizes"][rendition]
+    return format_html(
+        '<picture>{}<img class="{}" src="{}" srcset="{}" sizes="{}" width="{}" height="{}" /></picture>',
+        sources, css_class, image.get_rendition_url(rendition, fallback),
+        rendition_srcset(image, renditions, fallback), sizes, width, height)
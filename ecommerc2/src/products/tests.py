@@ -1,3 +1,372 @@
-from django.test import TestCase
+import io
+import json
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .api import VariationResource, export_objects
+from .bulk import CHUNK_SIZE, MAX_ROWS, refresh_products, reprice_variations, update_variations
+from .facets import facet_counts, rebuild_facets
+from .importer import CatalogImporter, read_csv, read_jsonl
+from .models import Category, CategoryFacet, Product, Variation
+from .pagination import InvalidCursor, KeysetPaginator, encode_cursor
+from .views import ProductDetailView
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        # prices repeat, so pages split runs of equal sort keys
+        for number in range(10):
+            Product.objects.create(title="Product %s" % number, price=10 + number % 3)
+        self.queryset = Product.objects.all()
+
+    def walk(self, paginator, cursor=None, direction="next"):
+        pages = []
+        while True:
+            page = paginator.page(cursor)
+            pages.append([product.id for product in page])
+            cursor = page.next_cursor if direction == "next" else page.previous_cursor
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_the_ordering_once(self):
+        ordering = ("-min_effective_price", "-id")
+        pages = self.walk(KeysetPaginator(self.queryset, ordering, 3))
+        expected = list(self.queryset.order_by(*ordering).values_list("id", flat=True))
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_previous_cursors_lead_back_to_the_first_page(self):
+        paginator = KeysetPaginator(self.queryset, ("min_effective_price", "id"), 3)
+        forward = self.walk(paginator)
+        last = paginator.page()
+        while last.has_next():
+            last = paginator.page(last.next_cursor)
+        backward = self.walk(paginator, last.previous_cursor, "previous")
+        self.assertEqual(backward, list(reversed(forward[:-1])))
+
+    def test_first_page_has_no_previous(self):
+        page = KeysetPaginator(self.queryset, ("id",), 3).page()
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+    def test_a_page_after_the_end_is_empty(self):
+        paginator = KeysetPaginator(self.queryset, ("id",), 3)
+        last_id = self.queryset.order_by("-id").values_list("id", flat=True)[0]
+        page = paginator.page(encode_cursor([last_id], "next"))
+        self.assertEqual(len(page), 0)
+        self.assertFalse(page.has_other_pages())
+
+    def test_rows_added_before_the_cursor_do_not_shift_the_next_page(self):
+        paginator = KeysetPaginator(self.queryset, ("id",), 3)
+        first = paginator.page()
+        second = [product.id for product in paginator.page(first.next_cursor)]
+        Product.objects.filter(id=first.object_list[0].id).delete()
+        self.assertEqual([product.id for product in paginator.page(first.next_cursor)], second)
+
+    def test_invalid_cursors(self):
+        paginator = KeysetPaginator(self.queryset, ("min_effective_price", "id"), 3)
+        for cursor in ("nonsense", encode_cursor([1], "next"), encode_cursor([1, 2], "sideways"),
+                       encode_cursor([[1], 2], "next"), encode_cursor(["cheap", 2], "next")):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse("product_list"), {"cursor": "nonsense"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_listing_follows_the_next_cursor(self):
+        response = self.client.get(reverse("product_list"), {"ordering": "-price", "page_size": 4})
+        page = response.context["page_obj"]
+        self.assertEqual(len(page), 4)
+        response = self.client.get(reverse("product_list") + "?" + page.next_querystring)
+        seen = [product.id for product in page] + [product.id for product in response.context["page_obj"]]
+        self.assertEqual(seen, list(self.queryset.order_by("-min_effective_price", "-id").values_list(
+            "id", flat=True)[:8]))
+
+
+class BulkUpdateTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(title="Mug", price=10)
+        self.first = self.product.variation_set.first()
+        self.second = Variation.objects.create(product=self.product, title="Large", price=20)
+
+    def values(self, variation, *fields):
+        return Variation.objects.filter(id=variation.id).values_list(*fields).get()
+
+    def test_each_row_gets_its_own_values(self):
+        applied, results = update_variations([
+            {"id": self.first.id, "price": "12.50", "inventory_size": 3},
+            {"id": self.second.id, "sale_price": "15.00", "active": False},
+        ])
+        self.assertTrue(applied)
+        self.assertEqual([result["status"] for result in results], ["updated", "updated"])
+        self.assertEqual(self.values(self.first, "price", "sale_price", "inventory_size", "active"),
+                         (Decimal("12.50"), None, 3, True))
+        self.assertEqual(self.values(self.second, "price", "sale_price", "inventory_size", "active"),
+                         (Decimal("20.00"), Decimal("15.00"), None, False))
+
+    def test_effective_prices_follow(self):
+        update_variations([{"id": self.first.id, "price": "25.00"}, {"id": self.second.id, "sale_price": "18"}])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.min_effective_price, self.product.max_effective_price),
+                         (Decimal("18.00"), Decimal("25.00")))
+
+    def test_unchanged_rows(self):
+        applied, results = update_variations([{"id": self.first.id, "price": "10.00"}])
+        self.assertTrue(applied)
+        self.assertEqual(results[0]["status"], "unchanged")
+
+    def test_one_bad_row_applies_nothing(self):
+        applied, results = update_variations([
+            {"id": self.first.id, "price": "12.50"},
+            {"id": self.second.id, "price": "-1"},
+            {"id": 0, "price": "1"},
+        ])
+        self.assertFalse(applied)
+        self.assertEqual([result["status"] for result in results], ["skipped", "invalid", "not_found"])
+        self.assertIn("price", results[1]["errors"])
+        self.assertEqual(self.values(self.first, "price"), (Decimal("10.00"),))
+
+    def test_rows_outside_of_the_queryset_are_not_found(self):
+        applied, results = update_variations([{"id": self.second.id, "price": "1"}],
+                                             queryset=Variation.objects.filter(id=self.first.id))
+        self.assertFalse(applied)
+        self.assertEqual(results[0]["status"], "not_found")
+
+    def test_too_many_rows(self):
+        with self.assertRaises(ValueError):
+            update_variations([{"id": self.first.id}] * (MAX_ROWS + 1))
+
+    def test_chunks(self):
+        variations = [Variation.objects.create(product=self.product, title=str(number), price=1)
+                      for number in range(CHUNK_SIZE + 5)]
+        applied, results = update_variations([{"id": variation.id, "inventory_size": number}
+                                              for number, variation in enumerate(variations)])
+        self.assertTrue(applied)
+        self.assertEqual(list(Variation.objects.filter(id__in=[variation.id for variation in variations]
+                                                       ).order_by("id").values_list("inventory_size", flat=True)),
+                         list(range(CHUNK_SIZE + 5)))
+
+    def test_reprice_rounds_to_cents(self):
+        Variation.objects.filter(id=self.first.id).update(price=Decimal("9.99"))
+        Variation.objects.filter(id=self.second.id).update(price=Decimal("19.99"))
+        self.assertEqual(reprice_variations(Variation.objects.filter(product=self.product), Decimal("10")), 2)
+        self.assertEqual(self.values(self.first, "price"), (Decimal("10.99"),))
+        self.assertEqual(self.values(self.second, "price"), (Decimal("21.99"),))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.min_effective_price, Decimal("10.99"))
+
+    def test_reprice_sale_prices_leaves_those_without_one(self):
+        Variation.objects.filter(id=self.second.id).update(sale_price=Decimal("16.67"))
+        updated = reprice_variations(Variation.objects.filter(product=self.product), Decimal("-15"),
+                                     field="sale_price")
+        self.assertEqual(updated, 1)
+        self.assertEqual(self.values(self.first, "sale_price"), (None,))
+        self.assertEqual(self.values(self.second, "sale_price"), (Decimal("14.17"),))
+
+
+class CatalogAPITests(TestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(title="Product %s" % number, price=10 + number)
+                         for number in range(5)]
+        for product in self.products:
+            Variation.objects.create(product=product, title="Large", price=30)
+
+    def get_json(self, url, params=None):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode("utf-8"))
+
+    def test_list_pages_follow_the_next_link(self):
+        data = self.get_json(reverse("api_product_list"), {"page_size": 3, "fields": "title"})
+        self.assertEqual(data["results"][0], {"id": self.products[0].id, "title": "Product 0"})
+        self.assertIsNone(data["previous"])
+        data = self.get_json(data["next"])
+        self.assertEqual([obj["id"] for obj in data["results"]], [product.id for product in self.products[3:]])
+        self.assertIsNone(data["next"])
+
+    def test_unknown_fields(self):
+        response = self.client.get(reverse("api_product_list"), {"fields": "title,secret"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_nested_objects_take_a_query_per_page(self):
+        url = reverse("api_product_list")
+        with self.assertNumQueries(4):  # products, categories, variations, images
+            data = self.get_json(url, {"fields": "categories,variations,images"})
+        self.assertEqual([variation["price"] for variation in data["results"][0]["variations"]],
+                         ["10.00", "30.00"])
+        self.assertNotIn("product", data["results"][0]["variations"][0])
+
+    def test_detail(self):
+        product = self.products[1]
+        data = self.get_json(reverse("api_product_detail", kwargs={"pk": product.id}), {"fields": "url"})
+        self.assertEqual(data, {"id": product.id, "url": product.get_absolute_url()})
+        response = self.client.get(reverse("api_product_detail", kwargs={"pk": 0}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_reads_every_object_in_chunks(self):
+        queryset = Variation.objects.all()
+        with self.assertNumQueries(4):  # chunks of 4, 4 and 2 rows, then an empty one
+            objects = list(export_objects(VariationResource(), queryset, ["id", "title"], chunk_size=4))
+        self.assertEqual([obj["id"] for obj in objects], list(queryset.order_by("id").values_list("id", flat=True)))
+
+    def test_export_streams_json_lines(self):
+        response = self.client.get(reverse("api_variation_export"), {"fields": "product"})
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertEqual(json.loads(lines[0]), {"id": self.products[0].variation_set.first().id,
+                                                "product": self.products[0].id})
+
+    def test_conditional_get(self):
+        url = reverse("api_category_list")
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Category.objects.create(title="Mugs", slug="mugs")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CatalogImporterTests(TestCase):
+    def run_import(self, rows, chunk_size=500):
+        importer = CatalogImporter(chunk_size=chunk_size)
+        importer.run(rows)
+        return importer
+
+    def csv_rows(self, text):
+        return list(read_csv(io.StringIO(text)))
+
+    def test_csv_import(self):
+        importer = self.run_import(self.csv_rows(
+            "title,price,categories,default,variation,variation_price,inventory\n"
+            "Mug,10,kitchen|gifts,kitchen,Small,8,5\n"
+            "Mug,10,kitchen|gifts,kitchen,Large,12,\n"
+            "Poster,5,gifts,,,,\n"))
+        self.assertEqual((importer.stats["products_created"], importer.stats["variations_created"],
+                          importer.stats["default_variations"], importer.stats["categories_created"]),
+                         (2, 2, 1, 2))
+        mug = Product.objects.get(title="Mug")
+        self.assertEqual(mug.default.slug, "kitchen")
+        self.assertEqual(set(mug.categories.values_list("slug", flat=True)), set(["kitchen", "gifts"]))
+        self.assertEqual(set(mug.variation_set.values_list("title", "price", "inventory_size")),
+                         set([("Small", Decimal("8.00"), 5), ("Large", Decimal("12.00"), None)]))
+        self.assertEqual((mug.min_effective_price, mug.max_effective_price), (Decimal("8.00"), Decimal("12.00")))
+        self.assertEqual(Product.objects.get(title="Poster").variation_set.get().title, "Default")
+
+    def test_importing_again_changes_only_what_differs(self):
+        rows = [{"title": "Mug", "price": "10", "variation": "Small", "variation_price": "8"},
+                {"title": "Cup", "price": "4"}]
+        self.run_import([dict(row) for row in rows])
+        rows[0]["variation_price"] = "9"
+        importer = self.run_import(rows)
+        self.assertEqual((importer.stats["products_created"], importer.stats["products_updated"],
+                          importer.stats["variations_updated"]), (0, 0, 1))
+        self.assertEqual(Variation.objects.get(title="Small").price, Decimal("9.00"))
+
+    def test_rows_of_a_product_stay_in_one_chunk(self):
+        importer = self.run_import([
+            {"title": "Mug", "price": "10", "variation": "Small"},
+            {"title": "Mug", "price": "10", "variation": "Large"},
+            {"title": "Cup", "price": "4"},
+        ], chunk_size=1)
+        self.assertEqual(importer.stats["products_created"], 2)
+        self.assertEqual(Product.objects.filter(title="Mug").count(), 1)
+        self.assertEqual(Variation.objects.filter(product__title="Mug").count(), 2)
+
+    def test_bad_rows_are_skipped(self):
+        lines = ['7', 'null', 'true', '"Mug"', 'not json', '{"title": ["Mug"], "price": 1}',
+                 '{"title": "Mug", "price": 1, "categories": "kitchen"}', '{"title": "Mug"}',
+                 '{"title": "Mug", "price": "cheap"}', '{"title": "Mug", "price": 1, "inventory": "lots"}',
+                 '{"title": 5, "price": 1, "description": 7}']
+        importer = self.run_import(read_jsonl(io.StringIO("\n".join(lines))))
+        self.assertEqual((importer.stats["rows"], importer.stats["skipped"]), (11, 10))
+        self.assertEqual([line for line, error in importer.errors], list(range(1, 11)))
+        self.assertEqual(Product.objects.get().title, "5")
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.mugs = Category.objects.create(title="Mugs", slug="mugs")
+        self.gifts = Category.objects.create(title="Gifts", slug="gifts")
+
+    def counts(self):
+        return dict(((category_id, bucket), count) for category_id, bucket, count in
+                    CategoryFacet.objects.exclude(product_count=0).values_list(
+                        "category_id", "price_bucket", "product_count"))
+
+    def assert_matches_a_rebuild(self):
+        counts = self.counts()
+        rebuild_facets()
+        self.assertEqual(counts, self.counts())
+
+    def test_deltas_match_a_rebuild(self):
+        mug = Product.objects.create(title="Mug", price=8)
+        mug.categories.add(self.mugs, self.gifts)
+        poster = Product.objects.create(title="Poster", price=30)
+        poster.categories.add(self.gifts)
+        self.assert_matches_a_rebuild()
+
+        Variation.objects.create(product=mug, title="Large", price=60)  # spans several buckets
+        self.assert_matches_a_rebuild()
+        mug.categories.remove(self.gifts)
+        self.assert_matches_a_rebuild()
+        poster.variation_set.update(sale_price=10)  # an UPDATE, no signal: refreshed by hand
+        refresh_products([poster.id])
+        self.assert_matches_a_rebuild()
+        poster.active = False
+        poster.save()
+        self.assert_matches_a_rebuild()
+        mug.delete()
+        self.assert_matches_a_rebuild()
+        self.assertEqual(self.counts(), {})
+
+    def test_a_price_on_an_edge_counts_in_both_buckets(self):
+        Product.objects.create(title="Mug", price=10).categories.add(self.mugs)
+        self.assertEqual(facet_counts()["prices"], [(0, 10, 1), (10, 25, 1)])
+
+    def test_several_categories_count_a_product_once(self):
+        mug = Product.objects.create(title="Mug", price=8)
+        mug.categories.add(self.mugs, self.gifts)
+        Product.objects.create(title="Poster", price=30).categories.add(self.gifts)
+        counts = facet_counts(category_ids=[self.mugs.id, self.gifts.id])
+        self.assertEqual(counts["prices"], [(0, 10, 1), (25, 50, 1)])
+        self.assertEqual(facet_counts()["categories"], {self.mugs.id: 1, self.gifts.id: 2})
+
+    def test_price_ranges_off_the_buckets_are_counted_by_query(self):
+        Product.objects.create(title="Mug", price=8).categories.add(self.mugs)
+        Product.objects.create(title="Poster", price=30).categories.add(self.mugs)
+        self.assertEqual(facet_counts(min_price=5, max_price=20)["categories"], {self.mugs.id: 1})
+        self.assertEqual(facet_counts(min_price=0, max_price=10)["categories"], {self.mugs.id: 1})
+
+
+class ProductDetailTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(title="Mug", price=10)
+
+    def get_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.product.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        return [query["sql"] for query in queries.captured_queries]
+
+    def test_the_product_is_fetched_once(self):
+        fetches = [sql for sql in self.get_queries()
+                   if sql.startswith('SELECT "%s"."id"' % Product._meta.db_table)]
+        self.assertEqual(len(fetches), 1)
+
+    def test_queries_do_not_grow_with_the_variations(self):
+        before = len(self.get_queries())
+        for number in range(3):
+            Variation.objects.create(product=self.product, title=str(number), price=12)
+        self.assertEqual(len(self.get_queries()), before)
+
+    def test_get_object_is_memoized(self):
+        view = ProductDetailView()
+        view.request = RequestFactory().get(self.product.get_absolute_url())
+        view.args, view.kwargs = (), {"pk": self.product.pk}
+        with self.assertNumQueries(3):  # the product, its variations, its images
+            obj = view.get_object()
+            self.assertIs(view.get_object(), obj)
+            self.assertEqual([variation.title for variation in obj.variation_set.all()], ["Default"])
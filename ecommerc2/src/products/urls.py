@@ -2,7 +2,9 @@ from django.conf.urls import url
 from .views import (
     ProductDetailView,
     ProductListView,
+    VariationBulkUpdateView,
     VariationListView,
+    VariationRepriceView,
 )
 
 
@@ -10,4 +12,6 @@ urlpatterns = [
     url(r'^$', ProductListView.as_view(), name='product_list'),
     url(r'^(?P<pk>\d+)/$', ProductDetailView.as_view(), name='product_detail'),
     url(r'^(?P<pk>\d+)/inventory/$', VariationListView.as_view(), name='product_inventory'),
+    url(r'^variations/bulk/$', VariationBulkUpdateView.as_view(), name='variation_bulk_update'),
+    url(r'^variations/reprice/$', VariationRepriceView.as_view(), name='variation_reprice'),
 ]
\ No newline at end of file
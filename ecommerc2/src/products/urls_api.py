@@ -0,0 +1,22 @@
+from django.conf.urls import url
+
+from .api import CategoryResource, ImageResource, ProductResource, VariationResource
+from .views import (
+    ResourceDetailView,
+    ResourceExportView,
+    ResourceListView,
+)
+
+
+urlpatterns = [
+    url(r'^products/$', ResourceListView.as_view(resource=ProductResource()), name='api_product_list'),
+    url(r'^products/export/$', ResourceExportView.as_view(resource=ProductResource()),
+        name='api_product_export'),
+    url(r'^products/(?P<pk>\d+)/$', ResourceDetailView.as_view(resource=ProductResource(), scope="product"),
+        name='api_product_detail'),
+    url(r'^variations/$', ResourceListView.as_view(resource=VariationResource()), name='api_variation_list'),
+    url(r'^variations/export/$', ResourceExportView.as_view(resource=VariationResource()),
+        name='api_variation_export'),
+    url(r'^images/$', ResourceListView.as_view(resource=ImageResource()), name='api_image_list'),
+    url(r'^categories/$', ResourceListView.as_view(resource=CategoryResource()), name='api_category_list'),
+]
@@ -0,0 +1,85 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+
+def get_catalog_cache():
+    # version counters and fragments, must be shared by every process
+    return caches[getattr(settings, "CATALOG_CACHE", "default")]
+
+
+def version_key(kind, pk):
+    return "catalog:version:%s:%s" % (kind, pk)
+
+
+def initial_version():
+    # a counter lost from the cache must not restart at a value whose
+    # fragments may still be cached, so start from the clock
+    return int(time.time() * 1000)
+
+
+def get_versions(kind, pks):
+    cache = get_catalog_cache()
+    keys = dict((pk, version_key(kind, pk)) for pk in pks)
+    found = cache.get_many(keys.values())
+    versions = {}
+    for pk, key in keys.items():
+        if key not in found:
+            cache.add(key, initial_version(), None)
+            found[key] = cache.get(key)
+        versions[pk] = found[key]
+    return versions
+
+
+def modified_key(kind, pk):
+    return "catalog:modified:%s:%s" % (kind, pk)
+
+
+def bump_versions(kind, pks):
+    cache = get_catalog_cache()
+    pks = set(pks)
+    for pk in pks:
+        key = version_key(kind, pk)
+        try:
+            cache.incr(key)
+        except ValueError:  # not in cache
+            cache.set(key, initial_version(), None)
+    now = time.time()
+    cache.set_many(dict((modified_key(kind, pk), now) for pk in pks), None)
+
+
+def get_modified(scopes):
+    """
+    Latest bump of any (kind, pk) scope as a unix timestamp; a scope whose
+    time was lost from the cache counts as modified now.
+    """
+    keys = [modified_key(kind, pk) for kind, pk in scopes]
+    found = get_catalog_cache().get_many(keys)
+    if len(found) < len(set(keys)):
+        return time.time()
+    return max(found.values()) if found else None
+
+
+def bump_catalog(product_ids=(), category_ids=()):
+    """
+    Bumps the products, their categories (CategoryMembership, so listings
+    and related products on their pages change too), the given categories
+    and the catalog as a whole. Conditional GETs of the catalog pages are
+    answered from these, see products.mixins.CatalogConditionalMixin.
+    Product.updated is touched as well, for the sitemap and feed shards.
+    """
+    from .models import CategoryMembership, Product
+
+    product_ids = list(set(product_ids))
+    category_ids = set(category_ids)
+    now = timezone.now()
+    for start in range(0, len(product_ids), 500):
+        chunk = product_ids[start:start + 500]
+        category_ids.update(CategoryMembership.objects.filter(
+            product_id__in=chunk).values_list("category_id", flat=True))
+        Product.objects.get_queryset().filter(id__in=chunk).update(updated=now)
+    bump_versions("product", product_ids)
+    bump_versions("category", category_ids)
+    bump_versions("catalog", ["all"])
@@ -1,44 +1,87 @@
+import json
+
 from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
 from django.contrib import messages
-from django.db.models import Q
-from django.http import Http404
+from django.db.models import Prefetch
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils import timezone
+from django.views.generic.base import View
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
-from .forms import ProductFilterForm, VariationInventoryFormSet
-from .mixins import LoginRequiredMixin, StaffRequiredMixin
-from .models import Category, Product, Variation
+from .api import InvalidFields, export_lines
+from .bulk import MAX_ROWS, reprice_variations, update_variations
+from .facets import bucket_bounds, facet_counts, get_bucket_edges
+from .feeds import (
+    feed_items,
+    render_feed_csv,
+    render_feed_xml,
+    render_sitemap,
+    render_sitemap_index,
+    shard_queryset,
+    shard_signatures,
+    sitemap_urls,
+)
+from .forms import ProductFilterForm, VariationInventoryFormSet, VariationRepriceForm
+from .mixins import (
+    CatalogConditionalMixin,
+    KeysetPaginationMixin,
+    LoginRequiredMixin,
+    MemoizedObjectMixin,
+    ReplicaReadMixin,
+    StaffRequiredMixin,
+)
+from .models import Category, CategoryMembership, Product, ProductImage, Variation
+from .search import get_search_backend, parse_price
+
+from django_filters import FilterSet, CharFilter, ModelMultipleChoiceFilter, NumberFilter
 
-from django_filters import FilterSet, CharFilter, NumberFilter
 
+PRODUCT_ORDERINGS = {
+    "id": ("id",),
+    "-id": ("-id",),
+    "title": ("title", "id"),
+    "-title": ("-title", "-id"),
+    "price": ("min_effective_price", "id"),
+    "-price": ("-min_effective_price", "-id"),
+}
 
-class CategoryDetailView(DetailView):
+
+class CategoryDetailView(ReplicaReadMixin, CatalogConditionalMixin, MemoizedObjectMixin, KeysetPaginationMixin, DetailView):
     model = Category
+    orderings = PRODUCT_ORDERINGS
+
+    def get_catalog_scopes(self):
+        return [("category", self.get_object().pk)]
 
     def get_context_data(self, **kwargs):
         context = super(CategoryDetailView, self).get_context_data(**kwargs)
-        obj = self.get_object()
-        product_set = obj.product_set.all()
-        default_products = obj.default_category.all()
-        products = (product_set | default_products).distinct()
-        context["products"] = products
+        # linked through categories or as default, see CategoryMembership
+        products = Product.objects.all().filter(category_memberships__category=self.object)
+        page = self.paginate_keyset(products)
+        context["products"] = page.object_list
+        context["page_obj"] = page
         return context
 
 
-class CategoryListView(ListView):
-    model = Category
-    queryset = Category.objects.all()
-    template_name = "products/product_list.html"
-
-
-class ProductDetailView(DetailView):
+class ProductDetailView(ReplicaReadMixin, CatalogConditionalMixin, MemoizedObjectMixin, DetailView):
     model = Product
+    # in id order, the first variation is the one shown without a choice
+    prefetch_related = (
+        Prefetch("variation_set", queryset=Variation.objects.order_by("id")),
+        Prefetch("productimage_set", queryset=ProductImage.objects.order_by("id")),
+    )
+
+    def get_catalog_scopes(self):
+        # related products all share a category (or the default one) with it
+        pk = self.kwargs.get("pk")
+        category_ids = CategoryMembership.objects.filter(product_id=pk).values_list("category_id", flat=True)
+        return [("product", pk)] + [("category", category_id) for category_id in sorted(category_ids)]
 
     def get_context_data(self, **kwargs):
         context = super(ProductDetailView, self).get_context_data(**kwargs)
-        instance = self.get_object()
-        context["related"] = Product.objects.get_related(instance=instance).order_by("?")[:6]
+        context["related"] = Product.objects.get_related(instance=self.object)
         return context
 
 
@@ -49,7 +92,6 @@ class VariationListView(StaffRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         context = super(VariationListView, self).get_context_data(**kwargs)
         context["formset"] = VariationInventoryFormSet(queryset=self.get_queryset())
-        pprint(context)
         return context
 
     def get_queryset(self, *args, **kwargs):
@@ -61,28 +103,89 @@ class VariationListView(StaffRequiredMixin, ListView):
         return queryset
 
     def post(self, request, *args, **kwargs):
-        formset = VariationInventoryFormSet(request.POST, request.FILES)
-        if formset.is_valid():
-            # formset.save(commit=False)
-            for form in formset:
-                new_item = form.save(commit=False)
-                if new_item.title:
-                    product_pk = self.kwargs.get("pk")
-                    product = get_object_or_404(Product, pk=product_pk)
-                    new_item.product = product
-                    new_item.save()
-
+        rows = formset_rows(request.POST)
+        if not rows:
+            raise Http404
+        applied, results = update_variations(rows, queryset=self.get_queryset(), partial=False)
+        if applied:
             messages.success(request, "Your inventory and pricing has been updated.")
             return redirect("product_list")
-        raise Http404
+        for result in results:
+            for field, errors in result["errors"].items():
+                messages.error(request, "Variation %s, %s: %s" % (result["id"], field, " ".join(errors)))
+        return redirect("product_inventory", pk=self.kwargs.get("pk"))
+
+
+def formset_rows(data, prefix="form"):
+    # the rows of a (VariationInventoryFormSet) formset POST as plain dicts
+    try:
+        total = min(int(data.get("%s-TOTAL_FORMS" % prefix, 0)), MAX_ROWS + 1)
+    except ValueError:
+        return []
+    rows = []
+    for index in range(total):
+        start = "%s-%s-" % (prefix, index)
+        rows.append(dict((key[len(start):], value) for key, value in data.items()
+                         if key.startswith(start)))
+    return rows
+
+
+def request_data(request):
+    # JSON body or form data
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body.decode("utf-8"))
+        except ValueError:
+            return None
+    return request.POST
+
+
+class VariationBulkUpdateView(StaffRequiredMixin, View):
+    """
+    POST {"variations": [{"id": 1, "price": "9.99", "inventory_size": 10}, ...]}
+    as JSON (only the given fields change) or a VariationInventoryFormSet
+    form. All or nothing, responds with a result per row.
+    """
+    def post(self, request, *args, **kwargs):
+        data = request_data(request)
+        if request.content_type == "application/json":
+            rows = data.get("variations") if isinstance(data, dict) else None
+            partial = True
+        else:
+            rows, partial = formset_rows(data), False
+        if not isinstance(rows, list) or not rows:
+            return JsonResponse({"error": "No variations given."}, status=400)
+        if len(rows) > MAX_ROWS:
+            return JsonResponse({"error": "At most %s variations per request." % MAX_ROWS}, status=400)
+        applied, results = update_variations(rows, partial=partial)
+        return JsonResponse({"applied": applied, "results": results}, status=200 if applied else 400)
+
+
+class VariationRepriceView(StaffRequiredMixin, View):
+    """
+    POST category, percent and field (price or sale_price): moves the prices
+    of every variation of the category's products at once.
+    """
+    def post(self, request, *args, **kwargs):
+        data = request_data(request)
+        form = VariationRepriceForm(data if isinstance(data, dict) else {})
+        if not form.is_valid():
+            errors = dict((field, list(messages)) for field, messages in form.errors.items())
+            return JsonResponse({"errors": errors}, status=400)
+        variations = Variation.objects.filter(
+            product__category_memberships__category=form.cleaned_data["category"])
+        updated = reprice_variations(variations, form.cleaned_data["percent"], form.cleaned_data["field"])
+        return JsonResponse({"updated": updated})
 
 
 class ProductFilter(FilterSet):
     title = CharFilter(name='title', lookup_expr='icontains', distinct=True)
     category = CharFilter(name='categories__title', lookup_expr='icontains', distinct=True)
-    category_id = CharFilter(name='categories__id', lookup_expr='icontains', distinct=True)
-    min_price = NumberFilter(name='variation__price', lookup_expr='gte', distinct=True)  # (some_price_gte=some_query)
-    max_price = NumberFilter(name='variation__price', lookup_expr='lte', distinct=True)
+    # in any of the checked categories, as the facet counts count them
+    category_id = ModelMultipleChoiceFilter(name='categories', queryset=Category.objects.all(), distinct=True)
+    # some variation costs at least min_price / at most max_price
+    min_price = NumberFilter(name='max_effective_price', lookup_expr='gte')
+    max_price = NumberFilter(name='min_effective_price', lookup_expr='lte')
 
     class Meta:
         model = Product
@@ -95,9 +198,8 @@ class ProductFilter(FilterSet):
         ]
 
 
-class FilterMixin(object):
+class FilterMixin(KeysetPaginationMixin):
     filter_class = None
-    search_ordering_param = "ordering"
 
     def get_queryset(self, *args, **kwargs):
         try:
@@ -108,44 +210,193 @@ class FilterMixin(object):
 
     def get_context_data(self, *args, **kwargs):
         context = super(FilterMixin, self).get_context_data(*args, **kwargs)
-        qs = self.get_queryset()
-
-        ordering = self.request.GET.get(self.search_ordering_param)
-        if ordering:
-            qs = qs.order_by(ordering)
+        qs = self.object_list
 
         filter_class = self.filter_class
         if filter_class:
             f = filter_class(self.request.GET, queryset=qs)
-            context["object_list"] = f.qs
+            qs = f.qs
+
+        page = self.paginate_keyset(qs)
+        context["object_list"] = page.object_list
+        context["page_obj"] = page
+        context["is_paginated"] = page.has_other_pages()
         return context
 
 
-class ProductListView(FilterMixin, ListView):
+class CategoryListView(ReplicaReadMixin, CatalogConditionalMixin, FilterMixin, ListView):
+    model = Category
+    queryset = Category.objects.all()
+    template_name = "products/product_list.html"
+    orderings = {
+        "title": ("title",),
+        "-title": ("-title",),
+    }
+    default_ordering = "title"
+
+
+class ProductListView(ReplicaReadMixin, CatalogConditionalMixin, FilterMixin, ListView):
     model = Product
     queryset = Product.objects.all()
     filter_class = ProductFilter
+    orderings = dict(PRODUCT_ORDERINGS, relevance=("search_rank", "id"))
 
     def get_context_data(self, **kwargs):
         context = super(ProductListView, self).get_context_data(**kwargs)
         context["now"] = timezone.now
         context["query"] = self.request.GET.get("q")
-        context["filter_form"] = ProductFilterForm(data=self.request.GET or None)
+        counts = self.get_facet_counts()
+        context["filter_form"] = ProductFilterForm(data=self.request.GET or None,
+                                                   category_counts=counts and counts["categories"])
+        context["price_facets"] = self.get_price_facets(counts and counts["prices"])
         return context
 
+    def get_facet_counts(self):
+        # the facet store knows nothing of search results, no counts then
+        if self.request.GET.get("q"):
+            return None
+        category_ids = [pk for pk in self.request.GET.getlist("category_id") if pk.isdigit()]
+        return facet_counts(category_ids=category_ids,
+                            min_price=parse_price(self.request.GET.get("min_price")),
+                            max_price=parse_price(self.request.GET.get("max_price")))
+
+    def get_price_facets(self, prices):
+        # prices None: every bucket, without counts
+        if prices is None:
+            prices = [bucket_bounds(bucket) + (None,) for bucket in range(len(get_bucket_edges()))]
+        price_facets = []
+        for lower, upper, count in prices:
+            params = self.request.GET.copy()
+            params.pop(self.cursor_param, None)
+            params["min_price"] = lower
+            if upper is None:
+                params.pop("max_price", None)
+            else:
+                params["max_price"] = upper
+            price_facets.append({"lower": lower, "upper": upper, "count": count,
+                                 "querystring": params.urlencode()})
+        return price_facets
+
+    def get_ordering_key(self):
+        ordering = self.request.GET.get(self.search_ordering_param)
+        if self.request.GET.get("q"):
+            # search results come ranked unless asked otherwise
+            if ordering not in self.orderings:
+                return "relevance"
+            return ordering
+        if ordering == "relevance":
+            return self.default_ordering
+        return super(ProductListView, self).get_ordering_key()
+
     def get_queryset(self, *args, **kwargs):
         qs = super(ProductListView, self).get_queryset(*args, **kwargs)
         query = self.request.GET.get("q")
         if query:
-            qs = self.model.objects.filter(
-                Q(title__icontains=query) |
-                Q(description__icontains=query)
-            )
-            try:
-                qs2 = self.model.objects.filter(
-                    Q(price=query)
-                )
-                qs = (qs | qs2).distinct()
-            except:
-                pass
-        return qs
\ No newline at end of file
+            qs = get_search_backend().filter_queryset(qs, query)
+        return qs
+
+
+class CatalogAPIMixin(ReplicaReadMixin, CatalogConditionalMixin):
+    """
+    Read-only JSON views of a products.api resource, ?fields=a,b selects
+    fields. Conditional on the catalog version, the same for every viewer.
+    """
+    resource = None
+    send_last_modified = True
+
+    def get_viewer_state(self):
+        return [self.request.get_full_path()]
+
+    def get_fields(self):
+        return self.resource.parse_fields(self.request.GET.get("fields"))
+
+    def get_queryset(self):
+        return self.resource.filter(self.resource.get_queryset(), self.request.GET)
+
+
+class BaseResourceListView(KeysetPaginationMixin, View):
+    page_size = 100
+    max_page_size = 500
+
+    def get(self, request, *args, **kwargs):
+        try:
+            fields = self.get_fields()
+        except InvalidFields as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        page = self.paginate_keyset(self.resource.values(self.get_queryset(), fields))
+        return JsonResponse({
+            "results": self.resource.serialize(page.object_list, fields),
+            "next": request.build_absolute_uri("?" + page.next_querystring) if page.has_next() else None,
+            "previous": (request.build_absolute_uri("?" + page.previous_querystring)
+                         if page.has_previous() else None),
+        })
+
+
+class ResourceListView(CatalogAPIMixin, BaseResourceListView):
+    pass
+
+
+class BaseResourceDetailView(View):
+    def get(self, request, *args, **kwargs):
+        try:
+            fields = self.get_fields()
+        except InvalidFields as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        rows = list(self.resource.values(self.get_queryset().filter(pk=kwargs["pk"]), fields))
+        if not rows:
+            raise Http404
+        return JsonResponse(self.resource.serialize(rows, fields)[0])
+
+
+class ResourceDetailView(CatalogAPIMixin, BaseResourceDetailView):
+    scope = None  # products.versions kind of the object, e.g. "product"
+
+    def get_catalog_scopes(self):
+        if self.scope:
+            return [(self.scope, self.kwargs["pk"])]
+        return super(ResourceDetailView, self).get_catalog_scopes()
+
+
+class BaseResourceExportView(View):
+    def get(self, request, *args, **kwargs):
+        try:
+            fields = self.get_fields()
+        except InvalidFields as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        response = StreamingHttpResponse(export_lines(self.resource, self.get_queryset(), fields),
+                                         content_type="application/x-ndjson")
+        response["Content-Disposition"] = "inline; filename=export.jsonl"
+        return response
+
+
+class ResourceExportView(CatalogAPIMixin, BaseResourceExportView):
+    """
+    Every object as JSON Lines, streamed in constant memory.
+    """
+
+
+class SitemapIndexView(View):
+    def get(self, request, *args, **kwargs):
+        urls = [request.build_absolute_uri(reverse("product_sitemap", kwargs={"shard": shard}))
+                for shard in sorted(shard_signatures())]
+        return StreamingHttpResponse(render_sitemap_index(urls), content_type="application/xml")
+
+
+class ProductSitemapView(View):
+    def get(self, request, *args, **kwargs):
+        urls = sitemap_urls(shard_queryset(int(kwargs["shard"])), request.build_absolute_uri("/")[:-1])
+        return StreamingHttpResponse(render_sitemap(urls), content_type="application/xml")
+
+
+class ProductFeedView(View):
+    """
+    Merchant feed of the whole catalog (an item per variation) as XML or
+    CSV, streamed; write_product_feeds writes the same in gzipped shards.
+    """
+    def get(self, request, *args, **kwargs):
+        base_url = request.build_absolute_uri("/")[:-1]
+        items = feed_items(Product.objects.all(), base_url)
+        if kwargs["format"] == "csv":
+            return StreamingHttpResponse(render_feed_csv(items), content_type="text/csv; charset=utf-8")
+        return StreamingHttpResponse(render_feed_xml(items, "Products", base_url + "/"),
+                                     content_type="application/xml")